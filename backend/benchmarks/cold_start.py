@@ -0,0 +1,102 @@
+"""
+Time to first request of a fresh worker process, with and without the warm-up at startup.
+
+Every run spawns a new Python process, as a new gunicorn worker would be, which sets Django up, serves the application
+with AppServer and issues a check-status request against the stub EC2 endpoint. The process reports how long the
+startup took (Django setup, warm-up included when enabled, and app server), how long the first request took and how
+long a second one took, once everything is loaded either way. The "cold" scenario disables WARM_UP_ENABLED.
+
+Usage, from the backend folder:
+    python -m benchmarks.cold_start --runs 5 --latency 0.02 --output cold_start.json
+"""
+import time
+
+STARTED = time.perf_counter()
+
+import argparse  # noqa: E402
+import http.client  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import statistics  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+
+from benchmarks.common import AppServer, migrate, report, setup_django, use_endpoint  # noqa: E402
+from benchmarks.stub_aws import StubEC2, StubServer  # noqa: E402
+
+SCENARIOS = (('cold', 'false'), ('warm', 'true'))
+
+
+def child(instance_id):
+    """
+    Runs in the spawned process, prints its timings as JSON
+    """
+    setup_django()
+
+    from django.conf import settings
+
+    settings.ALLOWED_HOSTS = ['127.0.0.1']
+    with AppServer() as app:
+        startup = time.perf_counter() - STARTED
+        timings = {'startup_s': startup}
+        for name in ('first_request_s', 'second_request_s'):
+            started = time.perf_counter()
+            connection = http.client.HTTPConnection(*app.address)
+            connection.request('POST', '/ec2/check-status',
+                               body=json.dumps({'client_id': 'AKIABENCHCOLDSTART', 'client_secret': 'benchmark-secret',
+                                                'instance_id': instance_id}),
+                               headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            if response.status != 200:
+                raise RuntimeError(f'check-status answered {response.status}')
+            timings[name] = time.perf_counter() - started
+    print(json.dumps(timings))
+
+
+def run_scenario(name, warm_up, endpoint_url, instance_id, runs):
+    environment = dict(os.environ, DJANGO_WARM_UP_ENABLED=warm_up, DJANGO_AWS_ENDPOINT_URL=endpoint_url)
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-m', 'benchmarks.cold_start', '--child', instance_id],
+                                         env=environment)
+        samples.append(json.loads(output.decode().strip().splitlines()[-1]))
+
+    row = {'scenario': name, 'runs': runs}
+    for column in ('startup_s', 'first_request_s', 'second_request_s'):
+        row[column] = statistics.mean(sample[column] for sample in samples)
+    row['time_to_first_request_s'] = statistics.mean(sample['startup_s'] + sample['first_request_s']
+                                                     for sample in samples)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='processes spawned per scenario')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every stub response')
+    parser.add_argument('--output', help='JSON file to store the results')
+    parser.add_argument('--child', metavar='INSTANCE_ID', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    setup_django()
+    migrate()
+
+    from core.services import AmazonService
+
+    results = []
+    with StubServer(StubEC2(latency=args.latency)) as server:
+        use_endpoint(server.endpoint_url)
+        instance_id = AmazonService.create_vm('AKIABENCHCOLDSTART', 'benchmark-secret')['InstanceId']
+        for name, warm_up in SCENARIOS:
+            results.append(run_scenario(name, warm_up, server.endpoint_url, instance_id, args.runs))
+
+    report('cold_start', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Helpers shared by the benchmarks: Django bootstrap, in-process app server, construction counters and result reporting.
+"""
+import json
+import os
+import socketserver
+import subprocess
+import sys
+import threading
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+
+def setup_django():
+    """
+    Configures Django for an offline run. The database defaults to a throwaway SQLite file so the benchmarks do not
+    need the Postgres container, any DJANGO_* variable already set in the environment wins.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config')
+    os.environ.setdefault('DJANGO_CONFIGURATION', 'Docker')
+    os.environ.setdefault('DJANGO_DATABASE_URL', 'sqlite:////tmp/aws-launchpad-benchmarks.sqlite3')
+
+    import configurations
+    configurations.setup()
+
+
+def migrate():
+    """
+    Creates the tables of the benchmark database, the instances index among them
+    """
+    from django.core.management import call_command
+
+    call_command('migrate', verbosity=0)
+
+
+def use_endpoint(endpoint_url):
+    """
+    Points every client created from now on to the given endpoint and drops the already cached wrappers
+    """
+    from django.conf import settings
+    from core.api import get_client_registry
+
+    settings.AWS_ENDPOINT_URL = endpoint_url
+    get_client_registry().clear()
+
+
+class _ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class _QuietWSGIRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AppServer(object):
+    """
+    Serves the Django application on a random local port with one thread per connection, so the benchmarks go
+    through the whole HTTP, middleware and view stack. Use it as a context manager.
+    """
+
+    def __init__(self):
+        # The application of wsgi.py, as gunicorn loads it, warm-up included
+        from wsgi import application
+
+        self._server = _ThreadingWSGIServer(('127.0.0.1', 0), _QuietWSGIRequestHandler)
+        self._server.set_app(application)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class ConstructionCounter(object):
+    """
+    Counts boto3 client and resource constructions through the botocore events emitted while building their classes
+    """
+
+    def __init__(self, *sessions):
+        self.clients = 0
+        self.resources = 0
+        self._lock = threading.Lock()
+
+        for session in sessions:
+            session.events.register('creating-client-class', self._on_client)
+            session.events.register('creating-resource-class.*.ServiceResource', self._on_resource)
+
+    def reset(self):
+        with self._lock:
+            self.clients = 0
+            self.resources = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {'client_constructions': self.clients, 'resource_constructions': self.resources}
+
+    def _on_client(self, **kwargs):
+        with self._lock:
+            self.clients += 1
+
+    def _on_resource(self, **kwargs):
+        with self._lock:
+            self.resources += 1
+
+
+def percentile(values, percentile):
+    """
+    Nearest rank percentile
+    :param values: list of numbers
+    :param percentile: between 0 and 100
+    :return: the value or None if there are no values
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(name, results, output=None):
+    """
+    Prints the results as a table and, when output is given, stores them as JSON next to the current git revision
+    :param name: of the benchmark
+    :param results: list of flat dicts, one per scenario
+    :param output: path of the JSON file to write
+    """
+    columns = []
+    for row in results:
+        columns += [column for column in row if column not in columns and not isinstance(row[column], dict)]
+
+    widths = {column: max(len(column), *(len(_format(row.get(column))) for row in results)) for column in columns}
+    print(f'# {name}')
+    print('  '.join(column.ljust(widths[column]) for column in columns))
+    for row in results:
+        print('  '.join(_format(row.get(column)).ljust(widths[column]) for column in columns))
+
+    if output:
+        with open(output, 'w') as output_file:
+            json.dump({'benchmark': name, 'revision': git_revision(), 'python': sys.version.split()[0],
+                       'results': results}, output_file, indent=2)
+        print(f'Results written to {output}')
+
+
+def _format(value):
+    if isinstance(value, float):
+        return f'{value:.4f}'
+    return '' if value is None else str(value)
@@ -0,0 +1,228 @@
+"""
+Latency, throughput, AWS calls, boto3 constructions and memory of the create, check-status and stop endpoints.
+
+The Django application is served in-process (see AppServer) against the stub EC2 endpoint, so every request goes
+through HTTP, the middlewares and the view. Each endpoint is run with 1, 10 and 100 concurrent clients, every client
+using its own credentials:
+
+- create: POST /ec2/create-vm and then polls /ec2/jobs/<id> until the launch job finishes, as the frontend does.
+- check-status: POST /ec2/check-status for an instance of the client, launched beforehand.
+- stop: POST /ec2/stop-instance, each request stopping a different instance launched beforehand.
+
+Memory is measured on a separate single client pass with tracemalloc, as the peak of memory allocated while serving
+one request once the client of the credentials is warm. Launch workers and queue are sized to the highest concurrency
+so requests are not rejected with a 503.
+
+Usage, from the backend folder:
+    python -m benchmarks.endpoints --requests 5 --latency 0.02 --output endpoints.json
+"""
+import argparse
+import http.client
+import json
+import statistics
+import threading
+import time
+import tracemalloc
+
+from benchmarks.common import AppServer, ConstructionCounter, migrate, percentile, report, setup_django, \
+    use_endpoint
+from benchmarks.stub_aws import StubEC2, StubServer
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+from core.services import AmazonService  # noqa: E402
+from core.transport import get_session  # noqa: E402
+
+CONCURRENCY = (1, 10, 100)
+JOB_POLL_INTERVAL = 0.01
+
+
+class Endpoint(object):
+    """
+    A benchmarked endpoint: prepare runs before the measures, once per client, and request issues one measured request
+    """
+    name = None
+
+    def prepare(self, credentials, requests):
+        return None
+
+    def request(self, connection, credentials, state, index):
+        raise NotImplementedError
+
+
+class CreateEndpoint(Endpoint):
+    name = 'create'
+
+    def request(self, connection, credentials, state, index):
+        job = _post(connection, '/ec2/create-vm', credentials, expected=202)
+        while job['Status'] not in ('succeeded', 'failed'):
+            time.sleep(JOB_POLL_INTERVAL)
+            job = _get(connection, f'/ec2/jobs/{job["JobId"]}')
+        if job['Status'] != 'succeeded':
+            raise RuntimeError(job['Error'])
+
+
+class CheckStatusEndpoint(Endpoint):
+    name = 'check-status'
+
+    def prepare(self, credentials, requests):
+        return AmazonService.create_vm(credentials['client_id'], credentials['client_secret'])['InstanceId']
+
+    def request(self, connection, credentials, state, index):
+        _post(connection, '/ec2/check-status', dict(credentials, instance_id=state))
+
+
+class StopEndpoint(Endpoint):
+    name = 'stop'
+
+    def prepare(self, credentials, requests):
+        return AmazonService.create_vm(credentials['client_id'], credentials['client_secret'],
+                                       count=requests)['InstanceIds']
+
+    def request(self, connection, credentials, state, index):
+        _post(connection, '/ec2/stop-instance', dict(credentials, instance_id=state[index]))
+
+
+def run_scenario(endpoint, app, stub, counter, clients, requests):
+    credentials = [{'client_id': f'AKIABENCH{endpoint.name.upper()}{clients}X{client}',
+                    'client_secret': 'benchmark-secret'} for client in range(clients)]
+    states = [endpoint.prepare(client_credentials, requests) for client_credentials in credentials]
+
+    stub.reset_counters()
+    counter.reset()
+    durations = []
+    errors = []
+    lock = threading.Lock()
+    start = threading.Barrier(clients + 1)
+
+    def client(client_index):
+        connection = http.client.HTTPConnection(*app.address)
+        start.wait()
+        for index in range(requests):
+            started = time.perf_counter()
+            try:
+                endpoint.request(connection, credentials[client_index], states[client_index], index)
+            except Exception as e:
+                connection.close()
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                durations.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = clients * requests
+    aws = stub.snapshot()
+    constructions = counter.snapshot()
+    return {
+        'endpoint': endpoint.name,
+        'clients': clients,
+        'requests': total,
+        'errors': len(errors),
+        'wall_time_s': elapsed,
+        'throughput_rps': len(durations) / elapsed if elapsed else None,
+        'mean_s': statistics.mean(durations) if durations else None,
+        'p50_s': percentile(durations, 50),
+        'p95_s': percentile(durations, 95),
+        'api_calls_per_request': aws['api_calls'] / total,
+        'clients_per_request': constructions['client_constructions'] / total,
+        'resources_per_request': constructions['resource_constructions'] / total,
+        'calls_per_action': aws['calls_per_action'],
+        'error_samples': sorted(set(errors))[:5],
+    }
+
+
+def measure_memory(endpoint, app, requests):
+    """
+    Peak of memory allocated while serving a request, in KiB, averaged over the given number of requests. A first
+    request, not measured, warms up the client of the credentials.
+    """
+    credentials = {'client_id': f'AKIABENCH{endpoint.name.upper()}MEMORY', 'client_secret': 'benchmark-secret'}
+    state = endpoint.prepare(credentials, requests + 1)
+    endpoint.request(http.client.HTTPConnection(*app.address), credentials, state, 0)
+
+    peaks = []
+    tracemalloc.start()
+    try:
+        for index in range(1, requests + 1):
+            connection = http.client.HTTPConnection(*app.address)
+            if hasattr(tracemalloc, 'reset_peak'):
+                before, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+            else:
+                # Python < 3.9, restarting the tracing resets the peak
+                tracemalloc.stop()
+                tracemalloc.start()
+                before = 0
+            endpoint.request(connection, credentials, state, index)
+            _, peak = tracemalloc.get_traced_memory()
+            connection.close()
+            peaks.append((peak - before) / 1024)
+    finally:
+        tracemalloc.stop()
+    return statistics.mean(peaks)
+
+
+def _post(connection, path, data, expected=200):
+    connection.request('POST', path, body=json.dumps(data), headers={'Content-Type': 'application/json'})
+    return _read(connection, path, expected)
+
+
+def _get(connection, path, expected=200):
+    connection.request('GET', path)
+    return _read(connection, path, expected)
+
+
+def _read(connection, path, expected):
+    response = connection.getresponse()
+    body = response.read()
+    if response.status != expected:
+        raise RuntimeError(f'{path} answered {response.status}: {body[:200]!r}')
+    # wsgiref closes the connection after every response
+    connection.close()
+    return json.loads(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5, help='requests per client')
+    parser.add_argument('--clients', type=int, nargs='+', default=CONCURRENCY, help='concurrent clients')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every stub response')
+    parser.add_argument('--endpoints', nargs='+', default=['create', 'check-status', 'stop'])
+    parser.add_argument('--output', help='JSON file to store the results')
+    args = parser.parse_args()
+
+    settings.DEBUG = False
+    settings.ALLOWED_HOSTS = ['127.0.0.1']
+    settings.EC2_LAUNCH_WORKERS = max(settings.EC2_LAUNCH_WORKERS, max(args.clients))
+    settings.EC2_LAUNCH_QUEUE_SIZE = max(settings.EC2_LAUNCH_QUEUE_SIZE, max(args.clients))
+    migrate()
+
+    endpoints = [endpoint for endpoint in (CreateEndpoint(), CheckStatusEndpoint(), StopEndpoint())
+                 if endpoint.name in args.endpoints]
+    counter = ConstructionCounter(get_session())
+
+    results = []
+    with StubServer(StubEC2(latency=args.latency)) as server, AppServer() as app:
+        use_endpoint(server.endpoint_url)
+        for endpoint in endpoints:
+            memory = measure_memory(endpoint, app, args.requests)
+            for clients in args.clients:
+                row = run_scenario(endpoint, app, server.stub, counter, clients, args.requests)
+                row['peak_kib_per_request'] = memory
+                results.append(row)
+
+    report('endpoints', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+Load test replaying, at increasing concurrency, the sessions of the frontend users against the stub EC2 endpoint.
+
+Every simulated user goes through the flow of the frontend, over HTTP against the in-process app server (see
+AppServer), with its own credentials:
+
+1. open-session: POST /ec2/session, skipped with --credentials, which sends the credentials with every request instead.
+2. create: POST /ec2/create-vm, then GET /ec2/jobs/<id> every --job-poll-interval seconds until the launch finishes.
+3. check-status: POST /ec2/check-status every --poll-interval seconds until the instance is running.
+4. stop: POST /ec2/stop-instance.
+
+Users start spread over --ramp-up seconds and a session is abandoned at its first failed request. The stub delays every
+response by --latency seconds, keeps instances pending for --transition-time seconds and, with --throttle-rate, answers
+RequestLimitExceeded over that many calls per second, as EC2 does. The backend runs with its own settings, so requests
+it sheds are reported as errors, by status code.
+
+For every concurrency there is one row per step, with the latency percentiles and error rate of its requests, and a
+"session" row with the duration of the whole sessions and the AWS calls made per session.
+
+Usage, from the backend folder:
+    python -m benchmarks.loadtest --users 10 50 100 --poll-interval 2 --transition-time 6 --output loadtest.json
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from collections import Counter
+
+from benchmarks.common import AppServer, migrate, percentile, report, setup_django, use_endpoint
+from benchmarks.stub_aws import StubEC2, StubServer
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+
+STEPS = ('open-session', 'create', 'check-status', 'stop')
+# check-status polls of a session before giving up on the instance reaching running
+MAX_STATUS_POLLS = 100
+
+
+class SessionFailed(Exception):
+    pass
+
+
+class UserSession(object):
+    """
+    One user going through the frontend flow. Every request is recorded as (step, seconds, status code), status 0
+    when the request could not be made at all.
+    """
+
+    def __init__(self, app, credentials, args):
+        self.app = app
+        self.credentials = credentials
+        self.args = args
+        self.requests = []
+        self.auth = credentials
+
+    def run(self):
+        if not self.args.credentials:
+            session = self._request('open-session', 'POST', '/ec2/session', self.credentials, expected=201)
+            self.auth = {'session': session['Session']}
+
+        job = self._request('create', 'POST', '/ec2/create-vm', self.auth, expected=202)
+        while job['Status'] not in ('succeeded', 'failed'):
+            time.sleep(self.args.job_poll_interval)
+            job = self._request('create', 'GET', f'/ec2/jobs/{job["JobId"]}')
+        if job['Status'] != 'succeeded':
+            raise SessionFailed(job['Error'])
+        instance_id = job['Result']['InstanceId']
+
+        for _ in range(MAX_STATUS_POLLS):
+            status = self._request('check-status', 'POST', '/ec2/check-status',
+                                   dict(self.auth, instance_id=instance_id))
+            if status['Raw'] == 'running':
+                break
+            time.sleep(self.args.poll_interval)
+        else:
+            raise SessionFailed(f'{instance_id} did not reach running')
+
+        self._request('stop', 'POST', '/ec2/stop-instance', dict(self.auth, instance_id=instance_id))
+
+    def _request(self, step, method, path, data=None, expected=200):
+        connection = http.client.HTTPConnection(*self.app.address, timeout=self.args.timeout)
+        started = time.perf_counter()
+        try:
+            if data is None:
+                connection.request(method, path)
+            else:
+                connection.request(method, path, body=json.dumps(data), headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self.requests.append((step, time.perf_counter() - started, 0))
+            raise SessionFailed(f'{path} failed: {e}')
+        finally:
+            connection.close()
+
+        self.requests.append((step, time.perf_counter() - started, response.status))
+        if response.status != expected:
+            raise SessionFailed(f'{path} answered {response.status}: {body[:200]!r}')
+        return json.loads(body)
+
+
+def run_scenario(app, stub, users, args):
+    sessions = [UserSession(app, {'client_id': f'AKIALOAD{users}X{user}', 'client_secret': 'benchmark-secret'}, args)
+                for user in range(users)]
+    durations = []
+    failures = []
+    lock = threading.Lock()
+
+    def user(session, delay):
+        time.sleep(delay)
+        started = time.perf_counter()
+        try:
+            session.run()
+        except SessionFailed as e:
+            with lock:
+                failures.append(str(e))
+            return
+        with lock:
+            durations.append(time.perf_counter() - started)
+
+    stub.reset_counters()
+    threads = [threading.Thread(target=user, args=(session, random.uniform(0, args.ramp_up))) for session in sessions]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    requests = [request for session in sessions for request in session.requests]
+    rows = [_step_row(users, step, [request for request in requests if request[0] == step]) for step in STEPS
+            if any(request[0] == step for request in requests)]
+
+    aws = stub.snapshot()
+    rows.append({
+        'users': users,
+        'step': 'session',
+        'requests': len(requests),
+        'errors': len(failures),
+        'error_rate': len(failures) / users,
+        'p50_s': percentile(durations, 50),
+        'p95_s': percentile(durations, 95),
+        'p99_s': percentile(durations, 99),
+        'wall_time_s': elapsed,
+        'requests_per_s': len(requests) / elapsed if elapsed else None,
+        'aws_calls_per_session': aws['api_calls'] / users,
+        'aws_throttled': aws['throttled_calls'],
+        'calls_per_action': aws['calls_per_action'],
+        'error_samples': sorted(set(failures))[:5],
+    })
+    return rows
+
+
+def _step_row(users, step, requests):
+    durations = [duration for _, duration, _ in requests]
+    statuses = Counter(status for _, _, status in requests)
+    errors = sum(count for status, count in statuses.items() if status == 0 or status >= 400)
+    return {
+        'users': users,
+        'step': step,
+        'requests': len(requests),
+        'errors': errors,
+        'error_rate': errors / len(requests),
+        'p50_s': percentile(durations, 50),
+        'p95_s': percentile(durations, 95),
+        'p99_s': percentile(durations, 99),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, nargs='+', default=[10, 50, 100], help='concurrent users, one run each')
+    parser.add_argument('--ramp-up', type=float, default=10, help='seconds over which the users start')
+    parser.add_argument('--poll-interval', type=float, default=10, help='seconds between check-status requests')
+    parser.add_argument('--job-poll-interval', type=float, default=1, help='seconds between launch job requests')
+    parser.add_argument('--credentials', action='store_true', help='send the credentials instead of opening a session')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every stub response')
+    parser.add_argument('--transition-time', type=float, default=20, help='seconds instances stay pending or stopping')
+    parser.add_argument('--throttle-rate', type=float, help='AWS calls per second the stub accepts, unlimited if unset')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds a request can take before it fails')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the ramp-up delays')
+    parser.add_argument('--output', help='JSON file to store the results')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    settings.DEBUG = False
+    settings.ALLOWED_HOSTS = ['127.0.0.1']
+    migrate()
+
+    stub = StubEC2(latency=args.latency, transition_time=args.transition_time, throttle_rate=args.throttle_rate)
+    results = []
+    with StubServer(stub) as server, AppServer() as app:
+        use_endpoint(server.endpoint_url)
+        for users in args.users:
+            results += run_scenario(app, server.stub, users, args)
+
+    report('loadtest', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
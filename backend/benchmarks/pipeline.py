@@ -0,0 +1,83 @@
+"""
+End-to-end launch latency of the LaunchPipeline with its preflight steps run one after the other or concurrently.
+
+Every launch starts cold: the lookup and permission caches are emptied and the stub has no security group, so the
+whole pipeline runs (VPC and security group lookups, permission check, AMI validation, security group creation,
+ingress and run instances). The "warm" scenario keeps the caches between launches, as repeat launches do.
+
+Usage, from the backend folder:
+    python -m benchmarks.pipeline --launches 10 --latency 0.05 --output pipeline.json
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import report, setup_django, use_endpoint
+from benchmarks.stub_aws import StubEC2, StubServer
+
+setup_django()
+
+from core.api import get_aws_client, get_lookup_cache  # noqa: E402
+from core.permissions import get_permission_cache  # noqa: E402
+from core.pipeline import LaunchPipeline, get_pipeline_executor  # noqa: E402
+
+
+def run_scenario(name, stub, executor, launches, cold=True):
+    stub.reset_counters()
+    durations = []
+    step_timings = {}
+
+    for _ in range(launches):
+        if cold:
+            get_lookup_cache().clear()
+            get_permission_cache().clear()
+            stub.security_groups.clear()
+
+        aws_client = get_aws_client('AKIABENCHMARK', 'benchmark-secret')
+        pipeline = LaunchPipeline(aws_client, executor=executor)
+
+        started = time.perf_counter()
+        pipeline.run()
+        durations.append(time.perf_counter() - started)
+
+        for step, duration in pipeline.timings.items():
+            step_timings.setdefault(step, []).append(duration)
+
+    aws = stub.snapshot()
+    return {
+        'scenario': name,
+        'launches': launches,
+        'mean_s': statistics.mean(durations),
+        'p50_s': statistics.median(durations),
+        'max_s': max(durations),
+        'api_calls_per_launch': aws['api_calls'] / launches,
+        'step_mean_s': {step: statistics.mean(timings) for step, timings in step_timings.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--launches', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every stub response')
+    parser.add_argument('--output', help='JSON file to store the results')
+    args = parser.parse_args()
+
+    with StubServer(StubEC2(latency=args.latency)) as server:
+        use_endpoint(server.endpoint_url)
+
+        with ThreadPoolExecutor(max_workers=1) as sequential:
+            results = [
+                run_scenario('sequential', server.stub, sequential, args.launches),
+                run_scenario('concurrent', server.stub, get_pipeline_executor(), args.launches),
+                run_scenario('warm', server.stub, get_pipeline_executor(), args.launches, cold=False),
+            ]
+
+    report('pipeline', results, args.output)
+    for row in results:
+        print(f'{row["scenario"]}: ' + ', '.join(f'{step} {duration:.4f}s'
+                                                 for step, duration in row['step_mean_s'].items()))
+
+
+if __name__ == '__main__':
+    main()
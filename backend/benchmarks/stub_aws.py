@@ -0,0 +1,466 @@
+"""
+Minimal in-process stand-in for the EC2 query API, used by the benchmarks.
+
+It speaks just enough of the protocol, STS GetCallerIdentity included, for botocore to parse the responses of the calls
+the backend makes, keeps a tiny amount of state (VPC, security groups and instances) and counts everything it receives:
+API calls per action, DryRun calls and accepted TCP connections. Every response can be delayed to emulate the latency of
+the real endpoint, and calls over a request rate can be throttled with RequestLimitExceeded as EC2 does.
+"""
+import re
+import threading
+import time
+from collections import Counter
+from fnmatch import fnmatchcase
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from uuid import uuid4
+
+NAMESPACE = 'http://ec2.amazonaws.com/doc/2016-11-15/'
+STS_NAMESPACE = 'https://sts.amazonaws.com/doc/2011-06-15/'
+ACCOUNT_ID = '000000000000'
+VPC_ID = 'vpc-0stub0000000000'
+AVAILABILITY_ZONE = 'eu-west-1a'
+
+# Public images returned by DescribeImages when looking them up by owner, (id, name, creation date)
+PUBLIC_IMAGES = (
+    ('ami-0stubwordpress0001', 'bitnami-wordpress-5.2.4-0-linux-debian-9-x86_64-hvm-ebs', '2019-10-15T10:00:00.000Z'),
+    ('ami-0stubwordpress0002', 'bitnami-wordpress-5.3.0-0-linux-debian-9-x86_64-hvm-ebs', '2019-11-13T10:00:00.000Z'),
+    ('ami-0stubwordpress0003', 'bitnami-wordpressmultisite-5.3.0-0-linux-debian-9-x86_64-hvm-ebs',
+     '2019-11-20T10:00:00.000Z'),
+)
+
+STATES = {
+    'pending': 0,
+    'running': 16,
+    'shutting-down': 32,
+    'terminated': 48,
+    'stopping': 64,
+    'stopped': 80,
+}
+
+
+class StubInstance(object):
+
+    def __init__(self, instance_id, image_id, instance_type, security_group_ids, tags, transition_time):
+        self.instance_id = instance_id
+        self.image_id = image_id
+        self.instance_type = instance_type
+        self.security_group_ids = security_group_ids
+        self.tags = tags
+        self.transition_time = transition_time
+        self._state = 'pending'
+        self._target = 'running'
+        self._changed_at = time.monotonic()
+
+    @property
+    def state(self):
+        if self._target and time.monotonic() - self._changed_at >= self.transition_time:
+            self._state, self._target = self._target, None
+        return self._state
+
+    def transition(self, intermediate, target):
+        previous = self.state
+        if previous == target or previous == 'terminated':
+            return previous, previous
+        self._state, self._target, self._changed_at = intermediate, target, time.monotonic()
+        return previous, intermediate
+
+
+class StubEC2(object):
+    """
+    State and counters of the stub, shared by every connection of the server.
+    :param latency: seconds every response is delayed
+    :param transition_time: seconds an instance stays in pending/stopping before reaching the final state
+    :param throttle_rate: calls per second accepted, with a burst of as many calls, the rest get RequestLimitExceeded
+    :param invalid_access_keys: access key ids STS GetCallerIdentity rejects as invalid
+    """
+
+    def __init__(self, latency=0.0, transition_time=0.0, throttle_rate=None, invalid_access_keys=()):
+        self.latency = latency
+        self.transition_time = transition_time
+        self.throttle_rate = throttle_rate
+        self.invalid_access_keys = set(invalid_access_keys)
+
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.dry_run_calls = Counter()
+        self.throttled_calls = Counter()
+        self.connections = 0
+        self._tokens = throttle_rate or 0
+        self._refilled_at = time.monotonic()
+
+        self.security_groups = {}
+        self.instances = {}
+        self.client_tokens = {}
+        self.client_token_params = {}
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls.clear()
+            self.dry_run_calls.clear()
+            self.throttled_calls.clear()
+            self.connections = 0
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'api_calls': sum(self.calls.values()),
+                'dry_run_calls': sum(self.dry_run_calls.values()),
+                'throttled_calls': sum(self.throttled_calls.values()),
+                'connections': self.connections,
+                'calls_per_action': dict(self.calls),
+            }
+
+    def handle(self, params, access_key=None):
+        action = params.get('Action', '')
+        dry_run = params.get('DryRun') == 'true'
+
+        with self.lock:
+            self.calls[action] += 1
+            if dry_run:
+                self.dry_run_calls[action] += 1
+            throttled = self._throttled()
+            if throttled:
+                self.throttled_calls[action] += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if throttled:
+            return 503, _error('RequestLimitExceeded', 'Request limit exceeded.')
+
+        if dry_run:
+            return 412, _error('DryRunOperation', 'Request would have succeeded, but DryRun flag is set.')
+
+        if action == 'GetCallerIdentity':
+            return self._get_caller_identity(access_key)
+
+        handler = getattr(self, f'_{action}', None)
+        if handler is None:
+            return 400, _error('InvalidAction', f'The action {action} is not valid for this web service.')
+
+        with self.lock:
+            return handler(params)
+
+    def _get_caller_identity(self, access_key):
+        if access_key in self.invalid_access_keys:
+            return 403, (f'<?xml version="1.0" encoding="UTF-8"?><ErrorResponse xmlns="{STS_NAMESPACE}"><Error>'
+                         f'<Type>Sender</Type><Code>InvalidClientTokenId</Code>'
+                         f'<Message>The security token included in the request is invalid.</Message></Error>'
+                         f'<RequestId>{uuid4()}</RequestId></ErrorResponse>')
+        return 200, (f'<?xml version="1.0" encoding="UTF-8"?><GetCallerIdentityResponse xmlns="{STS_NAMESPACE}">'
+                     f'<GetCallerIdentityResult><Arn>arn:aws:iam::{ACCOUNT_ID}:user/{access_key}</Arn>'
+                     f'<UserId>{access_key}</UserId><Account>{ACCOUNT_ID}</Account></GetCallerIdentityResult>'
+                     f'<ResponseMetadata><RequestId>{uuid4()}</RequestId></ResponseMetadata>'
+                     f'</GetCallerIdentityResponse>')
+
+    def _throttled(self):
+        if not self.throttle_rate:
+            return False
+        now = time.monotonic()
+        self._tokens = min(self.throttle_rate, self._tokens + (now - self._refilled_at) * self.throttle_rate)
+        self._refilled_at = now
+        if self._tokens < 1:
+            return True
+        self._tokens -= 1
+        return False
+
+    def _DescribeVpcs(self, params):
+        return 200, _response('DescribeVpcs', f'''
+            <vpcSet><item>
+                <vpcId>{VPC_ID}</vpcId><state>available</state><cidrBlock>172.31.0.0/16</cidrBlock>
+                <isDefault>true</isDefault>
+            </item></vpcSet>''')
+
+    def _DescribeSecurityGroups(self, params):
+        names = set(_filter_values(params, 'group-name'))
+        group_ids = set(_indexed(params, 'GroupId'))
+        groups = [group for group in self.security_groups.values()
+                  if (not names or _matches_any(group['name'], names))
+                  and (not group_ids or group['id'] in group_ids)]
+        items = ''.join(_security_group_xml(group) for group in groups)
+        return 200, _response('DescribeSecurityGroups', f'<securityGroupInfo>{items}</securityGroupInfo>')
+
+    def _CreateSecurityGroup(self, params):
+        name = params.get('GroupName', '')
+        if any(group['name'] == name for group in self.security_groups.values()):
+            return 400, _error('InvalidGroup.Duplicate', f"The security group '{name}' already exists")
+
+        group_id = f'sg-{uuid4().hex[:17]}'
+        self.security_groups[group_id] = {
+            'id': group_id,
+            'name': name,
+            'description': params.get('GroupDescription', ''),
+            'vpc_id': params.get('VpcId', VPC_ID),
+            'permissions': [],
+        }
+        return 200, _response('CreateSecurityGroup', f'<return>true</return><groupId>{group_id}</groupId>')
+
+    def _AuthorizeSecurityGroupIngress(self, params):
+        group = self.security_groups.get(params.get('GroupId', ''))
+        if group is None:
+            return 400, _error('InvalidGroup.NotFound', f"The security group '{params.get('GroupId')}' does not exist")
+
+        index = 1
+        while f'IpPermissions.{index}.IpProtocol' in params:
+            prefix = f'IpPermissions.{index}.'
+            group['permissions'].append({
+                'protocol': params[prefix + 'IpProtocol'],
+                'from_port': params.get(prefix + 'FromPort'),
+                'to_port': params.get(prefix + 'ToPort'),
+                'cidrs': _indexed(params, prefix + 'IpRanges', 'CidrIp'),
+            })
+            index += 1
+        return 200, _response('AuthorizeSecurityGroupIngress', '<return>true</return>')
+
+    def _RunInstances(self, params):
+        security_group_ids = _indexed(params, 'SecurityGroupId')
+        # A ClientToken is bound to the parameters of the first call using it, even if that call failed
+        client_token = params.get('ClientToken')
+        signature = sorted((key, value) for key, value in params.items() if key != 'ClientToken')
+        if client_token and self.client_token_params.setdefault(client_token, signature) != signature:
+            return 400, _error('IdempotentParameterMismatch',
+                               f"The client token '{client_token}' was already used with other parameters")
+
+        for group_id in security_group_ids:
+            if group_id not in self.security_groups:
+                return 400, _error('InvalidGroup.NotFound', f"The security group '{group_id}' does not exist")
+
+        # Calls repeated with the same ClientToken return the instances of the first one
+        if client_token in self.client_tokens:
+            launched = [self.instances[instance_id] for instance_id in self.client_tokens[client_token]]
+        else:
+            count = int(params.get('MaxCount', 1))
+            tags = _tags(params)
+            launched = []
+            for _ in range(count):
+                instance = StubInstance(f'i-{uuid4().hex[:17]}', params.get('ImageId', ''),
+                                        params.get('InstanceType', 'm1.small'), security_group_ids, tags,
+                                        self.transition_time)
+                self.instances[instance.instance_id] = instance
+                launched.append(instance)
+            if client_token:
+                self.client_tokens[client_token] = [instance.instance_id for instance in launched]
+
+        items = ''.join(_instance_xml(instance) for instance in launched)
+        return 200, _response('RunInstances', f'''
+            <reservationId>r-{uuid4().hex[:17]}</reservationId><ownerId>000000000000</ownerId>
+            <instancesSet>{items}</instancesSet>''')
+
+    def _DescribeInstances(self, params):
+        instance_ids = set(_indexed(params, 'InstanceId')) | set(_filter_values(params, 'instance-id'))
+        states = set(_filter_values(params, 'instance-state-name'))
+        types = set(_filter_values(params, 'instance-type'))
+
+        if _indexed(params, 'InstanceId'):
+            missing = [instance_id for instance_id in _indexed(params, 'InstanceId')
+                       if instance_id not in self.instances]
+            if missing:
+                return 400, _error('InvalidInstanceID.NotFound',
+                                   f"The instance IDs '{', '.join(missing)}' do not exist")
+
+        instances = [instance for instance in self.instances.values()
+                     if (not instance_ids or instance.instance_id in instance_ids)
+                     and (not states or instance.state in states)
+                     and (not types or instance.instance_type in types)
+                     and _tags_match(instance, params)]
+
+        page_size = int(params.get('MaxResults', 1000))
+        start = int(params.get('NextToken', 0) or 0)
+        page = instances[start:start + page_size]
+        next_token = f'<nextToken>{start + page_size}</nextToken>' if start + page_size < len(instances) else ''
+
+        reservations = ''.join(f'''
+            <item><reservationId>r-{instance.instance_id[2:]}</reservationId><ownerId>000000000000</ownerId>
+            <instancesSet>{_instance_xml(instance)}</instancesSet></item>''' for instance in page)
+        return 200, _response('DescribeInstances', f'<reservationSet>{reservations}</reservationSet>{next_token}')
+
+    def _DescribeImages(self, params):
+        image_ids = _indexed(params, 'ImageId')
+        if image_ids:
+            images = [(image_id, 'bitnami-wordpress-stub', '2019-11-01T00:00:00.000Z') for image_id in image_ids]
+        else:
+            images = [image for image in PUBLIC_IMAGES if _name_matches(image[1], params)]
+        items = ''.join(f'''
+            <item><imageId>{image_id}</imageId><imageState>available</imageState><architecture>x86_64</architecture>
+            <name>{name}</name><creationDate>{creation_date}</creationDate></item>'''
+                        for image_id, name, creation_date in images)
+        return 200, _response('DescribeImages', f'<imagesSet>{items}</imagesSet>')
+
+    def _StopInstances(self, params):
+        return self._transition('StopInstances', params, 'stopping', 'stopped')
+
+    def _StartInstances(self, params):
+        return self._transition('StartInstances', params, 'pending', 'running')
+
+    def _TerminateInstances(self, params):
+        return self._transition('TerminateInstances', params, 'shutting-down', 'terminated')
+
+    def _transition(self, action, params, intermediate, target):
+        instance_ids = _indexed(params, 'InstanceId')
+        missing = [instance_id for instance_id in instance_ids if instance_id not in self.instances]
+        if missing:
+            return 400, _error('InvalidInstanceID.NotFound', f"The instance IDs '{', '.join(missing)}' do not exist")
+        if target != 'terminated':
+            for instance_id in instance_ids:
+                if self.instances[instance_id].state == 'terminated':
+                    return 400, _error('IncorrectInstanceState',
+                                       f"The instance '{instance_id}' is not in a state from which it can be {target}.")
+
+        items = ''
+        for instance_id in instance_ids:
+            previous, current = self.instances[instance_id].transition(intermediate, target)
+            items += f'''
+                <item><instanceId>{instance_id}</instanceId>
+                <currentState><code>{STATES[current]}</code><name>{current}</name></currentState>
+                <previousState><code>{STATES[previous]}</code><name>{previous}</name></previousState></item>'''
+        return 200, _response(action, f'<instancesSet>{items}</instancesSet>')
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, without this kept-alive connections pay the delayed ACK on every call
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stub.lock:
+            self.server.stub.connections += 1
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode('utf-8')
+        params = {key: values[0] for key, values in parse_qs(body, keep_blank_values=True).items()}
+
+        # Authorization: AWS4-HMAC-SHA256 Credential=<access key>/<date>/<region>/<service>/aws4_request, ...
+        credential = re.search(r'Credential=([^/]+)/', self.headers.get('Authorization', ''))
+        status, payload = self.server.stub.handle(params, credential.group(1) if credential else None)
+        payload = payload.encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml;charset=UTF-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(object):
+    """
+    Runs a StubEC2 behind a threaded HTTP server on a random local port. Use it as a context manager.
+    """
+
+    def __init__(self, stub=None):
+        self.stub = stub or StubEC2()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self.stub
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def endpoint_url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _response(action, body):
+    return (f'<?xml version="1.0" encoding="UTF-8"?><{action}Response xmlns="{NAMESPACE}">'
+            f'<requestId>{uuid4()}</requestId>{body}</{action}Response>')
+
+
+def _error(code, message):
+    return (f'<?xml version="1.0" encoding="UTF-8"?><Response><Errors><Error><Code>{code}</Code>'
+            f'<Message>{message}</Message></Error></Errors><RequestID>{uuid4()}</RequestID></Response>')
+
+
+def _indexed(params, prefix, suffix=None):
+    """
+    Collects the values of a query list, e.g. InstanceId.1, InstanceId.2 or IpRanges.1.CidrIp
+    """
+    values = []
+    index = 1
+    while True:
+        key = f'{prefix}.{index}' + (f'.{suffix}' if suffix else '')
+        if key not in params:
+            return values
+        values.append(params[key])
+        index += 1
+
+
+def _filter_values(params, name):
+    index = 1
+    while f'Filter.{index}.Name' in params:
+        if params[f'Filter.{index}.Name'] == name:
+            return _indexed(params, f'Filter.{index}.Value')
+        index += 1
+    return []
+
+
+def _matches_any(value, patterns):
+    return any(re.fullmatch(re.escape(pattern).replace(r'\*', '.*'), value) for pattern in patterns)
+
+
+def _tags(params):
+    tags = {}
+    index = 1
+    while f'TagSpecification.1.Tag.{index}.Key' in params:
+        tags[params[f'TagSpecification.1.Tag.{index}.Key']] = params.get(f'TagSpecification.1.Tag.{index}.Value', '')
+        index += 1
+    return tags
+
+
+def _name_matches(name, params):
+    index = 1
+    while f'Filter.{index}.Name' in params:
+        if params[f'Filter.{index}.Name'] == 'name':
+            return any(fnmatchcase(name, pattern) for pattern in _indexed(params, f'Filter.{index}.Value'))
+        index += 1
+    return True
+
+
+def _tags_match(instance, params):
+    index = 1
+    while f'Filter.{index}.Name' in params:
+        name = params[f'Filter.{index}.Name']
+        if name.startswith('tag:'):
+            if instance.tags.get(name[4:]) not in _indexed(params, f'Filter.{index}.Value'):
+                return False
+        elif name == 'tag-key' and not set(_indexed(params, f'Filter.{index}.Value')) & set(instance.tags):
+            return False
+        index += 1
+    return True
+
+
+def _security_group_xml(group):
+    permissions = ''.join(f'''
+        <item><ipProtocol>{permission['protocol']}</ipProtocol><fromPort>{permission['from_port']}</fromPort>
+        <toPort>{permission['to_port']}</toPort>
+        <ipRanges>{''.join(f'<item><cidrIp>{cidr}</cidrIp></item>' for cidr in permission['cidrs'])}</ipRanges>
+        </item>''' for permission in group['permissions'])
+    return f'''
+        <item><ownerId>000000000000</ownerId><groupId>{group['id']}</groupId><groupName>{group['name']}</groupName>
+        <groupDescription>{group['description']}</groupDescription><vpcId>{group['vpc_id']}</vpcId>
+        <ipPermissions>{permissions}</ipPermissions></item>'''
+
+
+def _instance_xml(instance):
+    state = instance.state
+    public_ip = '<ipAddress>203.0.113.10</ipAddress>' if state == 'running' else ''
+    groups = ''.join(f'<item><groupId>{group_id}</groupId></item>' for group_id in instance.security_group_ids)
+    tags = ''.join(f'<item><key>{key}</key><value>{value}</value></item>' for key, value in instance.tags.items())
+    return f'''
+        <item><instanceId>{instance.instance_id}</instanceId><imageId>{instance.image_id}</imageId>
+        <instanceState><code>{STATES[state]}</code><name>{state}</name></instanceState>
+        <instanceType>{instance.instance_type}</instanceType>
+        <placement><availabilityZone>{AVAILABILITY_ZONE}</availabilityZone></placement>
+        {public_ip}<groupSet>{groups}</groupSet><tagSet>{tags}</tagSet></item>'''
@@ -0,0 +1,80 @@
+"""
+Client constructions and TCP connections per launch, before and after memoizing the raw clients.
+
+The "legacy" scenario reproduces the previous AmazonAPIWrapper.get_raw_client, which built a brand new boto3 client
+(and with it a new connection pool) on every call. The "shared" scenario is the current wrapper. Both run the same
+launch flow, security group + instance, against the stub EC2 endpoint.
+
+Usage, from the backend folder:
+    python -m benchmarks.transport --launches 20 --latency 0.02 --output transport.json
+"""
+import argparse
+import time
+
+from benchmarks.common import ConstructionCounter, report, setup_django, use_endpoint
+from benchmarks.stub_aws import StubEC2, StubServer
+
+setup_django()
+
+from core.api import AmazonAPIWrapper  # noqa: E402
+from core.transport import create_client, get_session  # noqa: E402
+
+
+class LegacyAPIWrapper(AmazonAPIWrapper):
+
+    def __init__(self, client_id, client_secret, *args, **kwargs):
+        self._legacy_credentials = (client_id, client_secret)
+        super().__init__(client_id, client_secret, *args, **kwargs)
+
+    def get_raw_client(self, resource='ec2'):
+        return create_client(resource, *self._legacy_credentials, self.region_name)
+
+
+def run_scenario(name, wrapper_class, stub, counter, launches):
+    stub.reset_counters()
+    counter.reset()
+
+    started = time.perf_counter()
+    wrapper = wrapper_class('AKIABENCHMARK', 'benchmark-secret')
+    for _ in range(launches):
+        security_group_id = wrapper.create_security_group()
+        wrapper.create_vm(security_group_id)
+    elapsed = time.perf_counter() - started
+
+    aws = stub.snapshot()
+    constructions = counter.snapshot()
+    return {
+        'scenario': name,
+        'launches': launches,
+        'wall_time_s': elapsed,
+        'per_launch_s': elapsed / launches,
+        'clients_per_launch': constructions['client_constructions'] / launches,
+        'connections_per_launch': aws['connections'] / launches,
+        'api_calls_per_launch': aws['api_calls'] / launches,
+        **constructions,
+        'connections': aws['connections'],
+        'api_calls': aws['api_calls'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--launches', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every stub response')
+    parser.add_argument('--output', help='JSON file to store the results')
+    args = parser.parse_args()
+
+    with StubServer(StubEC2(latency=args.latency)) as server:
+        use_endpoint(server.endpoint_url)
+        counter = ConstructionCounter(get_session())
+
+        results = [
+            run_scenario('legacy', LegacyAPIWrapper, server.stub, counter, args.launches),
+            run_scenario('shared', AmazonAPIWrapper, server.stub, counter, args.launches),
+        ]
+
+    report('transport', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
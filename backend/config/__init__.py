@@ -1 +1 @@
-from .docker import Docker
+from .docker import Docker, Test
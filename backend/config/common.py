@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 import os
 
 from configurations import Configuration, values
+from corsheaders.defaults import default_headers
 
 
 class Common(Configuration):
@@ -53,6 +54,7 @@ class Common(Configuration):
     INSTALLED_APPS = LOCAL_APPS + THIRD_PARTY_APPS + DJANGO_APPS
 
     MIDDLEWARE = [
+        'core.middleware.RequestMetricsMiddleware',
         'django.middleware.security.SecurityMiddleware',
         'django.contrib.sessions.middleware.SessionMiddleware',
         'corsheaders.middleware.CorsMiddleware',
@@ -70,8 +72,148 @@ class Common(Configuration):
         "http://localhost",
         "http://localhost:4200",
     ])
+    CORS_ALLOW_HEADERS = default_headers + ('idempotency-key',)
     # End CORS configuration
 
+    # AWS client registry configuration
+    AWS_CLIENT_REGISTRY_SIZE = values.IntegerValue(128)
+    AWS_CLIENT_REGISTRY_TTL = values.IntegerValue(15 * 60)
+    # End AWS client registry configuration
+
+    # AWS transport configuration
+    AWS_ENDPOINT_URL = values.Value(None)
+    AWS_MAX_POOL_CONNECTIONS = values.IntegerValue(50)
+    AWS_CONNECT_TIMEOUT = values.FloatValue(5)
+    AWS_READ_TIMEOUT = values.FloatValue(30)
+    AWS_TCP_KEEPALIVE = values.BooleanValue(True)
+    # legacy, standard or adaptive, adaptive adds client side rate limiting on top of the retries
+    AWS_RETRY_MODE = values.Value('adaptive')
+    AWS_MAX_ATTEMPTS = values.IntegerValue(5)
+    # End AWS transport configuration
+
+    # Startup warm-up configuration. Loads the boto3 session, the EC2 service model and the URLconf when a server worker
+    # process loads wsgi.py instead of on the first requests, manage.py commands do not warm up
+    WARM_UP_ENABLED = values.BooleanValue(True)
+    # End startup warm-up configuration
+
+    # AWS rate governor configuration, calls per second and burst of each account and region in this process. The
+    # defaults are the EC2 request rate limits, divide them by the number of worker processes
+    AWS_RATE_LIMIT_ENABLED = values.BooleanValue(True)
+    AWS_RATE_LIMIT_DESCRIBE_RATE = values.FloatValue(20)
+    AWS_RATE_LIMIT_DESCRIBE_BURST = values.IntegerValue(100)
+    AWS_RATE_LIMIT_MUTATE_RATE = values.FloatValue(5)
+    AWS_RATE_LIMIT_MUTATE_BURST = values.IntegerValue(50)
+    # Seconds a call may wait for its turn before being rejected with a 429
+    AWS_RATE_LIMIT_MAX_WAIT = values.FloatValue(5)
+    # End AWS rate governor configuration
+
+    # DryRun permission verdicts cache configuration
+    AWS_DRY_RUN_CACHE_ENABLED = values.BooleanValue(True)
+    AWS_DRY_RUN_CACHE_TTL = values.IntegerValue(30 * 60)
+    AWS_DRY_RUN_CACHE_DENIED_TTL = values.IntegerValue(60)
+    AWS_DRY_RUN_CACHE_SIZE = values.IntegerValue(4096)
+    # End DryRun permission verdicts cache configuration
+
+    # VPC and security group lookups cache configuration
+    AWS_LOOKUP_CACHE_TTL = values.IntegerValue(30 * 60)
+    AWS_LOOKUP_CACHE_SIZE = values.IntegerValue(4096)
+    # End VPC and security group lookups cache configuration
+
+    # Instance status stream configuration, seconds. Every open stream checks the status once per
+    # EC2_STATUS_STREAM_INTERVAL, the same pace as the check-status polling of the frontend it replaced, so streams do
+    # not add AWS calls
+    EC2_STATUS_STREAM_INTERVAL = values.FloatValue(10)
+    EC2_STATUS_STREAM_HEARTBEAT = values.FloatValue(15)
+    EC2_STATUS_STREAM_MAX_DURATION = values.IntegerValue(15 * 60)
+    # Longest wait of check-status in long polling mode, it has to stay under the proxies timeouts
+    EC2_STATUS_WAIT_MAX_TIMEOUT = values.IntegerValue(60)
+    # End instance status stream configuration
+
+    # Instance state poller configuration, seconds. Set EC2_STATE_CACHE_ALIAS to 'instance-state' to share the state
+    # between workers through Postgres
+    EC2_POLLER_FAST_INTERVAL = values.FloatValue(1)
+    EC2_POLLER_SLOW_INTERVAL = values.FloatValue(30)
+    EC2_POLLER_IDLE_TIMEOUT = values.IntegerValue(120)
+    EC2_STATE_CACHE_ALIAS = values.Value(None)
+    # End instance state poller configuration
+
+    # Launch jobs configuration. Launches over EC2_LAUNCH_WORKERS + EC2_LAUNCH_QUEUE_SIZE are rejected with a 503
+    EC2_LAUNCH_WORKERS = values.IntegerValue(4)
+    EC2_LAUNCH_QUEUE_SIZE = values.IntegerValue(32)
+    EC2_LAUNCH_JOB_RETENTION = values.IntegerValue(60 * 60)
+    # Set to 'instance-state' to share the progress of the jobs between workers through Postgres
+    EC2_JOB_CACHE_ALIAS = values.Value(None)
+    EC2_PIPELINE_WORKERS = values.IntegerValue(16)
+    # Seconds a create with an idempotency key joins the launch of the first one. Creates without key are never joined
+    # unless EC2_CREATE_DEDUP_WINDOW is set, then identical creates of the same credentials are joined for that many
+    # seconds, e.g. double clicks of clients that send no key
+    EC2_IDEMPOTENCY_TTL = values.IntegerValue(60 * 60)
+    EC2_CREATE_DEDUP_WINDOW = values.IntegerValue(0)
+    # End launch jobs configuration
+
+    # WordPress image resolution configuration, seconds. The latest image of EC2_IMAGE_OWNERS, Bitnami, matching
+    # EC2_IMAGE_NAME_PATTERN is looked up per region and cached for EC2_IMAGE_TTL. Images older than
+    # EC2_IMAGE_REFRESH_AFTER are refreshed in the background, failed lookups are retried after EC2_IMAGE_RETRY_AFTER
+    EC2_IMAGE_OWNERS = values.ListValue(['979382823631'])
+    EC2_IMAGE_NAME_PATTERN = values.Value('bitnami-wordpress-*-linux-debian-*-x86_64-hvm-ebs*')
+    EC2_IMAGE_TTL = values.IntegerValue(7 * 24 * 60 * 60)
+    EC2_IMAGE_REFRESH_AFTER = values.IntegerValue(6 * 60 * 60)
+    EC2_IMAGE_RETRY_AFTER = values.IntegerValue(60)
+    EC2_IMAGE_CACHE_SIZE = values.IntegerValue(64)
+    # Stores the images looked up in the database, so new worker processes start with them
+    EC2_IMAGE_PERSIST = values.BooleanValue(True)
+    # End WordPress image resolution configuration
+
+    # Sessions configuration, seconds. Sessions expire EC2_SESSION_TTL seconds after they were last used. Set
+    # EC2_SESSION_CACHE_ALIAS to a Django cache shared by the workers, not persisted as it keeps the credentials, so
+    # sessions opened by a worker can be used with any other
+    EC2_SESSION_TTL = values.IntegerValue(30 * 60)
+    EC2_SESSION_STORE_SIZE = values.IntegerValue(4096)
+    EC2_SESSION_CACHE_ALIAS = values.Value(None)
+    # End sessions configuration
+
+    # Warm pool configuration. Number of stopped spares kept per credentials and region for each instance type, e.g.
+    # DJANGO_EC2_WARM_POOL_SIZES="{'t2.micro': 2}", launches of those types start spares instead of running new
+    # instances. Spares are provisioned on EC2_WARM_POOL_WORKERS threads, checking their state every
+    # EC2_WARM_POOL_POLL_INTERVAL seconds. The warm pool needs the instances index
+    EC2_WARM_POOL_ENABLED = values.BooleanValue(False)
+    EC2_WARM_POOL_SIZES = values.DictValue({})
+    EC2_WARM_POOL_WORKERS = values.IntegerValue(2)
+    EC2_WARM_POOL_QUEUE_SIZE = values.IntegerValue(64)
+    EC2_WARM_POOL_POLL_INTERVAL = values.IntegerValue(15)
+    EC2_WARM_POOL_POLL_ATTEMPTS = values.IntegerValue(40)
+    # End warm pool configuration
+
+    # Request executor configuration. The AWS work of the requests runs on EC2_REQUEST_WORKERS threads per process with
+    # up to EC2_REQUEST_QUEUE_SIZE waiting, requests over that are rejected with a 503 and a Retry-After of
+    # EC2_RETRY_AFTER seconds. Requests give up, with a 504, after EC2_REQUEST_TIMEOUT seconds
+    EC2_REQUEST_WORKERS = values.IntegerValue(64)
+    EC2_REQUEST_QUEUE_SIZE = values.IntegerValue(256)
+    EC2_REQUEST_TIMEOUT = values.FloatValue(30)
+    EC2_RETRY_AFTER = values.IntegerValue(1)
+    # Long polls, status streams and inventory streams wait on the request thread, at most EC2_STREAM_LIMIT of them are
+    # open at once per process, over that they are rejected with a 503. Keep it under the threads of a worker so short
+    # requests are still served
+    EC2_STREAM_LIMIT = values.IntegerValue(64)
+    # End request executor configuration
+
+    # Regions configuration. Multi-region operations query every enabled region concurrently, regions not answering
+    # within EC2_REGION_TIMEOUT seconds are reported as failed
+    EC2_ENABLED_REGIONS = values.ListValue(['eu-west-1'])
+    EC2_REGION_TIMEOUT = values.FloatValue(10)
+    EC2_REGION_WORKERS = values.IntegerValue(16)
+    # End regions configuration
+
+    # Launched instances index configuration. Indexed instances not checked with AWS for EC2_INDEX_MAX_AGE seconds are
+    # refreshed before being listed
+    EC2_INDEX_ENABLED = values.BooleanValue(True)
+    EC2_INDEX_MAX_AGE = values.IntegerValue(30)
+    # End launched instances index configuration
+
+    # Metrics configuration. AWS calls and ec2 views latency are exposed on /metrics, nothing is recorded when disabled
+    METRICS_ENABLED = values.BooleanValue(True)
+    # End metrics configuration
+
     REST_FRAMEWORK = {
         # Use Django's standard `django.contrib.auth` permissions,
         # or allow read-only access for unauthenticated users.
@@ -111,6 +253,25 @@ class Common(Configuration):
     DATABASES = values.DatabaseURLValue('postgresql://postgres:postgres@db/postgres',
                                         environ_name="DJANGO_DATABASE_URL")
 
+    # Caches
+    # https://docs.djangoproject.com/en/2.2/topics/cache/
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'instance-state': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'ec2_instance_state',
+        },
+        # Shared by the workers and kept in memory only, for the sessions, which hold the credentials. Connected to on
+        # first use, see EC2_SESSION_CACHE_ALIAS
+        'sessions': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': 'memcached:11211',
+        },
+    }
+
     # Password validation
     # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -9,4 +9,8 @@ class Docker(Common):
 
 
 class Test(Common):
-    pass
+    DATABASES = values.DatabaseURLValue('sqlite://:memory:', environ_name="DJANGO_DATABASE_URL")
+
+    # The tests run against moto, which answers instantly
+    WARM_UP_ENABLED = values.BooleanValue(False)
+    AWS_RATE_LIMIT_ENABLED = values.BooleanValue(False)
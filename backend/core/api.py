@@ -1,22 +1,46 @@
 import logging
+import threading
 from uuid import uuid4
 
-import boto3
 from botocore.exceptions import ClientError
-from rest_framework.status import HTTP_500_INTERNAL_SERVER_ERROR
+from django.conf import settings
+from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_500_INTERNAL_SERVER_ERROR
 
+from core.cache import TTLCache, fingerprint
 from core.exceptions import OperationError
-from ec2.constants import WORDPRESS_AMI, SECURITY_GROUP_NAME, SECURITY_GROUP_DESCRIPTION
+from core.metrics import THROTTLING_ERROR_CODES
+from core.permissions import DENIED_ERROR_CODES, get_permission_cache
+from core.ratelimit import get_rate_governor
+from core.transport import create_client, create_resource
+from ec2.constants import WORDPRESS_AMI, SECURITY_GROUP_NAME, SECURITY_GROUP_DESCRIPTION, SECURITY_GROUP_INGRESS, \
+    DEFAULT_REGION, LAUNCHPAD_TAG_KEY, LAUNCHPAD_TAG_VALUE, \
+    MAX_FILTER_VALUES, DESCRIBE_INSTANCES_PAGE_SIZE, DEFAULT_INSTANCE_TYPE, MAX_INSTANCES_PER_RUN, \
+    MAX_CLIENT_TOKEN_LENGTH, MAX_STATE_CHANGE_IDS, STATE_CHANGE_ACTIONS
 
 logger = logging.getLogger(__name__)
 
+# Keys of an IpPermission describing the rule itself, the other ones list the sources it is open to
+INGRESS_RULE_KEYS = ('IpProtocol', 'FromPort', 'ToPort')
+INGRESS_SOURCE_KEYS = {
+    'IpRanges': lambda source: source.get('CidrIp'),
+    'Ipv6Ranges': lambda source: source.get('CidrIpv6'),
+    'UserIdGroupPairs': lambda source: (source.get('UserId'), source.get('GroupId') or source.get('GroupName'),
+                                        source.get('VpcPeeringConnectionId')),
+    'PrefixListIds': lambda source: source.get('PrefixListId'),
+}
+
 
 class AmazonAPIWrapper(object):
 
-    def __init__(self, client_id, client_secret, resource='ec2'):
+    def __init__(self, client_id, client_secret, resource='ec2', region_name=DEFAULT_REGION):
         self.__client_id = client_id
         self.__client_secret = client_secret
         self.__resource = resource
+        self.region_name = region_name
+        self.credential_key = fingerprint(client_id, client_secret)
+
+        self.__raw_clients = {}
+        self.__raw_clients_lock = threading.Lock()
 
         self.__get_client_resource()
 
@@ -25,18 +49,79 @@ class AmazonAPIWrapper(object):
         Assigns the ec2 resource object to self.client to later be used as client between the backend and AWS
         """
         try:
-            self.client = boto3.resource(self.__resource,
-                                         aws_access_key_id=self.__client_id,
-                                         aws_secret_access_key=self.__client_secret,
-                                         region_name='eu-west-1')
+            self.client = create_resource(self.__resource, self.__client_id, self.__client_secret, self.region_name)
+            self.__govern(self.client.meta.client)
 
         except ClientError:
             raise
 
     def get_raw_client(self, resource='ec2'):
-        return boto3.client(resource, aws_access_key_id=self.__client_id,
-                            aws_secret_access_key=self.__client_secret,
-                            region_name='eu-west-1')
+        """
+        Returns the low level client for the given service. Clients are created once per wrapper and reused, the one
+        for the wrapper's own service is the client behind self.client so both share the same connection pool.
+        :param resource: AWS service name
+        :return: boto3 client
+        """
+        raw_client = self.__raw_clients.get(resource)
+        if raw_client is None:
+            with self.__raw_clients_lock:
+                raw_client = self.__raw_clients.get(resource)
+                if raw_client is None:
+                    if resource == self.__resource:
+                        raw_client = self.client.meta.client
+                    else:
+                        raw_client = create_client(resource, self.__client_id, self.__client_secret,
+                                                   self.region_name)
+                        self.__govern(raw_client)
+                    self.__raw_clients[resource] = raw_client
+        return raw_client
+
+    def __govern(self, client):
+        """
+        Puts the calls of the client under the rate budgets of the credentials and region, see core.ratelimit
+        :param client: boto3 client
+        """
+        rate_governor = get_rate_governor()
+        if rate_governor is not None:
+            rate_governor.install(client, self.credential_key, self.region_name)
+
+    def preflight(self):
+        """
+        Checks up front, with one DryRun call each, the permissions needed to launch an instance so the verdicts are
+        cached before the launch pipeline needs them.
+        :return: dict with the action name as key and True if it is allowed
+        """
+        checks = {
+            'DescribeVpcs': lambda: self.get_raw_client().describe_vpcs(DryRun=True),
+            'CreateSecurityGroup': lambda: self.get_raw_client().create_security_group(
+                GroupName=SECURITY_GROUP_NAME, Description=SECURITY_GROUP_DESCRIPTION, DryRun=True),
+            'RunInstances': self._dry_run_instances,
+        }
+
+        verdicts = {}
+        for action, dry_run in checks.items():
+            try:
+                self._check_permission(action, dry_run)
+                verdicts[action] = True
+            except ClientError:
+                verdicts[action] = False
+        return verdicts
+
+    def _check_permission(self, action, dry_run):
+        """
+        Makes sure the credentials can perform the action. The DryRun call is only made if there is no cached verdict
+        for these credentials, region and action.
+        :param action: EC2 API action name
+        :param dry_run: callable issuing the DryRun version of the call
+        """
+        get_permission_cache().check(self.credential_key, self.region_name, action, dry_run)
+
+    def get_caller_identity(self):
+        """
+        Validates the credentials with a single STS call, which needs no IAM permission
+        :return: {'Account', 'Arn', 'UserId'} as given by AWS
+        """
+        return self.get_raw_client('sts').get_caller_identity()
 
     def security_group_exists(self, group_name=SECURITY_GROUP_NAME):
         """
@@ -63,59 +148,301 @@ class AmazonAPIWrapper(object):
         else:
             return instance
 
+    def describe_instances(self, instance_ids):
+        """
+        Retrieves the description of many instances at once through the describe_instances paginator. Ids are sent as
+        an instance-id filter instead of InstanceIds so unknown ids do not make the whole call fail, they are simply
+        missing from the result. Permission errors apply to every id so they are raised instead of being reported.
+        :param instance_ids: list of instance ids
+        :return: tuple with a dict instance id -> description as given by AWS and a dict instance id -> error code for
+        the ids that could not be retrieved
+        """
+        paginator = self.get_raw_client().get_paginator('describe_instances')
+        instances = {}
+        errors = {}
+
+        for chunk in _chunks(instance_ids, MAX_FILTER_VALUES):
+            try:
+                pages = paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': chunk}],
+                                           PaginationConfig={'PageSize': DESCRIBE_INSTANCES_PAGE_SIZE})
+                for page in pages:
+                    for reservation in page.get('Reservations', []):
+                        for instance in reservation.get('Instances', []):
+                            instances[instance['InstanceId']] = instance
+            except ClientError as e:
+                error_code = e.response.get('Error', {}).get('Code', '')
+                if error_code in DENIED_ERROR_CODES:
+                    raise
+                errors.update({instance_id: error_code for instance_id in chunk})
+
+        for instance_id in instance_ids:
+            if instance_id not in instances and instance_id not in errors:
+                errors[instance_id] = 'InvalidInstanceID.NotFound'
+
+        return instances, errors
+
+    def iter_instances(self, filters=None):
+        """
+        Lazily walks through the describe_instances paginator, yielding the instances of each page as it arrives
+        :param filters: describe_instances filters
+        :return: generator of instance descriptions as given by AWS
+        """
+        paginator = self.get_raw_client().get_paginator('describe_instances')
+        pages = paginator.paginate(Filters=filters or [],
+                                   PaginationConfig={'PageSize': DESCRIBE_INSTANCES_PAGE_SIZE})
+        for page in pages:
+            for reservation in page.get('Reservations', []):
+                yield from reservation.get('Instances', [])
+
+    def find_launchpad_instances(self):
+        """
+        Lists the instances launched by the launchpad in the region, that is the ones tagged with LAUNCHPAD_TAG_KEY
+        :return: list of instance descriptions as given by AWS
+        """
+        return list(self.iter_instances([{'Name': f'tag:{LAUNCHPAD_TAG_KEY}', 'Values': [LAUNCHPAD_TAG_VALUE]}]))
+
     def stop_instance(self, instance):
         """
         Given an instance of ec2, tries to stop it. First, checks if the client to perform that operation
         :param instance: to be stopped
         :return: status of the instance once the stop order has been asked
         """
-        try:
-            instance.stop(DryRun=True)
-        except ClientError as e:
-            if 'DryRunOperation' not in str(e):
-                raise
+        self._check_permission('StopInstances', lambda: instance.stop(DryRun=True))
 
         return instance.stop()
 
-    def create_vm(self, security_group_id, ami=WORDPRESS_AMI):
+    def change_instances_state(self, action, instance_ids):
         """
-        Creates a ec2 instance given a security group and an AMI
-        :param security_group_id: to attach to the ec2 instance
-        :param ami: it will the based of the instance
-        :return: instance just created
+        Starts, stops or terminates many instances with as few calls as possible, MAX_STATE_CHANGE_IDS ids each. There
+        is no DryRun call first: a call is rejected as a whole, changing nothing, if the credentials are not allowed.
+        A call is also rejected as a whole if any of its ids does not exist or cannot make the transition, those
+        chunks are split in halves until the faulty ids are isolated, so the others still change state.
+        :param action: one of STATE_CHANGE_ACTIONS, start, stop or terminate
+        :param instance_ids: list of instance ids
+        :return: tuple with a dict instance id -> {'InstanceId', 'CurrentState', 'PreviousState'} as given by AWS and a
+        dict instance id -> error code for the ids that could not change state
         """
-        try:
-            self._base_create_vm(security_group_id, ami, True)
-        except ClientError as e:
-            if 'DryRunOperation' not in str(e):
-                raise
+        method, response_key = STATE_CHANGE_ACTIONS[action]
+        change = getattr(self.get_raw_client(), method)
+        changes = {}
+        errors = {}
+
+        def run(chunk):
+            try:
+                response = change(InstanceIds=chunk)
+            except ClientError as e:
+                error_code = e.response.get('Error', {}).get('Code', '')
+                if error_code in DENIED_ERROR_CODES or error_code in THROTTLING_ERROR_CODES:
+                    raise
+                if len(chunk) == 1:
+                    errors[chunk[0]] = error_code
+                    return
+                middle = len(chunk) // 2
+                run(chunk[:middle])
+                run(chunk[middle:])
+                return
+            for transition in response.get(response_key, []):
+                changes[transition['InstanceId']] = transition
+
+        for chunk in _chunks(instance_ids, MAX_STATE_CHANGE_IDS):
+            run(chunk)
+
+        return changes, errors
+
+    def wait_for(self, waiter_name, instance_ids, delay=15, max_attempts=40):
+        """
+        Blocks until every instance reaches a state, through the botocore waiters
+        :param waiter_name: e.g. instance_running or instance_stopped
+        :param instance_ids: list of instance ids
+        :param delay: seconds between checks
+        :param max_attempts: checks before giving up with a WaiterError
+        """
+        self.get_raw_client().get_waiter(waiter_name).wait(InstanceIds=instance_ids,
+                                                           WaiterConfig={'Delay': delay, 'MaxAttempts': max_attempts})
+
+    def create_vm(self, security_group_id, ami=WORDPRESS_AMI, instance_type=DEFAULT_INSTANCE_TYPE, count=1,
+                  client_token=None):
+        """
+        Creates ec2 instances given a security group and an AMI. All of them are requested with a single
+        create_instances call, or one per MAX_INSTANCES_PER_RUN instances for the biggest fleets. Each call asks for
+        MinCount 1 so AWS launches as many instances as it has capacity for instead of failing the whole call.
+        With a client token every call is idempotent: repeating the launch with the same token returns the instances
+        launched the first time instead of launching new ones.
+        :param security_group_id: to attach to the ec2 instances
+        :param ami: it will the based of the instances
+        :param instance_type: type of the instances
+        :param count: number of instances to create
+        :param client_token: idempotency token of the launch, each call gets its own one derived from it
+        :return: tuple with the list of instances just created and the list of errors of the calls that failed once
+        some instances had already been launched, {'Requested': number of instances, 'Code', 'Message'}
+        """
+        self._check_permission('RunInstances',
+                               lambda: self._base_create_vm(security_group_id, ami, instance_type, 1, True))
+
+        instances = []
+        errors = []
+        remaining = count
+        while remaining > 0:
+            requested = min(remaining, MAX_INSTANCES_PER_RUN)
+            call_token = None
+            if client_token:
+                suffix = f'-{(count - remaining) // MAX_INSTANCES_PER_RUN}'
+                call_token = client_token[:MAX_CLIENT_TOKEN_LENGTH - len(suffix)] + suffix
+            try:
+                instances += self._base_create_vm(security_group_id, ami, instance_type, requested,
+                                                  client_token=call_token)
+            except ClientError as e:
+                # Nothing was launched, the error is the outcome of the whole operation
+                if not instances:
+                    raise
+                error = e.response.get('Error', {})
+                errors.append({'Requested': remaining, 'Code': error.get('Code', ''),
+                               'Message': error.get('Message', '')})
+                logger.warning(f'Launched {len(instances)} out of {count} instances, {error.get("Code")}')
+                break
+            remaining -= requested
+
+        return instances, errors
+
+    def resolve_security_group(self):
+        """
+        Returns the id of a security group fit for the instances, reusing an existing one whenever possible:
+        1) The id resolved by a previous call for these credentials and region, while it is cached.
+        2) A group named SECURITY_GROUP_NAME or SECURITY_GROUP_NAME-* in the VPC whose ingress rules are exactly
+        SECURITY_GROUP_INGRESS.
+        3) A brand new group, see create_security_group.
+        :return: id of the security group
+        """
+        security_group_id = self.get_cached_security_group()
+        if security_group_id is not None:
+            return security_group_id
+
+        vpc_id = self.get_vpc_id()
+        security_groups = self.find_security_groups()
+        security_group_id = self.pick_security_group(security_groups, vpc_id)
 
-        instances = self._base_create_vm(security_group_id, ami)
-        # We are only creating one instance, so we access the index 0
-        return instances[0]
+        if security_group_id is None:
+            name_taken = any(group.get('GroupName') == SECURITY_GROUP_NAME for group in security_groups)
+            security_group_id = self.create_security_group(vpc_id, name_taken)
 
-    def create_security_group(self):
+        self.cache_security_group(security_group_id)
+        return security_group_id
+
+    def get_cached_security_group(self):
+        return get_lookup_cache().get((self.credential_key, self.region_name, 'security-group'))
+
+    def cache_security_group(self, security_group_id):
+        get_lookup_cache().set((self.credential_key, self.region_name, 'security-group'), security_group_id)
+
+    def find_security_groups(self):
+        """
+        Lists the security groups named SECURITY_GROUP_NAME or SECURITY_GROUP_NAME-*, in any VPC
+        :return: list of security groups as given by AWS
+        """
+        return self.get_raw_client().describe_security_groups(Filters=[
+            {'Name': 'group-name', 'Values': [SECURITY_GROUP_NAME, f'{SECURITY_GROUP_NAME}-*']},
+        ]).get('SecurityGroups', [])
+
+    @staticmethod
+    def pick_security_group(security_groups, vpc_id):
+        """
+        Picks, out of the given security groups, one of the VPC whose ingress rules are exactly SECURITY_GROUP_INGRESS
+        :param security_groups: as returned by find_security_groups
+        :param vpc_id: id of the VPC
+        :return: id of the security group or None if none can be reused
+        """
+        for group in security_groups:
+            if group.get('VpcId') == vpc_id and \
+                    _ingress_rules(group.get('IpPermissions', [])) == _ingress_rules(SECURITY_GROUP_INGRESS):
+                logger.info(f'Reusing security group {group["GroupId"]} for VPC {vpc_id}')
+                return group['GroupId']
+        return None
+
+    def check_launch_permission(self, ami=WORDPRESS_AMI, instance_type=DEFAULT_INSTANCE_TYPE):
+        """
+        Checks, through the permission cache, that the credentials are allowed to run instances
+        """
+        self._check_permission('RunInstances', lambda: self._dry_run_instances(ami, instance_type))
+
+    def _dry_run_instances(self, ami=WORDPRESS_AMI, instance_type=DEFAULT_INSTANCE_TYPE):
+        self.get_raw_client().run_instances(ImageId=ami, InstanceType=instance_type, MinCount=1, MaxCount=1,
+                                            DryRun=True)
+
+    def validate_image(self, ami=WORDPRESS_AMI):
+        """
+        Makes sure the AMI exists and it is available in the region. Valid images are cached as AMIs are immutable.
+        :param ami: id of the image
+        """
+        cache_key = (self.region_name, 'image', ami)
+        if get_lookup_cache().get(cache_key):
+            return
+
+        images = self.get_raw_client().describe_images(ImageIds=[ami]).get('Images', [])
+        if not images or images[0].get('State') != 'available':
+            raise OperationError(f'The image {ami} is not available in {self.region_name}',
+                                 status=HTTP_400_BAD_REQUEST)
+        get_lookup_cache().set(cache_key, True)
+
+    def find_latest_image(self, owners, name_pattern):
+        """
+        Looks for the most recent available image of the owners whose name matches the pattern. describe_images is a
+        slow call, see core.images.ImageResolver for the cached resolution.
+        :param owners: AWS account ids publishing the image
+        :param name_pattern: name filter, with * wildcards
+        :return: image description or None if there is none
+        """
+        images = self.get_raw_client().describe_images(Owners=owners, Filters=[
+            {'Name': 'name', 'Values': [name_pattern]},
+            {'Name': 'state', 'Values': ['available']},
+            {'Name': 'architecture', 'Values': ['x86_64']},
+        ]).get('Images', [])
+        if not images:
+            return None
+        return max(images, key=lambda image: image.get('CreationDate', ''))
+
+    def forget_lookups(self):
+        """
+        Drops the cached VPC and security group ids, e.g. because the security group was deleted meanwhile
+        """
+        for lookup in ('vpc', 'security-group'):
+            get_lookup_cache().pop((self.credential_key, self.region_name, lookup))
+
+    def create_security_group(self, vpc_id=None, name_taken=None):
         """
         Routine to create a security group.
         1) Gets the VPC id, by default we take the first one.
         2) Create a security group based on the previous id. First it'll try to create a group with the hardcoded
         name, SECURITY_GROUP_NAME, if it's not available, it'll create a random one.
         3) Attaches security ingress to the group
+        :param vpc_id: id of the VPC if it is already known
+        :param name_taken: whether SECURITY_GROUP_NAME is already used, if it is already known
         :return: id of the security group
         """
         try:
-            vpc_id = self._get_vpc_id()
+            if vpc_id is None:
+                vpc_id = self.get_vpc_id()
 
             group_name = SECURITY_GROUP_NAME
 
             # If there is a security group named exactly as the one hardcoded on the code, we generate a random
             # one with the hardcoded one as base plus a random uuid
-            if self.security_group_exists():
+            if name_taken is None:
+                name_taken = self.security_group_exists()
+            if name_taken:
                 group_name += f'-{uuid4()}'
                 logger.info(f'Security group with name {SECURITY_GROUP_NAME}, exists already, assigning new name '
                             f'{group_name}')
 
-            security_group = self._create_security_group(group_name, vpc_id)
+            try:
+                security_group = self._create_security_group(group_name, vpc_id)
+            except ClientError as e:
+                if name_taken or e.response.get('Error', {}).get('Code', '') != 'InvalidGroup.Duplicate':
+                    raise
+                # Created meanwhile by a concurrent launch, which may not have assigned its ingress rules yet
+                group_name += f'-{uuid4()}'
+                logger.info(f'Security group with name {SECURITY_GROUP_NAME} was just created, assigning new name '
+                            f'{group_name}')
+                security_group = self._create_security_group(group_name, vpc_id)
 
             security_group_id = security_group.id
 
@@ -124,24 +451,23 @@ class AmazonAPIWrapper(object):
         except ClientError:
             raise
 
-    def _get_vpc_id(self):
-        try:
-            self.get_raw_client().describe_vpcs(DryRun=True)
-        except ClientError as e:
-            if 'DryRunOperation' not in str(e):
-                raise
+    def get_vpc_id(self):
+        cache_key = (self.credential_key, self.region_name, 'vpc')
+        vpc_id = get_lookup_cache().get(cache_key)
+        if vpc_id is not None:
+            return vpc_id
+
+        self._check_permission('DescribeVpcs', lambda: self.get_raw_client().describe_vpcs(DryRun=True))
 
         vpcs = self.get_raw_client().describe_vpcs()
         # By default, we take the first VPC
         vpc_id = vpcs.get('Vpcs', [{}])[0].get('VpcId', '')
+        get_lookup_cache().set(cache_key, vpc_id)
         return vpc_id
 
     def _assign_security_group_ingress(self, security_group_id):
-        try:
-            self.__base_assign_security_group_ingress(security_group_id, True)
-        except ClientError as e:
-            if 'DryRunOperation' not in str(e):
-                raise
+        self._check_permission('AuthorizeSecurityGroupIngress',
+                               lambda: self.__base_assign_security_group_ingress(security_group_id, True))
         self.__base_assign_security_group_ingress(security_group_id)
 
     def __base_assign_security_group_ingress(self, security_group_id, checking_permissions=False):
@@ -153,33 +479,16 @@ class AmazonAPIWrapper(object):
         :param checking_permissions: True if we want to check for permissions, False, to run the actual operation
         :return:
         """
-        self.get_raw_client().authorize_security_group_ingress(
-            GroupId=security_group_id,
-            IpPermissions=[
-                {'IpProtocol': 'tcp',
-                 'FromPort': 80,
-                 'ToPort': 80,
-                 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
-                {'IpProtocol': 'tcp',
-                 'FromPort': 443,
-                 'ToPort': 443,
-                 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
-                {'IpProtocol': 'tcp',
-                 'FromPort': 22,
-                 'ToPort': 22,
-                 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
-            ],
-            DryRun=checking_permissions)
+        self.get_raw_client().authorize_security_group_ingress(GroupId=security_group_id,
+                                                               IpPermissions=SECURITY_GROUP_INGRESS,
+                                                               DryRun=checking_permissions)
 
         if not checking_permissions:
             logger.info(f'Security group ingress assigned for group id {security_group_id}')
 
     def _create_security_group(self, group_name, vpc_id):
-        try:
-            self.__base_create_security_group(group_name, vpc_id, True)
-        except ClientError as e:
-            if 'DryRunOperation' not in str(e):
-                raise
+        self._check_permission('CreateSecurityGroup',
+                               lambda: self.__base_create_security_group(group_name, vpc_id, True))
 
         return self.__base_create_security_group(group_name, vpc_id)
 
@@ -201,40 +510,110 @@ class AmazonAPIWrapper(object):
 
         return security_group
 
-    def _base_create_vm(self, security_group_id, ami=WORDPRESS_AMI, checking_permissions=False):
+    def _base_create_vm(self, security_group_id, ami=WORDPRESS_AMI, instance_type=DEFAULT_INSTANCE_TYPE, count=1,
+                        checking_permissions=False, client_token=None):
         """
         Internal wrapper to be used by create_vm so it can run in DryRun mode to check for permissions.
         We do not assign a KeyName to this instance on launch time, meaning we will not be able to connect to it
         through ssh although permissions security was fixed to be able to do so.
         :param security_group_id: to be attached to the instance
         :param ami: to be the based of the instance
+        :param instance_type: type of the instances
+        :param count: maximum number of instances to launch, AWS may launch less if it is short of capacity
         :param checking_permissions: True if we want to check for permissions, False, to run the actual operation
-        :return: ec2 instance
+        :param client_token: idempotency token of the call, by default botocore generates one per call
+        :return: list of ec2 instances
         """
-        vm = self.client.create_instances(ImageId=ami,
-                                          InstanceType='t2.micro',
-                                          MinCount=1,
-                                          MaxCount=1,
-                                          SecurityGroupIds=[
-                                              security_group_id,
-                                          ],
-                                          DryRun=checking_permissions)
+        extra = {'ClientToken': client_token} if client_token else {}
+        vms = self.client.create_instances(ImageId=ami,
+                                           InstanceType=instance_type,
+                                           MinCount=1,
+                                           MaxCount=count,
+                                           SecurityGroupIds=[
+                                               security_group_id,
+                                           ],
+                                           TagSpecifications=[{
+                                               'ResourceType': 'instance',
+                                               'Tags': [{'Key': LAUNCHPAD_TAG_KEY, 'Value': LAUNCHPAD_TAG_VALUE}]
+                                           }],
+                                           DryRun=checking_permissions,
+                                           **extra)
 
         if not checking_permissions:
-            logger.info(f'VM with AMI {ami}, type t2.micro and security group {security_group_id}')
-
-        return vm
-
-
-aws = None
-
-
-def get_aws_client(client_id, client_secret, resource='ec2'):
-    global aws
+            logger.info(f'{len(vms)} VMs with AMI {ami}, type {instance_type} and security group {security_group_id}')
+
+        return vms
+
+
+def _ingress_rules(ip_permissions):
+    """
+    Flattens IpPermissions into a comparable set of (protocol, from port, to port, kind, source) rules. Every kind of
+    source is kept, IPv4 and IPv6 ranges, security groups and prefix lists, and keys of unknown kinds are kept as they
+    are, so a group opening anything more than SECURITY_GROUP_INGRESS never compares equal to it.
+    """
+    rules = set()
+    for permission in ip_permissions:
+        rule = (permission.get('IpProtocol'), permission.get('FromPort'), permission.get('ToPort'))
+        for key, sources in permission.items():
+            if key in INGRESS_RULE_KEYS or not sources:
+                continue
+            if key in INGRESS_SOURCE_KEYS:
+                rules.update(rule + (key, INGRESS_SOURCE_KEYS[key](source)) for source in sources)
+            else:
+                rules.add(rule + (key, repr(sources)))
+    return rules
+
+
+def _chunks(items, size):
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+_lookup_cache = None
+
+
+def get_lookup_cache():
+    """
+    Lazily builds the process wide cache of the VPC and security group ids resolved per credentials and region
+    :return: TTLCache
+    """
+    global _lookup_cache
+    if _lookup_cache is None:
+        _lookup_cache = TTLCache(max_size=settings.AWS_LOOKUP_CACHE_SIZE, ttl=settings.AWS_LOOKUP_CACHE_TTL)
+    return _lookup_cache
+
+
+_client_registry = None
+
+
+def get_client_registry():
+    """
+    Lazily builds the process wide registry of AmazonAPIWrapper instances. Wrappers are kept per credentials, region
+    and service, the least recently used ones are evicted once the registry is full and idle ones expire after
+    AWS_CLIENT_REGISTRY_TTL seconds.
+    :return: TTLCache
+    """
+    global _client_registry
+    if _client_registry is None:
+        _client_registry = TTLCache(max_size=settings.AWS_CLIENT_REGISTRY_SIZE,
+                                    ttl=settings.AWS_CLIENT_REGISTRY_TTL,
+                                    sliding=True)
+    return _client_registry
+
+
+def get_aws_client(client_id, client_secret, resource='ec2', region_name=DEFAULT_REGION):
+    """
+    Returns a warm AmazonAPIWrapper scoped to the given credentials, creating it on the first use
+    :param client_id: AWS credential
+    :param client_secret: AWS credential
+    :param resource: AWS service name
+    :param region_name: AWS region
+    :return: AmazonAPIWrapper or None if it could not be created
+    """
+    key = fingerprint(client_id, client_secret, region_name, resource)
     try:
-        if aws is None:
-            aws = AmazonAPIWrapper(client_id, client_secret, resource)
+        return get_client_registry().get_or_create(
+            key, lambda: AmazonAPIWrapper(client_id, client_secret, resource, region_name))
     except Exception as e:
         logger.warning(f'There has been an error creating a AWS client, {e}')
-        pass
-    return aws
+        return None
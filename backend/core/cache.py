@@ -0,0 +1,147 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+def fingerprint(*parts):
+    """
+    Builds a stable, non reversible key out of the given parts so secrets never have to be kept as dictionary keys
+    :param parts: values to be hashed, they are converted to str
+    :return: hex digest
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+class TTLCache(object):
+    """
+    Thread safe in-memory cache with optional LRU bound and time to live.
+
+    When sliding is True the expiration is pushed back every time an entry is read, so the TTL behaves as an idle
+    timeout, otherwise entries expire a fixed amount of time after being stored.
+    """
+
+    def __init__(self, max_size=None, ttl=None, sliding=False):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sliding = sliding
+
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        with self._lock:
+            self._purge_expired()
+            return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not _MISSING
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores the value under the given key, evicting the least recently used entries if the cache is full
+        :param key: to store the value under
+        :param value: to be stored
+        :param ttl: seconds the entry will live, by default the one given to the cache. None means no expiration
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._data[key] = (value, expires_at, ttl)
+            self._data.move_to_end(key)
+
+            if self.max_size is not None and len(self._data) > self.max_size:
+                self._purge_expired()
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+
+    def get_or_create(self, key, factory, ttl=None):
+        """
+        Returns the cached value for the key or stores the one built by factory. The factory runs outside the lock so
+        slow constructions do not block readers of other keys, if two threads race the first stored value wins.
+        :param key: to look up
+        :param factory: callable without arguments building the value
+        :param ttl: seconds the entry will live if it has to be created
+        :return: cached or newly created value
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        created = factory()
+
+        with self._lock:
+            # Another thread may have stored it while we were building ours
+            value = self._lookup(key)
+            if value is not _MISSING:
+                return value
+            self.set(key, created, ttl)
+        return created
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def _lookup(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+
+        value, expires_at, ttl = entry
+        now = time.monotonic()
+        if expires_at is not None and expires_at <= now:
+            del self._data[key]
+            self.expirations += 1
+            return _MISSING
+
+        if self.sliding and ttl is not None:
+            self._data[key] = (value, now + ttl, ttl)
+        self._data.move_to_end(key)
+        return value
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        expired = [key for key, (_, expires_at, _) in self._data.items()
+                   if expires_at is not None and expires_at <= now]
+        for key in expired:
+            del self._data[key]
+        self.expirations += len(expired)
@@ -21,3 +21,13 @@ class AWSPermissionDenied(AWSException):
 
 class OperationError(AWSException):
     pass
+
+
+class ServiceOverloaded(AWSException):
+    """
+    Raised instead of queueing more work once a bounded executor is full, retry_after tells clients when to try again
+    """
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message, status)
+        self.retry_after = retry_after
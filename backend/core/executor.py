@@ -0,0 +1,213 @@
+import logging
+import threading
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.status import HTTP_503_SERVICE_UNAVAILABLE, HTTP_504_GATEWAY_TIMEOUT
+
+from core.exceptions import OperationError, ServiceOverloaded
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedExecutor(object):
+    """
+    Thread pool that runs at most max_workers tasks at once and keeps at most max_queued waiting. Submissions over
+    that are rejected with ServiceOverloaded straight away instead of piling up, so an overloaded worker sheds load
+    with a 503 and a Retry-After rather than making every request slower.
+    """
+
+    def __init__(self, max_workers, max_queued, thread_name_prefix, retry_after=1,
+                 overloaded_message='There are too many operations in progress, please try again later'):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self.overloaded_message = overloaded_message
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queues function to be run by a worker
+        :return: Future
+        :raises ServiceOverloaded: if max_workers tasks are running and max_queued waiting
+        """
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queued:
+                raise ServiceOverloaded(self.overloaded_message, status=HTTP_503_SERVICE_UNAVAILABLE,
+                                        retry_after=self.retry_after)
+            self._in_flight += 1
+
+        try:
+            return self._executor.submit(self._run, function, args, kwargs)
+        except Exception:
+            self._done()
+            raise
+
+    def call(self, function, *args, timeout=None, **kwargs):
+        """
+        Runs function on a worker and waits for its result. The caller gives up after timeout seconds, the function
+        keeps its worker until it finishes.
+        :raises ServiceOverloaded: if the executor is full
+        :raises OperationError: 504 if the function did not finish in time
+        """
+        future = self.submit(function, *args, **kwargs)
+        try:
+            return future.result(timeout)
+        except futures.TimeoutError:
+            raise OperationError(f'The operation did not finish within {timeout} seconds',
+                                 status=HTTP_504_GATEWAY_TIMEOUT)
+
+    def stats(self):
+        with self._lock:
+            in_flight = self._in_flight
+        return {'in_flight': in_flight, 'max_workers': self.max_workers, 'max_queued': self.max_queued}
+
+    def _run(self, function, args, kwargs):
+        try:
+            return function(*args, **kwargs)
+        finally:
+            # Worker threads are not request threads, Django does not close their database connections by itself
+            close_old_connections()
+            self._done()
+
+    def _done(self):
+        with self._lock:
+            self._in_flight -= 1
+
+
+class ConcurrencyLimit(object):
+    """
+    Caps the requests doing their waiting on the request thread itself, long polls and streams, which cannot go through
+    a BoundedExecutor as they outlive EC2_REQUEST_TIMEOUT. Requests over the limit are rejected with ServiceOverloaded
+    straight away, so they cannot take every thread of the worker.
+    """
+
+    def __init__(self, limit, retry_after=1,
+                 overloaded_message='There are too many open streams, please try again later'):
+        self.limit = limit
+        self.retry_after = retry_after
+        self.overloaded_message = overloaded_message
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def acquire(self):
+        """
+        Takes a slot, it has to be given back with release
+        :raises ServiceOverloaded: if limit slots are taken
+        """
+        with self._lock:
+            if self._in_flight >= self.limit:
+                raise ServiceOverloaded(self.overloaded_message, status=HTTP_503_SERVICE_UNAVAILABLE,
+                                        retry_after=self.retry_after)
+            self._in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    @contextmanager
+    def hold(self):
+        """
+        Holds a slot for the duration of the block
+        :raises ServiceOverloaded: if limit slots are taken
+        """
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stream(self, iterable):
+        """
+        Gives back the slot already taken once the iterable is consumed or closed, e.g. the content of a
+        StreamingHttpResponse, which Django closes when the response is done
+        :return: iterable
+        """
+        return _ReleasingIterator(iterable, self.release)
+
+    def stats(self):
+        with self._lock:
+            in_flight = self._in_flight
+        return {'in_flight': in_flight, 'max_workers': self.limit, 'max_queued': 0}
+
+
+class _ReleasingIterator(object):
+
+    def __init__(self, iterable, release):
+        self._iterator = iter(iterable)
+        self._release = release
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        try:
+            if hasattr(self._iterator, 'close'):
+                self._iterator.close()
+        finally:
+            self._release()
+
+
+_request_executor = None
+_request_executor_lock = threading.Lock()
+
+
+def get_request_executor():
+    """
+    Lazily builds the executor running the AWS work of the requests served by the process, out of the EC2_REQUEST_*
+    settings
+    :return: BoundedExecutor
+    """
+    global _request_executor
+    if _request_executor is None:
+        with _request_executor_lock:
+            if _request_executor is None:
+                _request_executor = BoundedExecutor(max_workers=settings.EC2_REQUEST_WORKERS,
+                                                    max_queued=settings.EC2_REQUEST_QUEUE_SIZE,
+                                                    thread_name_prefix='aws-request',
+                                                    retry_after=settings.EC2_RETRY_AFTER)
+    return _request_executor
+
+
+def run_bounded(function, *args, **kwargs):
+    """
+    Runs the AWS work of a request on the request executor, waiting at most EC2_REQUEST_TIMEOUT seconds for it
+    """
+    return get_request_executor().call(function, *args, timeout=settings.EC2_REQUEST_TIMEOUT, **kwargs)
+
+
+_stream_limit = None
+_stream_limit_lock = threading.Lock()
+
+
+def get_stream_limit():
+    """
+    Lazily builds the limit of long polls and streams open at once in the process, out of EC2_STREAM_LIMIT
+    :return: ConcurrencyLimit
+    """
+    global _stream_limit
+    if _stream_limit is None:
+        with _stream_limit_lock:
+            if _stream_limit is None:
+                _stream_limit = ConcurrencyLimit(settings.EC2_STREAM_LIMIT, retry_after=settings.EC2_RETRY_AFTER)
+    return _stream_limit
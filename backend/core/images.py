@@ -0,0 +1,182 @@
+import logging
+import threading
+import time
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.status import HTTP_400_BAD_REQUEST
+
+from core.api import get_lookup_cache
+from core.cache import TTLCache
+from core.exceptions import OperationError, ServiceOverloaded
+from core.executor import BoundedExecutor
+from core.poller import SingleFlight
+from ec2.constants import WORDPRESS_AMIS
+from ec2.models import ResolvedImage
+
+logger = logging.getLogger(__name__)
+
+
+class ImageResolver(object):
+    """
+    Resolves, per region, the most recent Bitnami WordPress image, AMI ids being regional and Bitnami publishing new
+    ones every few weeks. Resolutions are cached for ttl seconds and, optionally, stored in the database so new worker
+    processes do not have to look them up again. Once older than refresh_after seconds they keep being served while a
+    refresh runs in the background, so describe_images, a slow call, stays off the launch path.
+
+    Public images are the same for everyone, a region is resolved with the client of the first launch needing it.
+    When the lookup fails the last image stored for the region is used, then the one pinned in WORDPRESS_AMIS.
+    """
+
+    def __init__(self, owners, name_pattern, ttl, refresh_after, retry_after=60, max_size=None, persist=False,
+                 max_workers=2, max_queued=16):
+        self.owners = owners
+        self.name_pattern = name_pattern
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self.retry_after = retry_after
+        self.persist = persist
+
+        self._images = TTLCache(max_size=max_size, ttl=ttl)
+        self._single_flight = SingleFlight()
+        self._executor = BoundedExecutor(max_workers, max_queued, thread_name_prefix='image-resolver')
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def resolve(self, aws_client):
+        """
+        Returns the WordPress image of the region of the client
+        :param aws_client: AmazonAPIWrapper of the launch, used only if the region has to be looked up
+        :return: id of the image
+        :raises OperationError: 400 if there is no image for the region
+        """
+        region_name = aws_client.region_name
+        entry = self._images.get(region_name)
+        if entry is None:
+            entry = self._single_flight.do(region_name, lambda: self._load(aws_client))
+        elif time.time() - entry['ResolvedAt'] > self.refresh_after:
+            self.refresh(aws_client)
+        return entry['ImageId']
+
+    def refresh(self, aws_client):
+        """
+        Queues a lookup of the image of the region of the client, unless one is already running or queued
+        :param aws_client: AmazonAPIWrapper to look the image up with
+        """
+        region_name = aws_client.region_name
+        with self._lock:
+            if region_name in self._refreshing:
+                return
+            self._refreshing.add(region_name)
+
+        try:
+            self._executor.submit(self._refresh, aws_client)
+        except ServiceOverloaded:
+            logger.warning(f'Too many image refreshes in progress, skipping {region_name}')
+            with self._lock:
+                self._refreshing.discard(region_name)
+
+    def stats(self):
+        return self._images.stats()
+
+    def _load(self, aws_client):
+        region_name = aws_client.region_name
+        stored = self._stored(region_name)
+        if stored is not None and time.time() - stored['ResolvedAt'] <= self.ttl:
+            self._images.set(region_name, stored)
+            if time.time() - stored['ResolvedAt'] > self.refresh_after:
+                self.refresh(aws_client)
+            return stored
+
+        try:
+            return self._look_up(aws_client)
+        except (ClientError, OperationError) as e:
+            fallback = stored or self._pinned(region_name)
+            if fallback is None:
+                raise
+            logger.warning(f'Could not look up the WordPress image of {region_name}, using {fallback["ImageId"]}, {e}')
+            # Looked up again after retry_after seconds instead of waiting for refresh_after
+            fallback = dict(fallback, ResolvedAt=time.time() - self.refresh_after + self.retry_after)
+            self._images.set(region_name, fallback, self.retry_after + self.ttl - self.refresh_after)
+            return fallback
+
+    def _refresh(self, aws_client):
+        try:
+            self._look_up(aws_client)
+        except Exception:
+            logger.exception(f'Error refreshing the WordPress image of {aws_client.region_name}')
+        finally:
+            with self._lock:
+                self._refreshing.discard(aws_client.region_name)
+
+    def _look_up(self, aws_client):
+        region_name = aws_client.region_name
+        image = aws_client.find_latest_image(self.owners, self.name_pattern)
+        if image is None:
+            raise OperationError(f'There is no WordPress image available in {region_name}',
+                                 status=HTTP_400_BAD_REQUEST)
+
+        entry = {'ImageId': image['ImageId'], 'Name': image.get('Name', ''),
+                 'CreationDate': image.get('CreationDate', ''), 'ResolvedAt': time.time()}
+        previous = self._images.get(region_name)
+        if previous is None or previous['ImageId'] != entry['ImageId']:
+            logger.info(f'WordPress image of {region_name} is {entry["ImageId"]} ({entry["Name"]})')
+        self._images.set(region_name, entry)
+        # Just described as available, the launch does not have to validate it again
+        get_lookup_cache().set((region_name, 'image', entry['ImageId']), True)
+        self._store(region_name, entry)
+        return entry
+
+    def _stored(self, region_name):
+        if not self.persist:
+            return None
+        try:
+            image = ResolvedImage.objects.filter(region=region_name).first()
+        except Exception:
+            logger.exception(f'Error reading the stored WordPress image of {region_name}')
+            return None
+        if image is None:
+            return None
+        return {'ImageId': image.image_id, 'Name': image.name, 'CreationDate': image.creation_date,
+                'ResolvedAt': image.resolved_at.timestamp()}
+
+    def _store(self, region_name, entry):
+        if not self.persist:
+            return
+        try:
+            ResolvedImage.objects.update_or_create(region=region_name, defaults={
+                'image_id': entry['ImageId'], 'name': entry['Name'], 'creation_date': entry['CreationDate'],
+                'resolved_at': timezone.now()})
+        except Exception:
+            logger.exception(f'Error storing the WordPress image of {region_name}')
+
+    @staticmethod
+    def _pinned(region_name):
+        image_id = WORDPRESS_AMIS.get(region_name)
+        if image_id is None:
+            return None
+        return {'ImageId': image_id, 'Name': '', 'CreationDate': '', 'ResolvedAt': 0}
+
+
+_image_resolver = None
+_image_resolver_lock = threading.Lock()
+
+
+def get_image_resolver():
+    """
+    Lazily builds the process wide ImageResolver out of the EC2_IMAGE_* settings
+    :return: ImageResolver
+    """
+    global _image_resolver
+    if _image_resolver is None:
+        with _image_resolver_lock:
+            if _image_resolver is None:
+                _image_resolver = ImageResolver(owners=settings.EC2_IMAGE_OWNERS,
+                                                name_pattern=settings.EC2_IMAGE_NAME_PATTERN,
+                                                ttl=settings.EC2_IMAGE_TTL,
+                                                refresh_after=settings.EC2_IMAGE_REFRESH_AFTER,
+                                                retry_after=settings.EC2_IMAGE_RETRY_AFTER,
+                                                max_size=settings.EC2_IMAGE_CACHE_SIZE,
+                                                persist=settings.EC2_IMAGE_PERSIST)
+    return _image_resolver
@@ -0,0 +1,231 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.poller import TRANSITIONAL_STATES
+from ec2.models import Instance, LaunchRecord
+
+logger = logging.getLogger(__name__)
+
+REFRESHED_FIELDS = ['state', 'state_code', 'instance_type', 'availability_zone', 'public_ip']
+
+
+class InstanceIndex(object):
+    """
+    Local index, in the database, of the instances launched by the launchpad. Launches and stops are written as they
+    happen so listings can be served without asking AWS. Rows older than EC2_INDEX_MAX_AGE seconds are refreshed with
+    a single describe_instances call, only the rows that actually changed being written back.
+    """
+
+    @staticmethod
+    def record_launch(aws_client, instances, ami, instance_type, requested, job_id='', pooled=False):
+        """
+        Stores a launch and the instances it created. Instances already indexed, e.g. returned again by an idempotent
+        launch, are left as they are.
+        :param aws_client: AmazonAPIWrapper the instances were launched with
+        :param instances: list of ec2 instances just created
+        :param ami: id of the image
+        :param instance_type: type of the instances
+        :param requested: number of instances requested
+        :param job_id: id of the launch job, if any
+        :param pooled: True if the instances are spares of the warm pool
+        """
+        if not settings.EC2_INDEX_ENABLED:
+            return
+
+        now = timezone.now()
+        with transaction.atomic():
+            launch = LaunchRecord.objects.create(credential_key=aws_client.credential_key, region=aws_client.region_name,
+                                                 job_id=job_id, ami=ami, instance_type=instance_type,
+                                                 requested=requested, launched=len(instances))
+            Instance.objects.bulk_create([
+                Instance(credential_key=aws_client.credential_key, region=aws_client.region_name,
+                         instance_id=instance.id, launch=launch,
+                         state=instance.state.get('Name', 'pending'), state_code=instance.state.get('Code'),
+                         instance_type=instance.instance_type,
+                         availability_zone=instance.placement.get('AvailabilityZone', ''),
+                         public_ip=instance.public_ip_address, refreshed_at=now, pooled=pooled)
+                for instance in instances
+            ], ignore_conflicts=True)
+
+    @staticmethod
+    def record_state(aws_client, instance_id, state):
+        """
+        Stores the state an instance was moved to, e.g. stopping after asking AWS to stop it
+        :param aws_client: AmazonAPIWrapper scoped to the instance owner
+        :param instance_id: id of the instance
+        :param state: state as returned by AWS, {'Code', 'Name'}
+        """
+        if not settings.EC2_INDEX_ENABLED:
+            return
+
+        Instance.objects.owned_by(aws_client.credential_key, aws_client.region_name) \
+            .filter(instance_id=instance_id) \
+            .update(state=state.get('Name', ''), state_code=state.get('Code'), refreshed_at=timezone.now())
+
+    @staticmethod
+    def list_instances(aws_client, states=None, instance_types=None, instance_ids=None, max_age=None):
+        """
+        Lists the indexed instances of the credentials and region, refreshing first the ones not checked with AWS for
+        more than max_age seconds
+        :param aws_client: AmazonAPIWrapper scoped to the instances owner
+        :param states: raw status names the instances must be in
+        :param instance_types: types the instances must be of
+        :param instance_ids: ids the instances must have
+        :param max_age: seconds, by default EC2_INDEX_MAX_AGE
+        :return: list of Instance
+        """
+        max_age = settings.EC2_INDEX_MAX_AGE if max_age is None else max_age
+        instances = Instance.objects.owned_by(aws_client.credential_key, aws_client.region_name).filter(pooled=False)
+        if instance_ids:
+            instances = instances.filter(instance_id__in=instance_ids)
+
+        stale = instances.live().filter(refreshed_at__lt=timezone.now() - timedelta(seconds=max_age))
+        InstanceIndex.refresh(aws_client, list(stale))
+
+        if states:
+            instances = instances.filter(state__in=states)
+        if instance_types:
+            instances = instances.filter(instance_type__in=instance_types)
+        return list(instances.order_by('-launched_at', 'instance_id'))
+
+    @staticmethod
+    def get_settled(aws_client, instance_ids, max_age=None):
+        """
+        Returns the indexed instances whose status can be served without asking AWS: not in a transitional state, as
+        those change within seconds, and checked with AWS less than max_age seconds ago
+        :param aws_client: AmazonAPIWrapper scoped to the instances owner
+        :param instance_ids: ids of the instances
+        :param max_age: seconds, by default EC2_INDEX_MAX_AGE
+        :return: dict instance id -> Instance, without the instances that have to be checked with AWS
+        """
+        if not settings.EC2_INDEX_ENABLED:
+            return {}
+
+        max_age = settings.EC2_INDEX_MAX_AGE if max_age is None else max_age
+        instances = Instance.objects.owned_by(aws_client.credential_key, aws_client.region_name) \
+            .filter(pooled=False, instance_id__in=instance_ids,
+                    refreshed_at__gte=timezone.now() - timedelta(seconds=max_age)) \
+            .exclude(state__in=TRANSITIONAL_STATES)
+        return {instance.instance_id: instance for instance in instances}
+
+    @staticmethod
+    def record_descriptions(aws_client, descriptions, checked_at=None):
+        """
+        Writes back to the indexed instances their descriptions just retrieved from AWS, e.g. by the instance state
+        poller, only the rows that changed being written. Instances that are not indexed are ignored.
+        :param aws_client: AmazonAPIWrapper scoped to the instances owner
+        :param descriptions: dict instance id -> description as returned by describe_instances
+        :param checked_at: datetime the descriptions were retrieved, by default now
+        """
+        if not settings.EC2_INDEX_ENABLED or not descriptions:
+            return
+
+        instances = Instance.objects.owned_by(aws_client.credential_key, aws_client.region_name) \
+            .filter(instance_id__in=list(descriptions))
+        InstanceIndex._apply(list(instances), descriptions, checked_at or timezone.now())
+
+    @staticmethod
+    def count_pooled(aws_client, instance_type):
+        """
+        Number of spares of the warm pool, ready or still being provisioned
+        :param aws_client: AmazonAPIWrapper scoped to the pool owner
+        :param instance_type: type of the instances
+        :return: int
+        """
+        return Instance.objects.owned_by(aws_client.credential_key, aws_client.region_name) \
+            .pooled(instance_type).live().count()
+
+    @staticmethod
+    def claim_pooled(aws_client, instance_type, count):
+        """
+        Takes up to count stopped spares out of the warm pool, oldest first. Each row is claimed with a conditional
+        update so concurrent launches, in this or any other worker, never get the same instance.
+        :param aws_client: AmazonAPIWrapper scoped to the pool owner
+        :param instance_type: type of the instances
+        :param count: maximum number of instances
+        :return: list of Instance claimed
+        """
+        candidates = Instance.objects.owned_by(aws_client.credential_key, aws_client.region_name) \
+            .pooled(instance_type).filter(state='stopped').order_by('launched_at')[:count]
+
+        claimed = []
+        for instance in candidates:
+            if Instance.objects.filter(pk=instance.pk, pooled=True).update(pooled=False):
+                instance.pooled = False
+                claimed.append(instance)
+        return claimed
+
+    @staticmethod
+    def release_pooled(aws_client, instance_ids, state=None):
+        """
+        Takes instances out of the warm pool, e.g. because they could not be provisioned, so they are listed as any
+        other instance of the credentials
+        :param aws_client: AmazonAPIWrapper scoped to the pool owner
+        :param instance_ids: ids of the instances
+        :param state: state as returned by AWS, {'Code', 'Name'}, if it is known
+        """
+        values = {'pooled': False}
+        if state is not None:
+            values.update(state=state.get('Name', ''), state_code=state.get('Code'), refreshed_at=timezone.now())
+        Instance.objects.owned_by(aws_client.credential_key, aws_client.region_name) \
+            .filter(instance_id__in=instance_ids).update(**values)
+
+    @staticmethod
+    def record_pooled_ready(aws_client, instance_ids):
+        """
+        Marks spares of the warm pool as stopped, that is ready to be claimed
+        :param aws_client: AmazonAPIWrapper scoped to the pool owner
+        :param instance_ids: ids of the instances
+        """
+        Instance.objects.owned_by(aws_client.credential_key, aws_client.region_name) \
+            .filter(instance_id__in=instance_ids, pooled=True) \
+            .update(state='stopped', state_code=80, public_ip=None, refreshed_at=timezone.now())
+
+    @staticmethod
+    def refresh(aws_client, instances):
+        """
+        Checks the given rows with AWS and writes back only the ones that changed. Instances AWS does not know anymore
+        are marked as terminated.
+        :param aws_client: AmazonAPIWrapper scoped to the instances owner
+        :param instances: list of Instance
+        :return: number of rows that changed
+        """
+        if not instances:
+            return 0
+
+        descriptions, errors = aws_client.describe_instances([instance.instance_id for instance in instances])
+        for instance in instances:
+            if instance.instance_id not in descriptions and \
+                    errors.get(instance.instance_id) == 'InvalidInstanceID.NotFound':
+                descriptions[instance.instance_id] = {'State': {'Name': 'terminated', 'Code': 48},
+                                                      'PublicIpAddress': None}
+
+        checked, changed = InstanceIndex._apply(instances, descriptions, timezone.now())
+        logger.info(f'Refreshed {checked} indexed instances in {aws_client.region_name}, {changed} changed')
+        return changed
+
+    @staticmethod
+    def _apply(instances, descriptions, checked_at):
+        """
+        Copies the descriptions to the rows and writes back the ones that changed
+        :return: tuple number of rows checked, number of rows that changed
+        """
+        changed = []
+        checked = []
+        for instance in instances:
+            description = descriptions.get(instance.instance_id)
+            if description is None:
+                continue
+            if instance.apply(description):
+                changed.append(instance)
+            checked.append(instance.pk)
+
+        with transaction.atomic():
+            if changed:
+                Instance.objects.bulk_update(changed, REFRESHED_FIELDS)
+            Instance.objects.filter(pk__in=checked).update(refreshed_at=checked_at)
+        return len(checked), len(changed)
@@ -0,0 +1,224 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.status import HTTP_500_INTERNAL_SERVER_ERROR
+
+from core.cache import TTLCache, fingerprint
+from core.exceptions import AWSException
+from core.executor import BoundedExecutor
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class Job(object):
+    """
+    Background operation whose progress is recorded step by step so it can be reported while it runs
+    """
+
+    def __init__(self, kind, on_change=None):
+        self.id = uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.steps = []
+        self.result = None
+        self.error = None
+        self.created_at = datetime.now(timezone.utc)
+        self.started_at = None
+        self.finished_at = None
+
+        self._on_change = on_change
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def step(self, name):
+        """
+        Records the execution of a step of the job: its status and how long it took
+        :param name: of the step
+        """
+        step = {'Name': name, 'Status': RUNNING, 'Duration': None}
+        with self._lock:
+            self.steps.append(step)
+        self.changed()
+
+        started = time.perf_counter()
+        try:
+            yield step
+        except Exception:
+            step['Status'] = FAILED
+            raise
+        else:
+            step['Status'] = SUCCEEDED
+        finally:
+            step['Duration'] = round(time.perf_counter() - started, 3)
+            self.changed()
+
+    def changed(self):
+        """
+        Notifies the progress of the job, e.g. so it is published to the other workers
+        """
+        if self._on_change is not None:
+            self._on_change(self)
+
+    def to_dict(self):
+        with self._lock:
+            steps = [dict(step) for step in self.steps]
+        return {
+            'JobId': self.id,
+            'Kind': self.kind,
+            'Status': self.status,
+            'Steps': steps,
+            'Result': self.result,
+            'Error': self.error,
+            'CreatedAt': self.created_at.isoformat(),
+            'StartedAt': self.started_at.isoformat() if self.started_at else None,
+            'FinishedAt': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class JobManager(object):
+    """
+    Runs jobs on a BoundedExecutor. Once max_workers jobs are running and max_queued are waiting, new submissions are
+    rejected instead of piling up. Finished jobs are kept for retention seconds so their outcome can
+    be queried. When a Django cache alias is given, the progress of the jobs is published there too so any worker
+    process can report it, not only the one running the job, and so are the deduplication keys of submit_once.
+    """
+
+    def __init__(self, max_workers, max_queued, retention, retry_after=1, cache_alias=None):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.retention = retention
+
+        self._executor = BoundedExecutor(max_workers, max_queued, thread_name_prefix='launch-job',
+                                         retry_after=retry_after)
+        self._jobs = TTLCache(ttl=retention)
+        self._shared = caches[cache_alias] if cache_alias else None
+        self._dedup = TTLCache(ttl=retention)
+        self._dedup_lock = threading.Lock()
+
+    def submit(self, kind, function, *args, **kwargs):
+        """
+        Queues function to be run by a worker. It receives the job as the keyword argument job so it can record its
+        steps, its return value is the result of the job.
+        :param kind: of job, e.g. launch
+        :param function: to be run
+        :return: Job
+        :raises ServiceOverloaded: if max_workers jobs are running and max_queued waiting
+        """
+        job = Job(kind, on_change=self._publish if self._shared is not None else None)
+        self._executor.submit(self._run, job, function, args, kwargs)
+        self._jobs.set(job.id, job)
+        job.changed()
+        return job
+
+    def submit_once(self, key, ttl, kind, function, *args, **kwargs):
+        """
+        Same as submit unless a job was submitted with the same key less than ttl seconds ago, then that job is
+        returned instead so duplicated requests join it rather than doing the work twice. Failed or expired jobs are
+        not joined, the work is submitted again. Duplicates reaching different workers at the very same time may both
+        be submitted, the work itself has to be idempotent too.
+        :param key: deduplication key, any tuple of str
+        :param ttl: seconds the key is remembered
+        :param kind: of job, e.g. launch
+        :param function: to be run, see submit
+        :return: tuple with the same dict as describe and True if the job was just submitted
+        :raises ServiceOverloaded: if max_workers jobs are running and max_queued waiting
+        """
+        cache_key = 'job-dedup:' + fingerprint(*key)
+        with self._dedup_lock:
+            job_id = self._dedup.get(cache_key)
+            if job_id is None and self._shared is not None:
+                job_id = self._shared.get(cache_key)
+            if job_id is not None:
+                existing = self.describe(job_id)
+                if existing is not None and existing['Status'] != FAILED:
+                    logger.info(f'Joining job {job_id} instead of submitting a duplicate')
+                    return existing, False
+
+            job = self.submit(kind, function, *args, **kwargs)
+            self._dedup.set(cache_key, job.id, ttl)
+            if self._shared is not None:
+                try:
+                    self._shared.set(cache_key, job.id, ttl)
+                except Exception:
+                    logger.exception(f'Error publishing the deduplication key of job {job.id}')
+        return job.to_dict(), True
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def describe(self, job_id):
+        """
+        Returns the progress of a job run by this process or, if there is a shared cache, by any other
+        :param job_id: id of the job
+        :return: same dict as Job.to_dict or None if the job does not exist or it already expired
+        """
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self._shared is not None:
+            return self._shared.get(self._cache_key(job_id))
+        return None
+
+    def stats(self):
+        return self._executor.stats()
+
+    def _run(self, job, function, args, kwargs):
+        job.status = RUNNING
+        job.started_at = datetime.now(timezone.utc)
+        job.changed()
+        try:
+            job.result = function(*args, job=job, **kwargs)
+            job.status = SUCCEEDED
+        except AWSException as aws_e:
+            job.error = {'Message': str(aws_e), 'Status': aws_e.status}
+            job.status = FAILED
+        except Exception as e:
+            logger.exception(f'Job {job.id} failed')
+            job.error = {'Message': str(e), 'Status': HTTP_500_INTERNAL_SERVER_ERROR}
+            job.status = FAILED
+        finally:
+            job.finished_at = datetime.now(timezone.utc)
+            job.changed()
+
+    def _publish(self, job):
+        try:
+            self._shared.set(self._cache_key(job.id), job.to_dict(), self.retention)
+        except Exception:
+            logger.exception(f'Error publishing the progress of job {job.id}')
+
+    @staticmethod
+    def _cache_key(job_id):
+        return 'launch-job:' + job_id
+
+
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """
+    Lazily builds the process wide JobManager out of the EC2_LAUNCH_* settings. Jobs are only known by the process
+    running them unless EC2_JOB_CACHE_ALIAS names a Django cache shared between workers.
+    :return: JobManager
+    """
+    global _job_manager
+    if _job_manager is None:
+        with _job_manager_lock:
+            if _job_manager is None:
+                _job_manager = JobManager(max_workers=settings.EC2_LAUNCH_WORKERS,
+                                          max_queued=settings.EC2_LAUNCH_QUEUE_SIZE,
+                                          retention=settings.EC2_LAUNCH_JOB_RETENTION,
+                                          retry_after=settings.EC2_RETRY_AFTER,
+                                          cache_alias=settings.EC2_JOB_CACHE_ALIAS)
+    return _job_manager
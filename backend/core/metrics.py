@@ -0,0 +1,249 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+THROTTLING_ERROR_CODES = ('RequestLimitExceeded', 'Throttling', 'ThrottlingException', 'RequestThrottled',
+                          'TooManyRequestsException')
+
+
+class Counter(object):
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_values(self, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.label_names, key)), value
+
+
+class Histogram(object):
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = _label_values(self, labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', dict(labels, le=_format_value(bound)), cumulative
+            yield f'{self.name}_count', labels, cumulative
+            yield f'{self.name}_sum', labels, total
+
+
+class Gauge(object):
+    """
+    Value read when the metrics are scraped, out of a callable returning a dict label values tuple -> value
+    """
+
+    def __init__(self, name, documentation, label_names, collect):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._collect = collect
+
+    def samples(self):
+        try:
+            values = self._collect()
+        except Exception:
+            logger.exception(f'Error collecting {self.name}')
+            return
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.label_names, key)), value
+
+
+class MetricsRegistry(object):
+    """
+    Metrics of the process, rendered in the Prometheus text exposition format. Every worker process keeps its own
+    registry, so each one has to be scraped on its own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def counter(self, name, documentation, label_names=()):
+        return self._register(name, lambda: Counter(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(name, lambda: Histogram(name, documentation, label_names, buckets))
+
+    def gauge(self, name, documentation, label_names, collect):
+        return self._register(name, lambda: Gauge(name, documentation, label_names, collect))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            kind = type(metric).__name__.lower()
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, name, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+
+def _label_values(metric, labels):
+    return tuple(str(labels.get(label_name, '')) for label_name in metric.label_names)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = {name: str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+               for name, value in labels.items()}
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped.items()) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class AWSCallMetrics(object):
+    """
+    botocore event handlers recording, per service and operation, the number of calls and their outcome, their
+    latency, the retries and the throttled attempts. DryRun calls are labelled apart from real ones.
+    """
+
+    def __init__(self, registry):
+        self.calls = registry.counter('aws_calls_total', 'AWS API calls by outcome, error code or ok',
+                                      ('service', 'operation', 'dry_run', 'outcome'))
+        self.latency = registry.histogram('aws_call_duration_seconds', 'AWS API call latency, retries included',
+                                          ('service', 'operation', 'dry_run'))
+        self.retries = registry.counter('aws_retries_total', 'AWS API call attempts that were retried',
+                                        ('service', 'operation'))
+        self.throttles = registry.counter('aws_throttles_total', 'AWS API call attempts rejected by throttling',
+                                          ('service', 'operation'))
+
+    def instrument(self, client):
+        """
+        Registers the handlers on the events of a boto3 client
+        :param client: boto3 client, for resources resource.meta.client
+        """
+        events = client.meta.events
+        events.register('before-parameter-build', self._before_parameter_build, unique_id='metrics-parameters')
+        events.register('before-call', self._before_call, unique_id='metrics-before-call')
+        events.register('after-call', self._after_call, unique_id='metrics-after-call')
+        events.register('after-call-error', self._after_call_error, unique_id='metrics-after-call-error')
+        events.register('needs-retry', self._needs_retry, unique_id='metrics-needs-retry')
+
+    @staticmethod
+    def _before_parameter_build(params, context, **kwargs):
+        context['metrics_dry_run'] = bool(params.get('DryRun'))
+
+    @staticmethod
+    def _before_call(model, context, **kwargs):
+        context['metrics_operation'] = (model.service_model.service_name, model.name)
+        context['metrics_started'] = time.perf_counter()
+
+    def _after_call(self, parsed, context, **kwargs):
+        outcome = parsed.get('Error', {}).get('Code') or 'ok'
+        self._record(context, outcome, parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0))
+
+    def _after_call_error(self, exception, context, **kwargs):
+        self._record(context, type(exception).__name__, 0)
+
+    def _record(self, context, outcome, retries):
+        if 'metrics_started' not in context:
+            return
+        service, operation = context['metrics_operation']
+        dry_run = 'true' if context.get('metrics_dry_run') else 'false'
+        self.calls.inc(service=service, operation=operation, dry_run=dry_run, outcome=outcome)
+        self.latency.observe(time.perf_counter() - context['metrics_started'], service=service, operation=operation,
+                             dry_run=dry_run)
+        if retries:
+            self.retries.inc(retries, service=service, operation=operation)
+
+    def _needs_retry(self, response, operation, **kwargs):
+        if response is not None:
+            error_code = response[1].get('Error', {}).get('Code')
+            if error_code in THROTTLING_ERROR_CODES:
+                self.throttles.inc(service=operation.service_model.service_name, operation=operation.name)
+        return None
+
+
+_registry = None
+_aws_call_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def metrics_enabled():
+    return settings.METRICS_ENABLED
+
+
+def get_metrics_registry():
+    """
+    Lazily builds the process wide MetricsRegistry
+    :return: MetricsRegistry
+    """
+    global _registry
+    if _registry is None:
+        with _metrics_lock:
+            if _registry is None:
+                _registry = MetricsRegistry()
+    return _registry
+
+
+def instrument_client(client):
+    """
+    Records the metrics of every call made by the client, only if METRICS_ENABLED so there is no cost otherwise
+    :param client: boto3 client
+    :return: the same client
+    """
+    global _aws_call_metrics
+    if not metrics_enabled():
+        return client
+    if _aws_call_metrics is None:
+        registry = get_metrics_registry()
+        with _metrics_lock:
+            if _aws_call_metrics is None:
+                _aws_call_metrics = AWSCallMetrics(registry)
+    _aws_call_metrics.instrument(client)
+    return client
@@ -0,0 +1,30 @@
+import time
+
+from django.core.exceptions import MiddlewareNotUsed
+
+from core.metrics import get_metrics_registry, metrics_enabled
+
+
+class RequestMetricsMiddleware(object):
+    """
+    Records the latency of the requests served by the ec2 views, per view, method and status. For streaming responses
+    it is the time until the response starts. Unloaded when METRICS_ENABLED is off.
+    """
+
+    def __init__(self, get_response):
+        if not metrics_enabled():
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.latency = get_metrics_registry().histogram('http_request_duration_seconds',
+                                                        'Latency of the requests served by the ec2 views',
+                                                        ('view', 'method', 'status'))
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        if match is not None and match.namespace == 'ec2':
+            self.latency.observe(time.perf_counter() - started, view=match.url_name, method=request.method,
+                                 status=response.status_code)
+        return response
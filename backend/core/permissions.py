@@ -0,0 +1,92 @@
+import logging
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+
+from core.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+DENIED_ERROR_CODES = ('UnauthorizedOperation', 'AuthFailure')
+INVALID_CREDENTIALS_ERROR_CODES = ('InvalidClientTokenId', 'SignatureDoesNotMatch', 'AuthFailure')
+
+
+class PermissionCache(object):
+    """
+    Remembers the outcome of DryRun calls per credentials, region and action so the permission check is paid once
+    instead of before every operation. Denials are remembered too, so requests that are going to fail anyway fail fast
+    without reaching AWS, but for a shorter time so a freshly granted policy is picked up soon.
+    """
+
+    def __init__(self, enabled=True, ttl=None, denied_ttl=None, max_size=None):
+        self.enabled = enabled
+        self.denied_ttl = denied_ttl
+        self._verdicts = TTLCache(max_size=max_size, ttl=ttl)
+
+    def check(self, credential_key, region_name, action, dry_run):
+        """
+        Makes sure the credentials are allowed to perform the action, calling dry_run only if there is no verdict cached
+        :param credential_key: fingerprint of the credentials
+        :param region_name: AWS region
+        :param action: EC2 API action name, e.g. RunInstances
+        :param dry_run: callable issuing the DryRun version of the call
+        :raises ClientError: if the credentials are not allowed to perform the action
+        """
+        if not self.enabled:
+            self._dry_run(dry_run)
+            return
+
+        key = (credential_key, region_name, action)
+        verdict = self._verdicts.get(key)
+        if verdict is True:
+            return
+        if verdict is not None:
+            raise ClientError(verdict.response, verdict.operation_name)
+
+        try:
+            self._dry_run(dry_run)
+        except ClientError as e:
+            if _error_code(e) in DENIED_ERROR_CODES:
+                logger.info(f'Caching permission denied for {action} in {region_name}')
+                self._verdicts.set(key, e, self.denied_ttl)
+            raise
+
+        self._verdicts.set(key, True)
+
+    def forget(self, credential_key, region_name, action):
+        self._verdicts.pop((credential_key, region_name, action))
+
+    def clear(self):
+        self._verdicts.clear()
+
+    def stats(self):
+        return self._verdicts.stats()
+
+    @staticmethod
+    def _dry_run(dry_run):
+        try:
+            dry_run()
+        except ClientError as e:
+            if _error_code(e) != 'DryRunOperation':
+                raise
+
+
+def _error_code(error):
+    return error.response.get('Error', {}).get('Code', '')
+
+
+_permission_cache = None
+
+
+def get_permission_cache():
+    """
+    Lazily builds the process wide PermissionCache out of the AWS_DRY_RUN_CACHE_* settings
+    :return: PermissionCache
+    """
+    global _permission_cache
+    if _permission_cache is None:
+        _permission_cache = PermissionCache(enabled=settings.AWS_DRY_RUN_CACHE_ENABLED,
+                                            ttl=settings.AWS_DRY_RUN_CACHE_TTL,
+                                            denied_ttl=settings.AWS_DRY_RUN_CACHE_DENIED_TTL,
+                                            max_size=settings.AWS_DRY_RUN_CACHE_SIZE)
+    return _permission_cache
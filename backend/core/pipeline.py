@@ -0,0 +1,162 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+
+from core.cache import fingerprint
+from ec2.constants import WORDPRESS_AMI, DEFAULT_INSTANCE_TYPE, SECURITY_GROUP_NAME
+
+logger = logging.getLogger(__name__)
+
+
+class LaunchPipeline(object):
+    """
+    Launch of instances as an explicit pipeline of steps.
+
+    1) Preflight: the steps that do not depend on each other run concurrently on a bounded executor: the VPC lookup,
+    the lookup of reusable security groups, the RunInstances permission check and the AMI validation.
+    2) Launch: the dependent steps are chained afterwards, creating the security group and its ingress rules only if
+    none could be reused, then running the instances.
+
+    The duration of every step is kept in timings and, when a job is given, recorded as one of its steps.
+    """
+
+    def __init__(self, aws_client, count=1, instance_type=DEFAULT_INSTANCE_TYPE, ami=WORDPRESS_AMI, client_token=None,
+                 job=None, executor=None):
+        self.aws_client = aws_client
+        self.count = count
+        self.instance_type = instance_type
+        self.ami = ami
+        self.client_token = client_token
+        self.job = job
+        self.executor = executor or get_pipeline_executor()
+
+        self.timings = {}
+        self._timings_lock = threading.Lock()
+
+    def run(self):
+        """
+        Runs the whole pipeline
+        :return: same tuple as AmazonAPIWrapper.create_vm, the instances and the errors of the calls that failed
+        """
+        started = time.perf_counter()
+
+        security_group_id = self.preflight()
+        try:
+            result = self.launch(security_group_id)
+        except ClientError as e:
+            error_code = e.response.get('Error', {}).get('Code', '')
+            if error_code == 'IdempotentParameterMismatch' and self.client_token:
+                # A previous run of this launch was retried with another security group, see below, replay that one
+                result = self.launch(security_group_id, self._retry_token(security_group_id))
+            elif error_code == 'InvalidGroup.NotFound':
+                # The cached security group was deleted meanwhile, resolve it again
+                logger.info(f'Security group {security_group_id} does not exist anymore, resolving it again')
+                self.aws_client.forget_lookups()
+                security_group_id = self.aws_client.resolve_security_group()
+                result = self.launch(security_group_id, self._retry_token(security_group_id))
+            else:
+                raise
+
+        self._record('total', time.perf_counter() - started)
+        return result
+
+    def preflight(self):
+        """
+        Runs the independent steps concurrently and, out of their results, resolves the security group to use
+        :return: id of the security group
+        """
+        aws_client = self.aws_client
+
+        security_group_id = aws_client.get_cached_security_group()
+        futures = {
+            'validate-image': self.executor.submit(self._step, 'validate-image', aws_client.validate_image, self.ami),
+            'check-permissions': self.executor.submit(self._step, 'check-permissions',
+                                                      aws_client.check_launch_permission, self.ami, self.instance_type),
+        }
+        if security_group_id is None:
+            futures['vpc'] = self.executor.submit(self._step, 'vpc', aws_client.get_vpc_id)
+            futures['find-security-group'] = self.executor.submit(self._step, 'find-security-group',
+                                                                  aws_client.find_security_groups)
+
+        # Every step is waited for so none keeps running once the pipeline failed, the first error is raised
+        results = {}
+        error = None
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+        if security_group_id is not None:
+            return security_group_id
+
+        vpc_id = results['vpc']
+        security_groups = results['find-security-group']
+        security_group_id = aws_client.pick_security_group(security_groups, vpc_id)
+
+        if security_group_id is None:
+            name_taken = any(group.get('GroupName') == SECURITY_GROUP_NAME for group in security_groups)
+            security_group_id = self._step('create-security-group', aws_client.create_security_group, vpc_id,
+                                           name_taken)
+
+        aws_client.cache_security_group(security_group_id)
+        return security_group_id
+
+    def launch(self, security_group_id, client_token=None):
+        return self._step('run-instances', self.aws_client.create_vm, security_group_id, self.ami,
+                          self.instance_type, self.count, client_token or self.client_token)
+
+    def _retry_token(self, security_group_id):
+        """
+        EC2 rejects a ClientToken used again with other parameters, a launch retried with another security group gets
+        its own token, derived from the group so running the launch again is still idempotent
+        """
+        if not self.client_token:
+            return None
+        return fingerprint(self.client_token, security_group_id)
+
+    def _step(self, name, function, *args):
+        started = time.perf_counter()
+        try:
+            with self._job_step(name):
+                return function(*args)
+        finally:
+            self._record(name, time.perf_counter() - started)
+
+    @contextmanager
+    def _job_step(self, name):
+        if self.job is None:
+            yield
+        else:
+            with self.job.step(name):
+                yield
+
+    def _record(self, name, duration):
+        with self._timings_lock:
+            self.timings[name] = round(duration, 4)
+
+
+_pipeline_executor = None
+_pipeline_executor_lock = threading.Lock()
+
+
+def get_pipeline_executor():
+    """
+    Lazily builds the executor running the preflight steps of every launch of the process, bounded by
+    EC2_PIPELINE_WORKERS threads
+    :return: ThreadPoolExecutor
+    """
+    global _pipeline_executor
+    if _pipeline_executor is None:
+        with _pipeline_executor_lock:
+            if _pipeline_executor is None:
+                _pipeline_executor = ThreadPoolExecutor(max_workers=settings.EC2_PIPELINE_WORKERS,
+                                                        thread_name_prefix='launch-pipeline')
+    return _pipeline_executor
@@ -0,0 +1,297 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+# States that are expected to change soon, instances in these states are polled faster
+TRANSITIONAL_STATES = ('pending', 'stopping', 'shutting-down')
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls sharing a key: the first caller runs the function and the rest wait for its result
+    instead of running it again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class LocalStateStore(object):
+    """
+    Keeps the instance descriptions in the memory of the process
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class CacheStateStore(object):
+    """
+    Keeps the instance descriptions in a Django cache so every worker shares them, e.g. a DatabaseCache on Postgres
+    """
+
+    def __init__(self, alias, timeout):
+        self._cache = caches[alias]
+        self._timeout = timeout
+
+    def get(self, key):
+        return self._cache.get(self._cache_key(key))
+
+    def set(self, key, entry):
+        self._cache.set(self._cache_key(key), entry, self._timeout)
+
+    def delete(self, key):
+        self._cache.delete(self._cache_key(key))
+
+    @staticmethod
+    def _cache_key(key):
+        return 'ec2-state:' + ':'.join(key)
+
+
+class InstanceStatePoller(object):
+    """
+    Serves the status of instances out of a state cache refreshed by a background thread.
+
+    Every instance read through the poller is watched for EC2_POLLER_IDLE_TIMEOUT seconds since its last read. On each
+    tick the poller groups the watched instances that are due per credentials and region and refreshes each group with
+    a single describe_instances call. Instances in a transitional state are refreshed every EC2_POLLER_FAST_INTERVAL
+    seconds, the rest every EC2_POLLER_SLOW_INTERVAL. Reads whose cached entry is older than that interval fetch it
+    themselves, identical concurrent fetches being coalesced into a single call.
+    """
+
+    def __init__(self, store, fast_interval, slow_interval, idle_timeout, tick=0.5):
+        self.store = store
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.idle_timeout = idle_timeout
+        self.tick = tick
+
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+        self._fetched = threading.Condition()
+        self._groups = {}
+        self._thread = None
+
+    def get_instances(self, aws_client, instance_ids, max_age=None):
+        """
+        Returns the description of the given instances, from the state cache when it is fresh enough
+        :param aws_client: AmazonAPIWrapper scoped to the instances owner
+        :param instance_ids: list of instance ids
+        :param max_age: seconds a cached description is acceptable, by default the polling interval of its state
+        :return: tuple with a dict instance id -> (description, age in seconds) and a dict instance id -> error code
+        """
+        self._ensure_running()
+
+        now = time.monotonic()
+        instances = {}
+        missing = []
+        for instance_id in instance_ids:
+            entry = self.store.get(self._key(aws_client, instance_id))
+            if entry is not None:
+                description, fetched_at = entry
+                age = time.time() - fetched_at
+                if age <= (self._interval(description) + self.tick if max_age is None else max_age):
+                    instances[instance_id] = (description, age)
+                    continue
+            missing.append(instance_id)
+
+        errors = {}
+        if missing:
+            fetched, errors = self._fetch(aws_client, missing)
+            instances.update({instance_id: (description, 0.0) for instance_id, description in fetched.items()})
+
+        self._watch(aws_client, instances, now)
+        return instances, errors
+
+    def wait_for(self, aws_client, instance_id, predicate, timeout):
+        """
+        Waits until the description of an instance satisfies predicate or timeout seconds pass. Waiters do not call AWS
+        on their own, they are woken up every time the poller fetches descriptions and check the state cache again, so
+        any number of them share the polling of the instance.
+        :param aws_client: AmazonAPIWrapper scoped to the instance owner
+        :param instance_id: id of the instance
+        :param predicate: callable receiving the instance description
+        :param timeout: seconds
+        :return: same tuple as get_instances, for the last description seen
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            instances, errors = self.get_instances(aws_client, [instance_id])
+            remaining = deadline - time.monotonic()
+            if instance_id not in instances or predicate(instances[instance_id][0]) or remaining <= 0:
+                return instances, errors
+
+            with self._fetched:
+                self._fetched.wait(min(remaining, self.fast_interval))
+
+    def forget(self, aws_client, instance_id):
+        """
+        Drops the cached description of an instance, e.g. after asking AWS to change its state, so the next read
+        fetches it again and it is polled fast from then on
+        """
+        self.store.delete(self._key(aws_client, instance_id))
+        with self._lock:
+            group = self._groups.get((aws_client.credential_key, aws_client.region_name))
+            if group is not None and instance_id in group['watches']:
+                group['watches'][instance_id].update(next_poll=0, interval=self.fast_interval)
+
+    def _fetch(self, aws_client, instance_ids):
+        key = (aws_client.credential_key, aws_client.region_name, tuple(sorted(instance_ids)))
+
+        def describe():
+            instances, errors = aws_client.describe_instances(instance_ids)
+            fetched_at = time.time()
+            for instance_id, description in instances.items():
+                self.store.set(self._key(aws_client, instance_id), (description, fetched_at))
+            with self._fetched:
+                self._fetched.notify_all()
+            return instances, errors
+
+        return self._flights.do(key, describe)
+
+    def _watch(self, aws_client, instances, now):
+        with self._lock:
+            group = self._groups.setdefault((aws_client.credential_key, aws_client.region_name),
+                                            {'client': aws_client, 'watches': {}})
+            group['client'] = aws_client
+            for instance_id, (description, age) in instances.items():
+                interval = self._interval(description)
+                watch = group['watches'].setdefault(instance_id, {'next_poll': now + interval - age})
+                watch.update(last_read=now, interval=interval)
+
+    def _ensure_running(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ec2-state-poller', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            try:
+                self._poll()
+            except Exception:
+                logger.exception('Error polling the state of the watched instances')
+
+    def _poll(self):
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            for group_key, group in list(self._groups.items()):
+                watches = group['watches']
+                for instance_id in [instance_id for instance_id, watch in watches.items()
+                                    if now - watch['last_read'] > self.idle_timeout]:
+                    del watches[instance_id]
+                    self.store.delete(group_key + (instance_id,))
+                if not watches:
+                    del self._groups[group_key]
+                    continue
+
+                instance_ids = [instance_id for instance_id, watch in watches.items() if watch['next_poll'] <= now]
+                if instance_ids:
+                    due.append((group['client'], instance_ids))
+
+        for aws_client, instance_ids in due:
+            try:
+                instances, _ = self._fetch(aws_client, instance_ids)
+            except Exception as e:
+                logger.warning(f'Error refreshing {len(instance_ids)} instances in {aws_client.region_name}, {e}')
+                instances = {}
+
+            with self._lock:
+                group = self._groups.get((aws_client.credential_key, aws_client.region_name))
+                if group is None:
+                    continue
+                for instance_id in instance_ids:
+                    watch = group['watches'].get(instance_id)
+                    if watch is None:
+                        continue
+                    if instance_id in instances:
+                        watch['interval'] = self._interval(instances[instance_id])
+                    watch['next_poll'] = now + watch['interval']
+
+    def _interval(self, description):
+        state = description.get('State', {}).get('Name')
+        return self.fast_interval if state in TRANSITIONAL_STATES else self.slow_interval
+
+    @staticmethod
+    def _key(aws_client, instance_id):
+        return aws_client.credential_key, aws_client.region_name, instance_id
+
+
+_instance_poller = None
+_instance_poller_lock = threading.Lock()
+
+
+def get_instance_poller():
+    """
+    Lazily builds the process wide InstanceStatePoller out of the EC2_POLLER_* settings. The state is kept in memory
+    unless EC2_STATE_CACHE_ALIAS names a Django cache to share it between workers.
+    :return: InstanceStatePoller
+    """
+    global _instance_poller
+    if _instance_poller is None:
+        with _instance_poller_lock:
+            if _instance_poller is None:
+                if settings.EC2_STATE_CACHE_ALIAS:
+                    store = CacheStateStore(settings.EC2_STATE_CACHE_ALIAS, timeout=settings.EC2_POLLER_IDLE_TIMEOUT)
+                else:
+                    store = LocalStateStore()
+                _instance_poller = InstanceStatePoller(store,
+                                                       fast_interval=settings.EC2_POLLER_FAST_INTERVAL,
+                                                       slow_interval=settings.EC2_POLLER_SLOW_INTERVAL,
+                                                       idle_timeout=settings.EC2_POLLER_IDLE_TIMEOUT)
+    return _instance_poller
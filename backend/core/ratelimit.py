@@ -0,0 +1,140 @@
+import logging
+import math
+import random
+import threading
+import time
+from functools import partial
+
+from django.conf import settings
+from rest_framework.status import HTTP_429_TOO_MANY_REQUESTS
+
+from core.cache import TTLCache
+from core.exceptions import ServiceOverloaded
+from core.metrics import get_metrics_registry, metrics_enabled
+
+logger = logging.getLogger(__name__)
+
+DESCRIBE = 'describe'
+MUTATE = 'mutate'
+# EC2 throttles non mutating actions (Describe*, Get*, ...) and mutating ones in separate buckets
+DESCRIBE_PREFIXES = ('Describe', 'Get', 'List')
+
+
+class TokenBucket(object):
+    """
+    Token bucket refilled with rate tokens per second up to capacity. Callers reserve a token and are told how long to
+    wait for it, so waiting callers are served in order at the refill rate instead of all retrying at once.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait):
+        """
+        Reserves a token
+        :param max_wait: seconds the caller accepts to wait for it
+        :return: seconds to wait before using the token or None if that is over max_wait, nothing is reserved then
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+
+class RateGovernor(object):
+    """
+    Keeps the EC2 calls of every account and region under a request rate, with separate budgets for describe and
+    mutating calls as EC2 has. Calls over the budget wait for their turn, with some jitter, so throughput degrades
+    gracefully instead of being throttled by AWS. Calls that would wait over max_wait seconds are rejected with a 429.
+
+    Budgets are per process, with several worker processes each one should get its share of the account limits.
+    """
+
+    def __init__(self, describe_rate, describe_burst, mutate_rate, mutate_burst, max_wait, max_size=None, ttl=None):
+        self.budgets = {DESCRIBE: (describe_rate, describe_burst), MUTATE: (mutate_rate, mutate_burst)}
+        self.max_wait = max_wait
+        self._buckets = TTLCache(max_size=max_size, ttl=ttl, sliding=True)
+
+        if metrics_enabled():
+            registry = get_metrics_registry()
+            self._queued = registry.counter('aws_rate_limited_total',
+                                            'AWS API calls that waited for the rate governor or were rejected',
+                                            ('kind', 'outcome'))
+            self._wait = registry.histogram('aws_rate_limit_wait_seconds', 'Time AWS API calls waited for their turn',
+                                            ('kind',))
+        else:
+            self._queued = self._wait = None
+
+    def install(self, client, account, region_name):
+        """
+        Makes every attempt of every call of the client, retries included, go through the governor
+        :param client: boto3 client
+        :param account: fingerprint of the credentials
+        :param region_name: AWS region
+        """
+        client.meta.events.register('before-send', partial(self._before_send, account, region_name),
+                                    unique_id='rate-governor')
+
+    def acquire(self, account, region_name, operation):
+        """
+        Waits for the turn of a call
+        :param account: fingerprint of the credentials
+        :param region_name: AWS region
+        :param operation: name of the API action, e.g. DescribeInstances
+        :raises ServiceOverloaded: 429 if the call would have to wait over max_wait seconds
+        """
+        kind = DESCRIBE if operation.startswith(DESCRIBE_PREFIXES) else MUTATE
+        bucket = self._buckets.get_or_create((account, region_name, kind), lambda: TokenBucket(*self.budgets[kind]))
+
+        wait = bucket.reserve(self.max_wait)
+        if wait is None:
+            if self._queued is not None:
+                self._queued.inc(kind=kind, outcome='rejected')
+            raise ServiceOverloaded('Too many AWS requests for this account, please try again later',
+                                    status=HTTP_429_TOO_MANY_REQUESTS,
+                                    retry_after=math.ceil(self.max_wait))
+        if wait > 0:
+            wait += random.uniform(0, 1 / bucket.rate)
+            if self._queued is not None:
+                self._queued.inc(kind=kind, outcome='queued')
+                self._wait.observe(wait, kind=kind)
+            time.sleep(wait)
+
+    def _before_send(self, account, region_name, event_name, **kwargs):
+        # before-send.<service>.<operation>
+        self.acquire(account, region_name, event_name.rsplit('.', 1)[-1])
+
+
+_rate_governor = None
+_rate_governor_lock = threading.Lock()
+
+
+def get_rate_governor():
+    """
+    Lazily builds the process wide RateGovernor out of the AWS_RATE_LIMIT_* settings
+    :return: RateGovernor or None if rate limiting is disabled
+    """
+    global _rate_governor
+    if not settings.AWS_RATE_LIMIT_ENABLED:
+        return None
+    if _rate_governor is None:
+        with _rate_governor_lock:
+            if _rate_governor is None:
+                _rate_governor = RateGovernor(describe_rate=settings.AWS_RATE_LIMIT_DESCRIBE_RATE,
+                                              describe_burst=settings.AWS_RATE_LIMIT_DESCRIBE_BURST,
+                                              mutate_rate=settings.AWS_RATE_LIMIT_MUTATE_RATE,
+                                              mutate_burst=settings.AWS_RATE_LIMIT_MUTATE_BURST,
+                                              max_wait=settings.AWS_RATE_LIMIT_MAX_WAIT,
+                                              max_size=settings.AWS_CLIENT_REGISTRY_SIZE * 4,
+                                              ttl=settings.AWS_CLIENT_REGISTRY_TTL)
+    return _rate_governor
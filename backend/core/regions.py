@@ -0,0 +1,59 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def fan_out(regions, function, timeout=None):
+    """
+    Runs function once per region concurrently and yields the outcomes as they arrive, so the whole operation takes
+    about as long as the slowest region instead of the sum of all of them. Regions that do not answer within the
+    timeout are reported as failed, their calls are left to finish in the background.
+    :param regions: list of region names
+    :param function: callable receiving the region name
+    :param timeout: seconds to wait for all the regions, by default EC2_REGION_TIMEOUT
+    :return: generator of (region, result, error, duration) tuples, error being None on success
+    """
+    timeout = settings.EC2_REGION_TIMEOUT if timeout is None else timeout
+    executor = get_region_executor()
+
+    started = time.perf_counter()
+    futures = {executor.submit(function, region): region for region in regions}
+    pending = set(futures)
+
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            pending.discard(future)
+            region = futures[future]
+            duration = time.perf_counter() - started
+            try:
+                yield region, future.result(), None, duration
+            except Exception as e:
+                logger.warning(f'Error querying region {region}, {e}')
+                yield region, None, e, duration
+    except TimeoutError:
+        for future in pending:
+            future.cancel()
+            yield futures[future], None, TimeoutError(f'No answer within {timeout} seconds'), timeout
+
+
+_region_executor = None
+_region_executor_lock = threading.Lock()
+
+
+def get_region_executor():
+    """
+    Lazily builds the executor shared by every multi-region operation of the process, bounded by EC2_REGION_WORKERS
+    :return: ThreadPoolExecutor
+    """
+    global _region_executor
+    if _region_executor is None:
+        with _region_executor_lock:
+            if _region_executor is None:
+                _region_executor = ThreadPoolExecutor(max_workers=settings.EC2_REGION_WORKERS,
+                                                      thread_name_prefix='region-fan-out')
+    return _region_executor
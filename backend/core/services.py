@@ -1,57 +1,230 @@
+import logging
+import math
+import time
+from concurrent import futures
+from datetime import timedelta
+
 from botocore.exceptions import ClientError
-from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED, HTTP_404_NOT_FOUND, \
+    HTTP_429_TOO_MANY_REQUESTS, HTTP_504_GATEWAY_TIMEOUT
 
 from core.api import get_aws_client
-from core.exceptions import AWSPermissionDenied
+from core.cache import fingerprint
+from core.exceptions import AWSException, AWSPermissionDenied, ClientCredentialsException, OperationError, \
+    ServiceOverloaded
+from core.images import get_image_resolver
+from core.index import InstanceIndex
+from core.jobs import get_job_manager
+from core.metrics import THROTTLING_ERROR_CODES
+from core.permissions import DENIED_ERROR_CODES, INVALID_CREDENTIALS_ERROR_CODES
+from core.pipeline import LaunchPipeline
+from core.poller import get_instance_poller
+from core.regions import fan_out
+from core.sessions import get_session_store
+from core.warmpool import get_warm_pool
+from ec2.constants import DEFAULT_INSTANCE_TYPE, DEFAULT_REGION, MAX_CLIENT_TOKEN_LENGTH
+
+logger = logging.getLogger(__name__)
 
 
 class AmazonService(object):
 
     @staticmethod
-    def create_vm(client_id, client_secret):
+    def launch_vm(client_id, client_secret, count=1, instance_type=DEFAULT_INSTANCE_TYPE, region_name=DEFAULT_REGION,
+                  idempotency_key=None):
+        """
+        Given a client id and client secret, queues a job creating running ec2 instances, see create_vm. The job runs
+        on the launch worker pool and its progress can be followed with get_launch_job.
+        Launches with the same idempotency key join the job of the first one for EC2_IDEMPOTENCY_TTL seconds instead of
+        launching again, the first request parameters win. The key is also sent to AWS as ClientToken, so AWS does not
+        launch twice either if the job has to be submitted again. Launches without key are all run, unless
+        EC2_CREATE_DEDUP_WINDOW is set, then the ones with the same parameters join the first one for that many
+        seconds.
+        :param client_id: AWS credential
+        :param client_secret: AWS credential
+        :param count: number of instances to create
+        :param instance_type: type of the instances
+        :param region_name: AWS region where the instances are launched
+        :param idempotency_key: chosen by the client, if any
+        :return: same dict as get_launch_job
+        """
+        aws_client = AmazonService._get_client_resource(client_id, client_secret, region_name)
+
+        if idempotency_key:
+            key = ('idempotency', aws_client.credential_key, region_name, idempotency_key)
+            client_token = fingerprint(*key)[:MAX_CLIENT_TOKEN_LENGTH]
+            ttl = settings.EC2_IDEMPOTENCY_TTL
+        elif settings.EC2_CREATE_DEDUP_WINDOW:
+            key = ('launch', aws_client.credential_key, region_name, instance_type, str(count))
+            client_token = None
+            ttl = settings.EC2_CREATE_DEDUP_WINDOW
+        else:
+            job = get_job_manager().submit('launch', AmazonService.create_vm, client_id, client_secret, count=count,
+                                           instance_type=instance_type, region_name=region_name)
+            return job.to_dict()
+
+        job, _ = get_job_manager().submit_once(key, ttl, 'launch', AmazonService.create_vm, client_id, client_secret,
+                                               count=count, instance_type=instance_type, region_name=region_name,
+                                               client_token=client_token)
+        return job
+
+    @staticmethod
+    def open_session(client_id, client_secret, region_name=DEFAULT_REGION):
+        """
+        Given a client id and client secret, validates them with a single STS call and opens a session so the next
+        requests can give its token instead of the credentials, see core.sessions. The launch permissions are checked
+        up front too, so the launches of the session find their verdicts already cached.
+        :param client_id: AWS credential
+        :param client_secret: AWS credential
+        :param region_name: AWS region of the client used to validate them
+        :return: {
+            'Session': opaque token,
+            'Account': AWS account id,
+            'ExpiresAt': ISO 8601 timestamp,
+            'Permissions': {action: True if it is allowed}, empty if the verdicts cache is disabled
+        }
+        """
+        aws_client = AmazonService._get_client_resource(client_id, client_secret, region_name)
+
+        try:
+            identity = aws_client.get_caller_identity()
+            session = get_session_store().create(client_id, client_secret, identity.get('Account', ''))
+            session['Permissions'] = aws_client.preflight() if settings.AWS_DRY_RUN_CACHE_ENABLED else {}
+            return session
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code', '') in INVALID_CREDENTIALS_ERROR_CODES:
+                raise ClientCredentialsException('The AWS credentials are not valid', status=HTTP_401_UNAUTHORIZED)
+            AmazonService._handle_error(e)
+        except Exception as e:
+            AmazonService._handle_error(e)
+
+    @staticmethod
+    def resolve_session(session):
         """
-        Given a client id and client secret, creates a running ec2 instance. This method performs the following
-        operations:
-        1) Creates a security group
-        2) Creates the ec2 instance with the previous security group attached
+        Given the token of a session, returns its credentials
+        :param session: token given by open_session
+        :return: tuple client id, client secret or None if the session expired or it was revoked
+        """
+        return get_session_store().resolve(session)
+
+    @staticmethod
+    def close_session(session):
+        """
+        Revokes a session, its token cannot be used anymore
+        :param session: token given by open_session
+        """
+        get_session_store().revoke(session)
+
+    @staticmethod
+    def get_launch_job(job_id):
+        """
+        Given a job id, returns the progress of the launch job
+        :param job_id: given by launch_vm
+        :return: {
+            'JobId': id of the job,
+            'Kind': 'launch',
+            'Status': queued, running, succeeded or failed,
+            'Steps': [{'Name': name of the step, 'Status': status of the step, 'Duration': seconds}],
+            'Result': same dict as create_vm once the job succeeded,
+            'Error': {'Message': reason, 'Status': HTTP status} once the job failed,
+            'CreatedAt', 'StartedAt', 'FinishedAt': ISO 8601 timestamps
+        }
+        """
+        job = get_job_manager().describe(job_id)
+        if job is None:
+            raise OperationError('The job does not exist or it already expired', status=HTTP_404_NOT_FOUND)
+        return job
+
+    @staticmethod
+    def create_vm(client_id, client_secret, count=1, instance_type=DEFAULT_INSTANCE_TYPE, region_name=DEFAULT_REGION,
+                  client_token=None, job=None):
+        """
+        Given a client id and client secret, creates running ec2 instances through the LaunchPipeline. This method
+        performs the following operations:
+        1) Starts stopped spares of the warm pool, if it is enabled for the instance type, see core.warmpool.
+        2) For the instances still missing, resolves a security group, shared by all the instances, reusing an
+        existing one if possible. The lookups, the permission check and the AMI validation run concurrently.
+        3) Creates the ec2 instances with the previous security group attached
         :param client_id: AWS credential
         :param client_secret: AWS credential
+        :param count: number of instances to create
+        :param instance_type: type of the instances, by default t2.micro
+        :param region_name: AWS region where the instances are launched, by default 'eu-west-1'
+        :param client_token: idempotency token of the launch, by default the id of the job, if any
+        :param job: Job recording the progress of each step, if any
         :return: {
-            'InstanceId': id of the just created ec2 instance
-            'InstanceType': type of the instance, by default as hardcoded, t2.micro
-            'Region': region where the ec2 instance was launched, by default and as hardcoded, 'eu-west-1'
+            'InstanceId': id of the first ec2 instance just created
+            'InstanceIds': ids of all the ec2 instances just created
+            'InstanceType': type of the instances
+            'Region': availability zone where the first ec2 instance was launched
+            'Requested': number of instances requested
+            'Launched': number of instances actually launched, less than requested if AWS was short of capacity
+            'Pooled': number of them started out of the warm pool instead of being launched
+            'Errors': [{'Requested': instances that could not be launched, 'Code': AWS error code, 'Message'}]
         }
         """
-        aws_client = AmazonService._get_client_resource(client_id, client_secret)
+        aws_client = AmazonService._get_client_resource(client_id, client_secret, region_name)
 
         try:
-            security_group_id = aws_client.create_security_group()
-            instance = aws_client.create_vm(security_group_id)
+            ami = AmazonService._wordpress_ami(aws_client, job)
+            pooled = AmazonService._claim_pooled(aws_client, instance_type, count, job)
+            instances, errors = [], []
+            if len(pooled) < count:
+                if client_token is None and job is not None:
+                    client_token = job.id
+                pipeline = LaunchPipeline(aws_client, count=count - len(pooled), instance_type=instance_type, ami=ami,
+                                          client_token=client_token, job=job)
+                try:
+                    instances, errors = pipeline.run()
+                except ClientError as e:
+                    # The spares are already started, they are the outcome of the launch
+                    if not pooled:
+                        raise
+                    error = e.response.get('Error', {})
+                    errors = [{'Requested': count - len(pooled), 'Code': error.get('Code', ''),
+                               'Message': error.get('Message', '')}]
+                logger.info(f'Launch pipeline timings {pipeline.timings}')
+                AmazonService._index(InstanceIndex.record_launch, aws_client, instances, ami, instance_type,
+                                     count - len(pooled), job.id if job else '')
 
+            warm_pool = get_warm_pool()
+            if warm_pool is not None:
+                warm_pool.record_served(instance_type, len(pooled), len(instances))
+                warm_pool.refill(aws_client, instance_type, ami)
+
+            instance_ids = [instance.instance_id for instance in pooled] + [instance.id for instance in instances]
             return {
-                'InstanceId': instance.id,
-                'InstanceType': instance.instance_type,
-                'Region': instance.placement.get('AvailabilityZone', '')
+                'InstanceId': instance_ids[0],
+                'InstanceIds': instance_ids,
+                'InstanceType': instance_type,
+                'Region': pooled[0].availability_zone if pooled else instances[0].placement.get('AvailabilityZone', ''),
+                'Requested': count,
+                'Launched': len(instance_ids),
+                'Pooled': len(pooled),
+                'Errors': errors
             }
         except (ClientError, Exception) as e:
             AmazonService._handle_error(e)
 
     @staticmethod
-    def stop_instance(instance_id, client_id, client_secret):
+    def stop_instance(instance_id, client_id, client_secret, region_name=DEFAULT_REGION):
         """
         Given an instance id, client id and client secret, stops  the instance
         :param instance_id: given by AWS
         :param client_id: AWS credential
         :param client_secret: AWS credential
+        :param region_name: AWS region of the instance
         :return: {
             'Code': status code,
             'Raw': status raw name given by AWS,
             'Name': pretty name for frontend to displayed
             'PublicIP': ip of the ec2 instance given by AWS,
-            'Region': region where the ec2 instance was launched, by default and as hardcoded, 'eu-west-1'
+            'Region': availability zone where the ec2 instance was launched
         }
         """
-        aws_client = AmazonService._get_client_resource(client_id, client_secret)
+        aws_client = AmazonService._get_client_resource(client_id, client_secret, region_name)
 
         try:
             instance = aws_client.get_instance(instance_id)
@@ -61,8 +234,10 @@ class AmazonService(object):
                                           status=HTTP_400_BAD_REQUEST)
 
             instance_status = aws_client.stop_instance(instance)
+            get_instance_poller().forget(aws_client, instance_id)
 
             state = instance_status.get('StoppingInstances', [{}])[0].get('CurrentState')
+            AmazonService._index(InstanceIndex.record_state, aws_client, instance_id, state)
 
             return {
                 'Code': state.get('Code', ''),
@@ -76,63 +251,444 @@ class AmazonService(object):
             AmazonService._handle_error(e)
 
     @staticmethod
-    def get_instance_status(instance_id, client_id, client_secret):
+    def change_instances_state(action, instance_ids, client_id, client_secret, region_name=DEFAULT_REGION):
+        """
+        Given many instance ids, client id and client secret, starts, stops or terminates all of them with as few
+        calls as possible, see AmazonAPIWrapper.change_instances_state
+        :param action: start, stop or terminate
+        :param instance_ids: list of ids given by AWS
+        :param client_id: AWS credential
+        :param client_secret: AWS credential
+        :param region_name: AWS region of the instances
+        :return: {
+            'Instances': {instance id: {
+                'Code': status code,
+                'Raw': status raw name given by AWS,
+                'Name': pretty name for frontend to displayed,
+                'PreviousRaw': status raw name before the call
+            }},
+            'Errors': {instance id: {'Code': AWS error code, 'Message': human readable message}}
+        }
         """
-        Given an instance id, client id and client secret, checks for the status of the retrieved instance
+        aws_client = AmazonService._get_client_resource(client_id, client_secret, region_name)
+
+        try:
+            changes, errors = aws_client.change_instances_state(action, instance_ids)
+
+            instances = {}
+            for instance_id, transition in changes.items():
+                state = transition.get('CurrentState', {})
+                get_instance_poller().forget(aws_client, instance_id)
+                AmazonService._index(InstanceIndex.record_state, aws_client, instance_id, state)
+                instances[instance_id] = {
+                    'Code': state.get('Code', ''),
+                    'Raw': state.get('Name', ''),
+                    'Name': AmazonService._normalize_status(state),
+                    'PreviousRaw': transition.get('PreviousState', {}).get('Name', '')
+                }
+
+            return {
+                'Instances': instances,
+                'Errors': {instance_id: {'Code': code, 'Message': AmazonService._error_message(code)}
+                           for instance_id, code in errors.items()}
+            }
+        except (ClientError, Exception) as e:
+            AmazonService._handle_error(e)
+
+    @staticmethod
+    def get_instance_status(instance_id, client_id, client_secret, region_name=DEFAULT_REGION):
+        """
+        Given an instance id, client id and client secret, checks for the status of the retrieved instance. Instances
+        of the index checked with AWS less than EC2_INDEX_MAX_AGE seconds ago, and not in a transitional state, are
+        served out of the index, the other ones through the instance state poller.
         :param instance_id: given by AWS
         :param client_id: AWS credential
         :param client_secret: AWS credential
+        :param region_name: AWS region of the instance
         :return: {
             'Code': status code,
             'Raw': status raw name given by AWS,
             'Name': pretty name for frontend to displayed
             'PublicIP': ip of the ec2 instance given by AWS,
-            'Region': region where the ec2 instance was launched, by default and as hardcoded, 'eu-west-1'
+            'Region': availability zone where the ec2 instance was launched
+            'Age': seconds since the status was retrieved from AWS, statuses are served from a shared state cache
         }
         """
-        aws_client = AmazonService._get_client_resource(client_id, client_secret)
+        aws_client = AmazonService._get_client_resource(client_id, client_secret, region_name)
 
         try:
-            instance = aws_client.get_instance(instance_id)
+            statuses, _ = AmazonService._status_of(aws_client, [instance_id])
 
-            if instance is None:
+            if instance_id not in statuses:
                 raise AWSPermissionDenied('There has been an error getting the status of the VM',
                                           status=HTTP_400_BAD_REQUEST)
 
-            state = instance.state
+            return statuses[instance_id]
+        except (ClientError, Exception) as e:
+            AmazonService._handle_error(e)
+
+    @staticmethod
+    def wait_for_instance_status(instance_id, client_id, client_secret, target_state=None, timeout=0,
+                                 region_name=DEFAULT_REGION):
+        """
+        Given an instance id, client id and client secret, waits server side for the instance to change its status. It
+        returns straight away if the instance is already in target_state, otherwise as soon as its status changes or
+        once timeout seconds pass, whatever happens first. Waits share the polling of the instance state poller.
+        :param instance_id: given by AWS
+        :param client_id: AWS credential
+        :param client_secret: AWS credential
+        :param target_state: raw status name, e.g. 'running', that ends the wait if the instance is already in it
+        :param timeout: seconds to wait at most, bounded by EC2_STATUS_WAIT_MAX_TIMEOUT
+        :param region_name: AWS region of the instance
+        :return: same dict as get_instance_status
+        """
+        aws_client = AmazonService._get_client_resource(client_id, client_secret, region_name)
+        timeout = min(timeout, settings.EC2_STATUS_WAIT_MAX_TIMEOUT)
+
+        try:
+            poller = get_instance_poller()
+            instances, _ = poller.get_instances(aws_client, [instance_id])
+
+            if instance_id in instances and instances[instance_id][0].get('State', {}).get('Name') != target_state:
+                initial = instances[instance_id][0].get('State', {})
+                instances, _ = poller.wait_for(aws_client, instance_id,
+                                               lambda description: description.get('State', {}) != initial,
+                                               timeout)
+
+            if instance_id not in instances:
+                raise AWSPermissionDenied('There has been an error getting the status of the VM',
+                                          status=HTTP_400_BAD_REQUEST)
+
+            return AmazonService._instance_status(*instances[instance_id])
+        except (ClientError, Exception) as e:
+            AmazonService._handle_error(e)
+
+    @staticmethod
+    def get_instances_status(instance_ids, client_id, client_secret, region_name=DEFAULT_REGION):
+        """
+        Given many instance ids, client id and client secret, checks for the status of all of them. The ones that
+        cannot be served out of the index, see get_instance_status, are checked with a single describe_instances call
+        (paginated and split in chunks only for the biggest batches)
+        :param instance_ids: list of ids given by AWS
+        :param client_id: AWS credential
+        :param client_secret: AWS credential
+        :param region_name: AWS region of the instances
+        :return: {
+            'Instances': {instance id: same dict as get_instance_status},
+            'Errors': {instance id: {'Code': AWS error code, 'Message': human readable message}}
+        }
+        """
+        aws_client = AmazonService._get_client_resource(client_id, client_secret, region_name)
+
+        try:
+            statuses, errors = AmazonService._status_of(aws_client, instance_ids)
 
             return {
-                'Code': state.get('Code', ''),
-                'Raw': state.get('Name', ''),
-                'Name': AmazonService._normalize_status(state),
-                'PublicIP': instance.public_ip_address,
-                'InstanceType': instance.instance_type,
-                'Region': instance.placement.get('AvailabilityZone', '')
+                'Instances': statuses,
+                'Errors': {instance_id: {'Code': code, 'Message': AmazonService._error_message(code)}
+                           for instance_id, code in errors.items()}
+            }
+        except (ClientError, Exception) as e:
+            AmazonService._handle_error(e)
+
+    @staticmethod
+    def list_indexed_instances(client_id, client_secret, states=None, instance_types=None, instance_ids=None,
+                               region_name=DEFAULT_REGION):
+        """
+        Given a client id and client secret, lists the instances launched through the launchpad out of the local
+        index. Only the instances not checked with AWS for EC2_INDEX_MAX_AGE seconds are refreshed, with a single
+        describe_instances call, before being listed.
+        :param client_id: AWS credential
+        :param client_secret: AWS credential
+        :param states: raw status names the instances must be in, e.g. ['running']
+        :param instance_types: types the instances must be of
+        :param instance_ids: ids the instances must have
+        :param region_name: AWS region of the instances
+        :return: {
+            'Instances': [same dict as get_instance_status plus 'RefreshedAt', ISO 8601 timestamp of the last check
+            with AWS],
+            'RefreshedAt': timestamp of the least recently checked instance listed
+        }
+        """
+        aws_client = AmazonService._get_client_resource(client_id, client_secret, region_name)
+
+        try:
+            instances = InstanceIndex.list_instances(aws_client, states=states, instance_types=instance_types,
+                                                     instance_ids=instance_ids)
+            refreshed_at = min((instance.refreshed_at for instance in instances), default=None)
+
+            return {
+                'Instances': [AmazonService._indexed_instance_status(instance) for instance in instances],
+                'RefreshedAt': refreshed_at.isoformat() if refreshed_at else None
             }
         except (ClientError, Exception) as e:
             AmazonService._handle_error(e)
 
     @staticmethod
-    def _get_client_resource(client_id, client_secret):
-        aws_client = get_aws_client(client_id, client_secret)
+    def list_instances(client_id, client_secret, states=None, instance_types=None, tags=None,
+                       region_name=DEFAULT_REGION):
+        """
+        Given a client id and client secret, lists the instances of the region page by page. Filtering happens server
+        side, and instances are yielded as each describe_instances page arrives so the inventory is never held in
+        memory as a whole. The first page is retrieved straight away so wrong credentials fail before anything is
+        streamed.
+        :param client_id: AWS credential
+        :param client_secret: AWS credential
+        :param states: raw status names the instances must be in, e.g. ['running']
+        :param instance_types: types the instances must be of
+        :param tags: dict tag key -> tag value the instances must have
+        :param region_name: AWS region of the instances
+        :return: generator yielding the same dict as get_instance_status per instance
+        """
+        aws_client = AmazonService._get_client_resource(client_id, client_secret, region_name)
+
+        filters = []
+        if states:
+            filters.append({'Name': 'instance-state-name', 'Values': list(states)})
+        if instance_types:
+            filters.append({'Name': 'instance-type', 'Values': list(instance_types)})
+        for key, value in (tags or {}).items():
+            filters.append({'Name': f'tag:{key}', 'Values': [value]})
+
+        instances = aws_client.iter_instances(filters)
+        try:
+            first = next(instances, None)
+        except (ClientError, Exception) as e:
+            AmazonService._handle_error(e)
+
+        def statuses():
+            if first is None:
+                return
+            yield AmazonService._instance_status(first)
+            try:
+                for instance in instances:
+                    yield AmazonService._instance_status(instance)
+            except (ClientError, Exception) as e:
+                AmazonService._handle_error(e)
+
+        return statuses()
+
+    @staticmethod
+    def watch_instance_status(instance_id, client_id, client_secret, target_state=None, region_name=DEFAULT_REGION):
+        """
+        Given an instance id, client id and client secret, watches the status of the instance server side. The first
+        status is retrieved straight away so wrong credentials or unknown instances fail before anything is streamed.
+        The watch ends once the instance reaches target_state or after EC2_STATUS_STREAM_MAX_DURATION seconds.
+        :param instance_id: given by AWS
+        :param client_id: AWS credential
+        :param client_secret: AWS credential
+        :param target_state: raw status name, e.g. 'running', that ends the watch
+        :param region_name: AWS region of the instance
+        :return: generator yielding the same dict as get_instance_status every time Code or Raw change, and None on
+        the checks where nothing changed
+        """
+        status = AmazonService.get_instance_status(instance_id, client_id, client_secret, region_name)
+
+        def changes(current):
+            yield current
+            last = (current['Code'], current['Raw'])
+            deadline = time.monotonic() + settings.EC2_STATUS_STREAM_MAX_DURATION
+
+            while current['Raw'] != target_state and time.monotonic() < deadline:
+                time.sleep(settings.EC2_STATUS_STREAM_INTERVAL)
+                current = AmazonService.get_instance_status(instance_id, client_id, client_secret, region_name)
+
+                if (current['Code'], current['Raw']) != last:
+                    last = (current['Code'], current['Raw'])
+                    yield current
+                else:
+                    yield None
+
+        return changes(status)
+
+    @staticmethod
+    def find_launchpad_instances(client_id, client_secret, regions=None):
+        """
+        Given a client id and client secret, looks for the instances launched by the launchpad in every enabled region.
+        Regions are queried concurrently and their results merged as they arrive, so it takes about as long as the
+        slowest region. A failing region does not fail the whole operation, it is reported in Errors.
+        :param client_id: AWS credential
+        :param client_secret: AWS credential
+        :param regions: list of regions to query, by default EC2_ENABLED_REGIONS
+        :return: {
+            'Regions': {region: {'Instances': [same dict as get_instance_status], 'Duration': seconds}},
+            'Errors': {region: {'Message': reason, 'Status': HTTP status}}
+        }
+        """
+        regions = regions or settings.EC2_ENABLED_REGIONS
+
+        def locate(region_name):
+            aws_client = AmazonService._get_client_resource(client_id, client_secret, region_name)
+            try:
+                return aws_client.find_launchpad_instances()
+            except (ClientError, Exception) as e:
+                AmazonService._handle_error(e)
+
+        result = {'Regions': {}, 'Errors': {}}
+        for region_name, instances, error, duration in fan_out(regions, locate):
+            if error is None:
+                result['Regions'][region_name] = {
+                    'Instances': [AmazonService._instance_status(instance) for instance in instances],
+                    'Duration': round(duration, 3)
+                }
+            elif isinstance(error, AWSException):
+                result['Errors'][region_name] = {'Message': str(error), 'Status': error.status}
+            elif isinstance(error, futures.TimeoutError):
+                result['Errors'][region_name] = {'Message': str(error), 'Status': HTTP_504_GATEWAY_TIMEOUT}
+            else:
+                result['Errors'][region_name] = {'Message': str(error), 'Status': HTTP_400_BAD_REQUEST}
+        return result
+
+    @staticmethod
+    def _get_client_resource(client_id, client_secret, region_name=DEFAULT_REGION):
+        aws_client = get_aws_client(client_id, client_secret, region_name=region_name)
         if not aws_client:
             raise AWSPermissionDenied("The given credentials does not have permissions to access EC2. Please,"
                                       "grant full access to EC2 to the given credentials", status=HTTP_401_UNAUTHORIZED)
         return aws_client
 
+    @staticmethod
+    def _wordpress_ami(aws_client, job=None):
+        """
+        Returns the latest WordPress AMI of the region of the client, AMI ids differ between regions
+        :param aws_client: AmazonAPIWrapper of the launch
+        :param job: Job recording the progress of each step, if any
+        :return: id of the image
+        """
+        if job is None:
+            return get_image_resolver().resolve(aws_client)
+        with job.step('resolve-image'):
+            return get_image_resolver().resolve(aws_client)
+
     @staticmethod
     def _handle_error(e):
         """
         Parses the given exception to know if it's a permissions exception or something else. If it's a permissions
-        error we sent AWSPermissionDenied otherwise, the raw exception.
+        error we sent AWSPermissionDenied, if AWS is still throttling the account once the retries are exhausted
+        ServiceOverloaded, otherwise, the raw exception.
         :param e: exception to be parsed
         """
         if isinstance(e, ClientError):
             error_code = e.response.get('Error', {}).get('Code', '')
-            if error_code == 'UnauthorizedOperation' or error_code == 'AuthFailure':
+            if error_code in DENIED_ERROR_CODES:
                 raise AWSPermissionDenied("You don't have permissions to perform this operation",
                                           status=HTTP_401_UNAUTHORIZED)
-            raise
+            if error_code in THROTTLING_ERROR_CODES:
+                raise ServiceOverloaded('AWS is throttling the requests of this account, please try again later',
+                                        status=HTTP_429_TOO_MANY_REQUESTS,
+                                        retry_after=math.ceil(settings.AWS_RATE_LIMIT_MAX_WAIT))
+        raise e
+
+    @staticmethod
+    def _instance_status(instance, age=0.0):
+        """
+        Builds the status dict given to the frontend out of an instance description as returned by describe_instances
+        :param instance: instance description
+        :param age: seconds since the description was retrieved from AWS
+        :return: status dict
+        """
+        state = instance.get('State', {})
+        return {
+            'InstanceId': instance.get('InstanceId', ''),
+            'Code': state.get('Code', ''),
+            'Raw': state.get('Name', ''),
+            'Name': AmazonService._normalize_status(state),
+            'PublicIP': instance.get('PublicIpAddress'),
+            'InstanceType': instance.get('InstanceType', ''),
+            'Region': instance.get('Placement', {}).get('AvailabilityZone', ''),
+            'Age': round(age, 1)
+        }
+
+    @staticmethod
+    def _status_of(aws_client, instance_ids):
+        """
+        Statuses of instances, out of the index for the settled ones checked recently, see InstanceIndex.get_settled,
+        through the instance state poller for the others. What the poller retrieves is written back to the index.
+        :return: tuple with a dict instance id -> status dict and a dict instance id -> AWS error code
+        """
+        indexed = InstanceIndex.get_settled(aws_client, instance_ids)
+        statuses = {instance_id: AmazonService._indexed_instance_status(instance)
+                    for instance_id, instance in indexed.items()}
+
+        missing = [instance_id for instance_id in instance_ids if instance_id not in indexed]
+        if not missing:
+            return statuses, {}
+
+        instances, errors = get_instance_poller().get_instances(aws_client, missing)
+        if instances:
+            oldest = max(age for _, age in instances.values())
+            AmazonService._index(InstanceIndex.record_descriptions, aws_client,
+                                 {instance_id: description for instance_id, (description, _) in instances.items()},
+                                 timezone.now() - timedelta(seconds=oldest))
+        statuses.update({instance_id: AmazonService._instance_status(*instance)
+                         for instance_id, instance in instances.items()})
+        return statuses, errors
+
+    @staticmethod
+    def _indexed_instance_status(instance):
+        """
+        Builds the status dict given to the frontend out of an indexed instance
+        :param instance: Instance
+        :return: status dict
+        """
+        state = {'Name': instance.state, 'Code': instance.state_code}
+        return {
+            'InstanceId': instance.instance_id,
+            'Code': instance.state_code,
+            'Raw': instance.state,
+            'Name': AmazonService._normalize_status(state),
+            'PublicIP': instance.public_ip,
+            'InstanceType': instance.instance_type,
+            'Region': instance.availability_zone,
+            'Age': round((timezone.now() - instance.refreshed_at).total_seconds(), 1),
+            'RefreshedAt': instance.refreshed_at.isoformat()
+        }
+
+    @staticmethod
+    def _claim_pooled(aws_client, instance_type, count, job=None):
+        """
+        Starts spares of the warm pool for a launch. The warm pool is only an optimization, if it fails the launch
+        goes cold.
+        :return: list of Instance started
+        """
+        warm_pool = get_warm_pool()
+        if warm_pool is None or not warm_pool.size(instance_type):
+            return []
+        try:
+            if job is None:
+                return warm_pool.claim(aws_client, instance_type, count)
+            with job.step('warm-pool'):
+                return warm_pool.claim(aws_client, instance_type, count)
+        except Exception:
+            logger.exception('Error claiming instances out of the warm pool')
+            return []
+
+    @staticmethod
+    def _index(operation, *args):
+        """
+        Writes to the instances index. The index is only an optimization, failing to write it does not fail the
+        operation that was already done in AWS.
+        :param operation: InstanceIndex method
+        """
+        try:
+            operation(*args)
+        except Exception:
+            logger.exception(f'Error updating the instances index, {operation.__name__}')
+
+    @staticmethod
+    def _error_message(error_code):
+        """
+        Human readable message for the AWS error codes reported per instance
+        :param error_code: AWS error code
+        :return: message
+        """
+        if error_code in ('InvalidInstanceID.NotFound', 'InvalidInstanceID.Malformed'):
+            return 'The instance does not exist'
+        if error_code == 'IncorrectInstanceState':
+            return 'The instance is not in a state it can be changed from'
+        if error_code == 'UnsupportedOperation':
+            return 'The instance does not support this operation'
+        return 'There has been an error getting the status of the VM'
 
     @staticmethod
     def _normalize_status(state):
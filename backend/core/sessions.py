@@ -0,0 +1,112 @@
+import secrets
+import threading
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+
+from core.cache import TTLCache, fingerprint
+
+# Seconds, a shared session used again gets its expiration pushed back in the cache at most this often
+SLIDE_INTERVAL = 60
+
+
+class SessionStore(object):
+    """
+    Short lived sessions standing for validated credentials, so clients poll with an opaque token instead of sending
+    the secrets on every request. Tokens are only kept hashed, a session resolves to the credentials with a single
+    lookup and ends once it has not been used for ttl seconds or it is revoked.
+
+    Sessions live in the memory of the process unless a Django cache alias is given. Then they are kept only in that
+    cache, so every worker process sees them and their revocation. The credentials are stored there too, it should be
+    a cache that is not persisted. Their expiration is pushed back with touch, at most once per SLIDE_INTERVAL and
+    worker, so clients polling every few seconds do not hit the cache with a write on every request.
+    """
+
+    def __init__(self, ttl, max_size=None, cache_alias=None):
+        self.ttl = ttl
+        self._sessions = TTLCache(max_size=max_size, ttl=ttl, sliding=True)
+        self._shared = caches[cache_alias] if cache_alias else None
+        # Shared sessions this worker pushed the expiration of recently
+        self._touched = TTLCache(max_size=max_size, ttl=min(SLIDE_INTERVAL, ttl / 2))
+
+    def create(self, client_id, client_secret, account=''):
+        """
+        Opens a session for credentials that were already validated
+        :param client_id: AWS credential
+        :param client_secret: AWS credential
+        :param account: id of the AWS account the credentials belong to
+        :return: {'Session': token, 'Account': account, 'ExpiresAt': ISO 8601 timestamp, if it is not used meanwhile}
+        """
+        token = secrets.token_urlsafe(32)
+        session = {'ClientId': client_id, 'ClientSecret': client_secret, 'Account': account}
+
+        key = self._key(token)
+        if self._shared is not None:
+            self._shared.set(key, session, self.ttl)
+            self._touched.set(key, True)
+        else:
+            self._sessions.set(key, session)
+
+        return {
+            'Session': token,
+            'Account': account,
+            'ExpiresAt': (datetime.now(timezone.utc) + timedelta(seconds=self.ttl)).isoformat(),
+        }
+
+    def resolve(self, token):
+        """
+        Returns the credentials of a session, which then expires ttl seconds from now
+        :param token: given by create
+        :return: tuple client id, client secret or None if the session does not exist, expired or was revoked
+        """
+        key = self._key(token)
+        if self._shared is None:
+            session = self._sessions.get(key)
+        else:
+            session = self._shared.get(key)
+            # touch never brings back a session revoked meanwhile, unlike setting it again
+            if session is not None and key not in self._touched:
+                self._shared.touch(key, self.ttl)
+                self._touched.set(key, True)
+        if session is None:
+            return None
+        return session['ClientId'], session['ClientSecret']
+
+    def revoke(self, token):
+        """
+        Ends a session before it expires
+        :param token: given by create
+        """
+        key = self._key(token)
+        if self._shared is not None:
+            self._shared.delete(key)
+            self._touched.pop(key)
+        else:
+            self._sessions.pop(key)
+
+    def stats(self):
+        return self._sessions.stats()
+
+    @staticmethod
+    def _key(token):
+        return 'session:' + fingerprint(token)
+
+
+_session_store = None
+_session_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """
+    Lazily builds the process wide SessionStore out of the EC2_SESSION_* settings
+    :return: SessionStore
+    """
+    global _session_store
+    if _session_store is None:
+        with _session_store_lock:
+            if _session_store is None:
+                _session_store = SessionStore(ttl=settings.EC2_SESSION_TTL,
+                                              max_size=settings.EC2_SESSION_STORE_SIZE,
+                                              cache_alias=settings.EC2_SESSION_CACHE_ALIAS)
+    return _session_store
@@ -0,0 +1,61 @@
+import pytest
+
+from core.services import AmazonService
+
+MISSING_ID = 'i-0123456789abcdef0'
+
+
+@pytest.fixture
+def instance_ids(aws_client, wordpress_ami):
+    instances = aws_client.get_raw_client().run_instances(ImageId=wordpress_ami, MinCount=3, MaxCount=3)['Instances']
+    return [instance['InstanceId'] for instance in instances]
+
+
+@pytest.fixture
+def stop_calls(aws_client):
+    """
+    Ids of the instances of every StopInstances call
+    """
+    calls = []
+    aws_client.get_raw_client().meta.events.register(
+        'before-parameter-build.ec2.StopInstances', lambda params, **kwargs: calls.append(list(params['InstanceIds'])))
+    return calls
+
+
+def test_state_change_is_a_single_call_when_every_instance_can_change(aws_client, instance_ids, stop_calls):
+    changes, errors = aws_client.change_instances_state('stop', instance_ids)
+
+    assert set(changes) == set(instance_ids)
+    assert errors == {}
+    assert stop_calls == [instance_ids]
+
+
+def test_state_change_isolates_the_faulty_ids_by_halving(aws_client, instance_ids, stop_calls):
+    first, second, third = instance_ids
+
+    changes, errors = aws_client.change_instances_state('stop', [first, MISSING_ID, second, third])
+
+    assert set(changes) == set(instance_ids)
+    assert {change['CurrentState']['Name'] for change in changes.values()} <= {'stopping', 'stopped'}
+    assert errors == {MISSING_ID: 'InvalidInstanceID.NotFound'}
+    # The rejected call is split until the unknown id is alone, the halves without it succeed straight away
+    assert stop_calls == [[first, MISSING_ID, second, third], [first, MISSING_ID], [first], [MISSING_ID],
+                          [second, third]]
+
+
+def test_describe_reports_the_unknown_ids(aws_client, instance_ids):
+    instances, errors = aws_client.describe_instances(instance_ids + [MISSING_ID])
+
+    assert set(instances) == set(instance_ids)
+    assert errors == {MISSING_ID: 'InvalidInstanceID.NotFound'}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_batch_status_reports_the_unknown_ids(credentials, instance_ids):
+    result = AmazonService.get_instances_status(instance_ids + [MISSING_ID], **credentials)
+
+    assert set(result['Instances']) == set(instance_ids)
+    assert {status['Raw'] for status in result['Instances'].values()} == {'running'}
+    assert list(result['Errors']) == [MISSING_ID]
+    assert result['Errors'][MISSING_ID]['Code'] == 'InvalidInstanceID.NotFound'
+    assert result['Errors'][MISSING_ID]['Message']
@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+
+from core.jobs import FAILED, SUCCEEDED, JobManager, get_job_manager
+from core.services import AmazonService
+
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+def wait_for_job(job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = get_job_manager().describe(job_id)
+        if job['Status'] in (SUCCEEDED, FAILED):
+            return job
+        assert time.monotonic() < deadline, f'job {job_id} did not finish'
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def no_dedup_window(settings):
+    settings.EC2_CREATE_DEDUP_WINDOW = 0
+
+
+def test_launches_with_the_same_idempotency_key_join_the_first_job(credentials, wordpress_ami, no_dedup_window):
+    first = AmazonService.launch_vm(**credentials, idempotency_key='order-1')
+    second = AmazonService.launch_vm(**credentials, idempotency_key='order-1')
+
+    assert second['JobId'] == first['JobId']
+    job = wait_for_job(first['JobId'])
+    assert job['Status'] == SUCCEEDED
+    assert AmazonService.launch_vm(**credentials, idempotency_key='order-1')['JobId'] == first['JobId']
+
+
+def test_launches_with_other_idempotency_keys_are_run(credentials, wordpress_ami, no_dedup_window):
+    first = AmazonService.launch_vm(**credentials, idempotency_key='order-1')
+    second = AmazonService.launch_vm(**credentials, idempotency_key='order-2')
+
+    assert second['JobId'] != first['JobId']
+    instance_ids = {wait_for_job(job['JobId'])['Result']['InstanceId'] for job in (first, second)}
+    assert len(instance_ids) == 2
+
+
+def test_launches_without_key_are_all_run_unless_the_dedup_window_is_set(credentials, wordpress_ami, settings):
+    settings.EC2_CREATE_DEDUP_WINDOW = 0
+    first = AmazonService.launch_vm(**credentials)
+    second = AmazonService.launch_vm(**credentials)
+    assert second['JobId'] != first['JobId']
+
+    settings.EC2_CREATE_DEDUP_WINDOW = 30
+    third = AmazonService.launch_vm(**credentials)
+    fourth = AmazonService.launch_vm(**credentials)
+    other_type = AmazonService.launch_vm(**credentials, instance_type='t3.micro')
+    assert fourth['JobId'] == third['JobId']
+    assert other_type['JobId'] != third['JobId']
+
+    for job in (first, second, third, other_type):
+        wait_for_job(job['JobId'])
+
+
+def test_concurrent_duplicates_are_submitted_once():
+    manager = JobManager(max_workers=2, max_queued=16, retention=60)
+    release = threading.Event()
+    runs = []
+
+    def work(job=None):
+        runs.append(job.id)
+        release.wait(5)
+        return 'done'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(manager.submit_once(('key',), 60, 'test', work)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    release.set()
+
+    assert len({job['JobId'] for job, _ in results}) == 1
+    assert sum(submitted for _, submitted in results) == 1
+
+
+def test_failed_job_is_not_joined():
+    manager = JobManager(max_workers=1, max_queued=4, retention=60)
+
+    def fail(job=None):
+        raise RuntimeError('boom')
+
+    failed, _ = manager.submit_once(('key',), 60, 'test', fail)
+    deadline = time.monotonic() + 5
+    while manager.describe(failed['JobId'])['Status'] != FAILED:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    retried, submitted = manager.submit_once(('key',), 60, 'test', lambda job=None: 'done')
+
+    assert submitted
+    assert retried['JobId'] != failed['JobId']
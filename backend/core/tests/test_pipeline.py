@@ -0,0 +1,86 @@
+import pytest
+from botocore.awsrequest import AWSResponse
+
+from core.cache import fingerprint
+from core.pipeline import LaunchPipeline
+from ec2.constants import MAX_CLIENT_TOKEN_LENGTH
+
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+class ClientTokens(object):
+    """
+    EC2 ClientToken idempotency, which moto does not implement: a token is bound to the security group of the first
+    launch that used it and launching again with it and another group fails with IdempotentParameterMismatch
+    """
+
+    def __init__(self, aws_client):
+        self.groups = {}
+        self.calls = []
+        aws_client.get_raw_client().meta.events.register('before-call.ec2.RunInstances', self)
+
+    def __call__(self, params, **kwargs):
+        body = params['body']
+        if body.get('DryRun') == 'true':
+            return None
+        token, group = body['ClientToken'], body['SecurityGroupId.1']
+        self.calls.append((token, group))
+        if self.groups.setdefault(token, group) != group:
+            error = {'Code': 'IdempotentParameterMismatch', 'Message': f'Token {token} was used with other parameters'}
+            return AWSResponse(params['url'], 400, {}, None), {'Error': error}
+        return None
+
+
+def call_token(client_token):
+    # Token of the first create_instances call of a launch, see AmazonAPIWrapper.create_vm
+    return client_token[:MAX_CLIENT_TOKEN_LENGTH - 2] + '-0'
+
+
+@pytest.fixture
+def deleted_security_group(aws_client):
+    """
+    Security group cached for the credentials but deleted meanwhile, e.g. from the AWS console
+    """
+    security_group_id = aws_client.resolve_security_group()
+    aws_client.get_raw_client().delete_security_group(GroupId=security_group_id)
+    return security_group_id
+
+
+def test_launch_with_a_deleted_security_group_is_retried_with_a_derived_token(aws_client, wordpress_ami,
+                                                                            deleted_security_group):
+    tokens = ClientTokens(aws_client)
+
+    instances, errors = LaunchPipeline(aws_client, ami=wordpress_ami, client_token='launch-1').run()
+
+    security_group_id = aws_client.get_cached_security_group()
+    assert security_group_id != deleted_security_group
+    assert len(instances) == 1
+    assert errors == []
+    assert tokens.calls == [(call_token('launch-1'), deleted_security_group),
+                            (call_token(fingerprint('launch-1', security_group_id)), security_group_id)]
+
+
+def test_launch_run_again_replays_the_derived_token(aws_client, wordpress_ami, deleted_security_group):
+    tokens = ClientTokens(aws_client)
+    LaunchPipeline(aws_client, ami=wordpress_ami, client_token='launch-1').run()
+    security_group_id = aws_client.get_cached_security_group()
+    tokens.calls.clear()
+
+    instances, errors = LaunchPipeline(aws_client, ami=wordpress_ami, client_token='launch-1').run()
+
+    assert len(instances) == 1
+    assert errors == []
+    # The original token is still bound to the deleted group, the one derived from the current group is used instead
+    assert tokens.calls == [(call_token('launch-1'), security_group_id),
+                            (call_token(fingerprint('launch-1', security_group_id)), security_group_id)]
+
+
+def test_launch_without_token_is_retried_without_one(aws_client, wordpress_ami, deleted_security_group):
+    pipeline = LaunchPipeline(aws_client, ami=wordpress_ami)
+
+    instances, errors = pipeline.run()
+
+    assert pipeline._retry_token(aws_client.get_cached_security_group()) is None
+    assert len(instances) == 1
+    assert errors == []
+    assert aws_client.get_cached_security_group() != deleted_security_group
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from core.poller import InstanceStatePoller, LocalStateStore
+
+
+@pytest.fixture
+def poller():
+    return InstanceStatePoller(LocalStateStore(), fast_interval=0.2, slow_interval=30, idle_timeout=60, tick=0.1)
+
+
+@pytest.fixture
+def instance_id(aws_client, wordpress_ami):
+    return aws_client.get_raw_client().run_instances(ImageId=wordpress_ami, MinCount=1,
+                                                     MaxCount=1)['Instances'][0]['InstanceId']
+
+
+@pytest.fixture
+def describe_calls(aws_client):
+    """
+    Ids of the instances of every DescribeInstances call
+    """
+    calls = []
+    aws_client.get_raw_client().meta.events.register(
+        'before-parameter-build.ec2.DescribeInstances',
+        lambda params, **kwargs: calls.append(params['Filters'][0]['Values']))
+    return calls
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, 'the poller did not catch up'
+        time.sleep(0.05)
+
+
+def test_concurrent_reads_share_a_single_describe(aws_client, poller, instance_id, describe_calls):
+    # Slow AWS so every read arrives while the first describe is in flight
+    aws_client.get_raw_client().meta.events.register('before-call.ec2.DescribeInstances',
+                                                     lambda **kwargs: time.sleep(0.5))
+    barrier = threading.Barrier(8)
+    results = []
+
+    def read():
+        barrier.wait()
+        results.append(poller.get_instances(aws_client, [instance_id]))
+
+    threads = [threading.Thread(target=read) for _ in range(barrier.parties)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert describe_calls == [[instance_id]]
+    assert len(results) == barrier.parties
+    assert all(instances[instance_id][0]['State']['Name'] == 'running' for instances, _ in results)
+
+
+def test_cached_description_is_served_without_describe(aws_client, poller, instance_id, describe_calls):
+    poller.get_instances(aws_client, [instance_id])
+
+    instances, errors = poller.get_instances(aws_client, [instance_id])
+
+    assert describe_calls == [[instance_id]]
+    assert instances[instance_id][0]['State']['Name'] == 'running'
+    assert errors == {}
+
+
+def test_transitional_instance_is_polled_fast_until_it_settles(aws_client, poller, instance_id, describe_calls):
+    pending = {'InstanceId': instance_id, 'State': {'Code': 0, 'Name': 'pending'}}
+    poller.store.set((aws_client.credential_key, aws_client.region_name, instance_id), (pending, time.time()))
+
+    instances, _ = poller.get_instances(aws_client, [instance_id])
+    assert instances[instance_id][0]['State']['Name'] == 'pending'
+    assert describe_calls == []
+
+    # Polled in the background after fast_interval, running is settled so the next poll is slow_interval away
+    wait_until(lambda: poller.get_instances(aws_client, [instance_id])[0][instance_id][0]['State']['Name'] == 'running')
+    time.sleep(1)
+
+    assert describe_calls == [[instance_id]]
@@ -0,0 +1,59 @@
+import pytest
+from django.urls import reverse
+
+from core.exceptions import ServiceOverloaded
+from core.ratelimit import RateGovernor
+
+ACCOUNT = 'account'
+
+
+@pytest.fixture
+def governor():
+    # A single call of each kind is allowed, the next one would wait for 100 seconds
+    return RateGovernor(describe_rate=0.01, describe_burst=1, mutate_rate=0.01, mutate_burst=1, max_wait=0.5)
+
+
+def test_call_over_the_budget_is_rejected_with_a_429(governor):
+    governor.acquire(ACCOUNT, 'eu-west-1', 'DescribeInstances')
+
+    with pytest.raises(ServiceOverloaded) as e:
+        governor.acquire(ACCOUNT, 'eu-west-1', 'DescribeSecurityGroups')
+
+    assert e.value.status == 429
+    assert e.value.retry_after == 1
+
+
+def test_budgets_are_per_kind_account_and_region(governor):
+    governor.acquire(ACCOUNT, 'eu-west-1', 'DescribeInstances')
+
+    governor.acquire(ACCOUNT, 'eu-west-1', 'StopInstances')
+    governor.acquire(ACCOUNT, 'us-east-1', 'DescribeInstances')
+    governor.acquire('other-account', 'eu-west-1', 'DescribeInstances')
+    with pytest.raises(ServiceOverloaded):
+        governor.acquire(ACCOUNT, 'eu-west-1', 'TerminateInstances')
+
+
+def test_calls_within_max_wait_are_queued():
+    governor = RateGovernor(describe_rate=20, describe_burst=1, mutate_rate=20, mutate_burst=1, max_wait=0.5)
+
+    for _ in range(3):
+        governor.acquire(ACCOUNT, 'eu-west-1', 'DescribeInstances')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_throttled_request_answers_429_with_retry_after(aws, client, credentials, settings):
+    settings.AWS_RATE_LIMIT_ENABLED = True
+    settings.AWS_RATE_LIMIT_DESCRIBE_RATE = 0.01
+    settings.AWS_RATE_LIMIT_DESCRIBE_BURST = 1
+    settings.AWS_RATE_LIMIT_MAX_WAIT = 0.5
+
+    def check_status(instance_id):
+        return client.post(reverse('ec2:check-status-batch'),
+                           {'client_id': credentials['client_id'], 'client_secret': credentials['client_secret'],
+                            'instance_ids': [instance_id]}, content_type='application/json')
+
+    assert check_status('i-0123456789abcdef0').status_code == 200
+    response = check_status('i-0123456789abcdef1')
+
+    assert response.status_code == 429
+    assert response['Retry-After'] == '1'
@@ -0,0 +1,64 @@
+import pytest
+
+from core.api import AmazonAPIWrapper
+from ec2.constants import SECURITY_GROUP_INGRESS, SECURITY_GROUP_NAME
+
+
+def create_group(aws_client, name, ip_permissions):
+    ec2 = aws_client.get_raw_client()
+    group_id = ec2.create_security_group(GroupName=name, Description='test', VpcId=aws_client.get_vpc_id())['GroupId']
+    if ip_permissions:
+        ec2.authorize_security_group_ingress(GroupId=group_id, IpPermissions=ip_permissions)
+    return group_id
+
+
+def test_group_with_exactly_the_ingress_rules_is_reused(aws_client):
+    group_id = create_group(aws_client, SECURITY_GROUP_NAME, SECURITY_GROUP_INGRESS)
+
+    assert aws_client.resolve_security_group() == group_id
+
+
+@pytest.mark.parametrize('extra', [
+    {'IpProtocol': 'tcp', 'FromPort': 3306, 'ToPort': 3306, 'Ipv6Ranges': [{'CidrIpv6': '::/0'}]},
+    {'IpProtocol': 'tcp', 'FromPort': 80, 'ToPort': 80, 'Ipv6Ranges': [{'CidrIpv6': '::/0'}]},
+    {'IpProtocol': 'tcp', 'FromPort': 3306, 'ToPort': 3306, 'UserIdGroupPairs': 'other-group'},
+], ids=['ipv6-extra-port', 'ipv6-same-port', 'security-group-pair'])
+def test_group_opening_more_than_the_ingress_rules_is_not_reused(aws_client, extra):
+    ec2 = aws_client.get_raw_client()
+    if extra.get('UserIdGroupPairs') == 'other-group':
+        other_id = ec2.create_security_group(GroupName='other', Description='test',
+                                             VpcId=aws_client.get_vpc_id())['GroupId']
+        extra = dict(extra, UserIdGroupPairs=[{'GroupId': other_id}])
+    group_id = create_group(aws_client, SECURITY_GROUP_NAME, SECURITY_GROUP_INGRESS + [extra])
+
+    resolved = aws_client.resolve_security_group()
+
+    assert resolved != group_id
+    group = ec2.describe_security_groups(GroupIds=[resolved])['SecurityGroups'][0]
+    assert group['GroupName'].startswith(f'{SECURITY_GROUP_NAME}-')
+
+
+@pytest.mark.parametrize('extra', [
+    {'Ipv6Ranges': [{'CidrIpv6': '::/0'}]},
+    {'UserIdGroupPairs': [{'UserId': '123456789012', 'GroupId': 'sg-0123456789abcdef0'}]},
+    {'PrefixListIds': [{'PrefixListId': 'pl-0123456789abcdef0'}]},
+], ids=['ipv6', 'security-group-pair', 'prefix-list'])
+def test_every_source_kind_counts_when_comparing_groups(extra):
+    permissions = [dict(rule) for rule in SECURITY_GROUP_INGRESS]
+    permissions[0].update(extra)
+    groups = [{'GroupId': 'sg-1', 'VpcId': 'vpc-1', 'IpPermissions': SECURITY_GROUP_INGRESS},
+              {'GroupId': 'sg-2', 'VpcId': 'vpc-1', 'IpPermissions': permissions}]
+
+    assert AmazonAPIWrapper.pick_security_group(groups[1:], 'vpc-1') is None
+    assert AmazonAPIWrapper.pick_security_group(groups, 'vpc-1') == 'sg-1'
+
+
+def test_group_created_meanwhile_by_another_launch_does_not_fail_the_launch(aws_client):
+    # Another launch created the group after this one looked for it
+    taken_id = create_group(aws_client, SECURITY_GROUP_NAME, [])
+
+    created_id = aws_client.create_security_group(aws_client.get_vpc_id(), name_taken=False)
+
+    assert created_id != taken_id
+    group = aws_client.get_raw_client().describe_security_groups(GroupIds=[created_id])['SecurityGroups'][0]
+    assert group['GroupName'].startswith(f'{SECURITY_GROUP_NAME}-')
@@ -0,0 +1,74 @@
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from core.services import AmazonService
+from ec2.models import Instance
+
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+@pytest.fixture
+def describe_calls(aws_client):
+    """
+    Ids of the instances of every describe_instances call, sent as instance-id filters
+    """
+    calls = []
+    aws_client.get_raw_client().meta.events.register(
+        'before-parameter-build.ec2.DescribeInstances',
+        lambda params, **kwargs: calls.append(params['Filters'][0]['Values']))
+    return calls
+
+
+@pytest.fixture
+def launched(aws_client, credentials, wordpress_ami):
+    """
+    Id of an instance launched through the launchpad, indexed as pending
+    """
+    return AmazonService.create_vm(**credentials)['InstanceId']
+
+
+def test_settled_instance_is_served_out_of_the_index(credentials, launched, describe_calls):
+    Instance.objects.filter(instance_id=launched).update(state='running', state_code=16, refreshed_at=timezone.now())
+
+    status = AmazonService.get_instance_status(launched, **credentials)
+
+    assert status['Raw'] == 'running'
+    assert 'RefreshedAt' in status
+    assert describe_calls == []
+
+
+def test_transitional_instance_is_checked_with_aws_and_indexed(credentials, launched, describe_calls):
+    assert Instance.objects.get(instance_id=launched).state == 'pending'
+
+    status = AmazonService.get_instance_status(launched, **credentials)
+
+    assert status['Raw'] == 'running'
+    assert len(describe_calls) == 1
+    # Written back, the next check does not reach AWS
+    assert Instance.objects.get(instance_id=launched).state == 'running'
+    assert AmazonService.get_instance_status(launched, **credentials)['Raw'] == 'running'
+    assert len(describe_calls) == 1
+
+
+def test_stale_instance_is_checked_with_aws(credentials, launched, describe_calls, settings):
+    Instance.objects.filter(instance_id=launched).update(
+        state='running', state_code=16, refreshed_at=timezone.now() - timedelta(seconds=settings.EC2_INDEX_MAX_AGE + 1))
+
+    AmazonService.get_instance_status(launched, **credentials)
+
+    assert len(describe_calls) == 1
+    assert Instance.objects.get(instance_id=launched).refreshed_at > timezone.now() - timedelta(seconds=5)
+
+
+def test_batch_checks_with_aws_only_the_instances_the_index_cannot_serve(aws_client, credentials, launched,
+                                                                         wordpress_ami, describe_calls):
+    Instance.objects.filter(instance_id=launched).update(state='running', state_code=16, refreshed_at=timezone.now())
+    unknown = aws_client.get_raw_client().run_instances(ImageId=wordpress_ami, MinCount=1,
+                                                        MaxCount=1)['Instances'][0]['InstanceId']
+
+    result = AmazonService.get_instances_status([launched, unknown], **credentials)
+
+    assert set(result['Instances']) == {launched, unknown}
+    assert describe_calls == [[unknown]]
@@ -0,0 +1,198 @@
+import threading
+import time
+
+import pytest
+from django.db import connection
+from django.utils import timezone
+
+from core.index import InstanceIndex
+from core.services import AmazonService
+from core.warmpool import WarmPool, get_warm_pool
+from ec2.models import Instance
+
+pytestmark = pytest.mark.django_db(transaction=True)
+
+INSTANCE_TYPE = 't2.micro'
+
+
+@pytest.fixture
+def warm_pool_settings(settings):
+    settings.EC2_WARM_POOL_ENABLED = True
+    settings.EC2_WARM_POOL_SIZES = {INSTANCE_TYPE: 1}
+    settings.EC2_WARM_POOL_POLL_INTERVAL = 1
+    settings.EC2_WARM_POOL_POLL_ATTEMPTS = 5
+    return settings
+
+
+def make_pool(size):
+    return WarmPool({INSTANCE_TYPE: size}, max_workers=2, max_queued=8, poll_interval=1, poll_attempts=5)
+
+
+def wait_for_refills(warm_pool, timeout=30):
+    deadline = time.monotonic() + timeout
+    while warm_pool.stats()['in_flight']:
+        assert time.monotonic() < deadline, 'the warm pool refill did not finish'
+        time.sleep(0.05)
+
+
+def fill(warm_pool, aws_client, ami):
+    """
+    Refills the pool until it is full. moto launches MinCount instances instead of up to MaxCount, so every refill
+    adds a single spare.
+    """
+    for _ in range(warm_pool.size(INSTANCE_TYPE)):
+        warm_pool.refill(aws_client, INSTANCE_TYPE, ami)
+        wait_for_refills(warm_pool)
+        if InstanceIndex.count_pooled(aws_client, INSTANCE_TYPE) >= warm_pool.size(INSTANCE_TYPE):
+            return
+
+
+def aws_states(aws_client, instance_ids):
+    reservations = aws_client.get_raw_client().describe_instances(InstanceIds=instance_ids)['Reservations']
+    return {instance['InstanceId']: instance['State']['Name']
+            for reservation in reservations for instance in reservation['Instances']}
+
+
+def served(warm_pool):
+    return {labels['source']: value for _, labels, value in warm_pool._served.samples()
+            if labels['instance_type'] == INSTANCE_TYPE}
+
+
+def refill_lag_count(warm_pool):
+    return sum(value for name, labels, value in warm_pool._refill_lag.samples()
+               if name.endswith('_count') and labels['instance_type'] == INSTANCE_TYPE)
+
+
+def test_refill_provisions_stopped_spares_up_to_the_size(aws_client, wordpress_ami):
+    warm_pool = make_pool(2)
+    observed = refill_lag_count(warm_pool)
+
+    fill(warm_pool, aws_client, wordpress_ami)
+
+    spares = list(Instance.objects.pooled(INSTANCE_TYPE))
+    assert len(spares) == 2
+    assert {spare.state for spare in spares} == {'stopped'}
+    assert set(aws_states(aws_client, [spare.instance_id for spare in spares]).values()) == {'stopped'}
+    assert refill_lag_count(warm_pool) == observed + 2
+
+
+def test_refill_tops_the_pool_up_after_a_claim(aws_client, wordpress_ami):
+    warm_pool = make_pool(2)
+    fill(warm_pool, aws_client, wordpress_ami)
+
+    claimed = warm_pool.claim(aws_client, INSTANCE_TYPE, 1)
+    assert InstanceIndex.count_pooled(aws_client, INSTANCE_TYPE) == 1
+
+    fill(warm_pool, aws_client, wordpress_ami)
+    assert InstanceIndex.count_pooled(aws_client, INSTANCE_TYPE) == 2
+    assert claimed[0].instance_id not in Instance.objects.pooled(INSTANCE_TYPE).values_list('instance_id', flat=True)
+
+    # Already full, nothing is launched
+    launched = Instance.objects.count()
+    fill(warm_pool, aws_client, wordpress_ami)
+    assert Instance.objects.count() == launched
+
+
+def test_claim_starts_the_oldest_spares(aws_client, wordpress_ami):
+    warm_pool = make_pool(2)
+    fill(warm_pool, aws_client, wordpress_ami)
+    oldest = Instance.objects.pooled(INSTANCE_TYPE).order_by('launched_at').first()
+
+    claimed = warm_pool.claim(aws_client, INSTANCE_TYPE, 1)
+
+    assert [instance.instance_id for instance in claimed] == [oldest.instance_id]
+    assert claimed[0].state in ('pending', 'running')
+    assert aws_states(aws_client, [oldest.instance_id])[oldest.instance_id] in ('pending', 'running')
+    oldest.refresh_from_db()
+    assert not oldest.pooled
+    assert oldest.state == claimed[0].state
+
+
+def test_claim_never_hands_out_a_spare_twice(aws_client, wordpress_ami):
+    warm_pool = make_pool(3)
+    fill(warm_pool, aws_client, wordpress_ami)
+
+    first = warm_pool.claim(aws_client, INSTANCE_TYPE, 2)
+    second = warm_pool.claim(aws_client, INSTANCE_TYPE, 2)
+
+    assert len(first) == 2
+    assert len(second) == 1
+    assert not {instance.instance_id for instance in first} & {instance.instance_id for instance in second}
+    assert warm_pool.claim(aws_client, INSTANCE_TYPE, 1) == []
+
+
+def test_concurrent_claims_never_hand_out_a_spare_twice(aws_client, wordpress_ami):
+    warm_pool = make_pool(3)
+    fill(warm_pool, aws_client, wordpress_ami)
+    barrier = threading.Barrier(6)
+    claimed = []
+    lock = threading.Lock()
+
+    def claim():
+        try:
+            barrier.wait()
+            instances = warm_pool.claim(aws_client, INSTANCE_TYPE, 1)
+            with lock:
+                claimed.extend(instance.instance_id for instance in instances)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=claim) for _ in range(barrier.parties)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(claimed) == 3
+    assert len(set(claimed)) == 3
+    assert InstanceIndex.count_pooled(aws_client, INSTANCE_TYPE) == 0
+
+
+def test_launch_goes_cold_when_the_pool_is_empty_then_refills_it(aws_client, credentials, wordpress_ami,
+                                                                 warm_pool_settings):
+    warm_pool = get_warm_pool()
+    before = served(warm_pool)
+
+    result = AmazonService.create_vm(**credentials, instance_type=INSTANCE_TYPE)
+    wait_for_refills(warm_pool)
+
+    assert result['Pooled'] == 0
+    assert result['Launched'] == 1
+    assert served(warm_pool).get('cold', 0) == before.get('cold', 0) + 1
+    spare = Instance.objects.pooled(INSTANCE_TYPE).get()
+    assert spare.state == 'stopped'
+    assert spare.instance_id != result['InstanceId']
+
+
+def test_launch_is_served_out_of_the_pool(aws_client, credentials, wordpress_ami, warm_pool_settings):
+    warm_pool = get_warm_pool()
+    fill(warm_pool, aws_client, wordpress_ami)
+    spare = Instance.objects.pooled(INSTANCE_TYPE).get()
+    before = served(warm_pool)
+
+    result = AmazonService.create_vm(**credentials, instance_type=INSTANCE_TYPE)
+    wait_for_refills(warm_pool)
+
+    assert result['Pooled'] == 1
+    assert result['InstanceIds'] == [spare.instance_id]
+    assert served(warm_pool).get('pool', 0) == before.get('pool', 0) + 1
+    assert served(warm_pool).get('cold', 0) == before.get('cold', 0)
+    # Refilled behind the launch
+    assert Instance.objects.pooled(INSTANCE_TYPE).exclude(instance_id=spare.instance_id).count() == 1
+
+
+def test_launch_goes_cold_when_a_spare_cannot_be_started(aws_client, credentials, wordpress_ami,
+                                                         warm_pool_settings):
+    broken = Instance.objects.create(credential_key=aws_client.credential_key, region=aws_client.region_name,
+                                     instance_id='i-0123456789abcdef0', state='stopped', state_code=80,
+                                     instance_type=INSTANCE_TYPE, refreshed_at=timezone.now(), pooled=True)
+    warm_pool = get_warm_pool()
+
+    result = AmazonService.create_vm(**credentials, instance_type=INSTANCE_TYPE)
+    wait_for_refills(warm_pool)
+
+    assert result['Pooled'] == 0
+    assert result['Launched'] == 1
+    assert result['InstanceId'] != broken.instance_id
+    broken.refresh_from_db()
+    assert not broken.pooled
@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+from django.conf import settings
+
+from core.metrics import get_metrics_registry, instrument_client, metrics_enabled
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.RLock()
+
+
+def get_session():
+    """
+    Returns the boto3 session shared by every client and resource of the process. Sharing it means the service models
+    and the credential/endpoint machinery are loaded once instead of once per client.
+    :return: boto3.session.Session
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = boto3.session.Session()
+    return _session
+
+
+def get_client_config():
+    """
+    Builds the botocore configuration used by every client: a connection pool big enough for the concurrent requests a
+    worker serves, TCP keep-alive so pooled connections survive between polls, and bounded timeouts. Throttled and
+    failed calls are retried with exponential backoff and jitter, in adaptive mode botocore also slows down the calls
+    of a client while AWS keeps throttling them.
+    :return: botocore Config
+    """
+    return Config(max_pool_connections=settings.AWS_MAX_POOL_CONNECTIONS,
+                  connect_timeout=settings.AWS_CONNECT_TIMEOUT,
+                  read_timeout=settings.AWS_READ_TIMEOUT,
+                  tcp_keepalive=settings.AWS_TCP_KEEPALIVE,
+                  retries={'mode': settings.AWS_RETRY_MODE, 'max_attempts': settings.AWS_MAX_ATTEMPTS})
+
+
+def create_resource(service, client_id, client_secret, region_name):
+    """
+    Creates a boto3 resource out of the shared session. botocore sessions are not thread safe while building clients,
+    so constructions are serialized, using the clients afterwards is safe. Calls are instrumented, see core.metrics.
+    """
+    with _session_lock:
+        resource = get_session().resource(service,
+                                          aws_access_key_id=client_id,
+                                          aws_secret_access_key=client_secret,
+                                          region_name=region_name,
+                                          endpoint_url=settings.AWS_ENDPOINT_URL,
+                                          config=get_client_config())
+    instrument_client(resource.meta.client)
+    return resource
+
+
+def create_client(service, client_id, client_secret, region_name):
+    """
+    Creates a low level boto3 client out of the shared session, see create_resource.
+    """
+    with _session_lock:
+        client = get_session().client(service,
+                                      aws_access_key_id=client_id,
+                                      aws_secret_access_key=client_secret,
+                                      region_name=region_name,
+                                      endpoint_url=settings.AWS_ENDPOINT_URL,
+                                      config=get_client_config())
+    return instrument_client(client)
+
+
+def warm_up(services=('ec2',), region_name=None):
+    """
+    Loads up front, once per process, what the first requests would otherwise pay for on the request path: the shared
+    session, the endpoints data and, for every service, its service model and resource definitions, which are parsed
+    once and cached by the session loader. Throwaway clients and resources are built with dummy credentials, nothing
+    is sent to AWS.
+    :param services: AWS service names
+    :param region_name: AWS region of the throwaway clients
+    :return: seconds the warm-up took
+    """
+    started = time.perf_counter()
+    for service in services:
+        create_resource(service, 'warm-up', 'warm-up', region_name)
+    duration = time.perf_counter() - started
+
+    logger.info(f'AWS transport warmed up in {duration:.3f}s for {", ".join(services)}')
+    if metrics_enabled():
+        get_metrics_registry().gauge('aws_warm_up_seconds', 'Time the AWS transport warm-up took at startup', (),
+                                     lambda: {(): duration})
+    return duration
+
+
+def warm_up_worker():
+    """
+    Loads, when WARM_UP_ENABLED, what the first requests of a fresh worker would otherwise load: the AWS transport, see
+    warm_up, and the URLconf with the views and services it imports. Called by wsgi.py once the application is loaded,
+    so it runs in every worker process of the server and never for the manage.py commands.
+    """
+    if not settings.WARM_UP_ENABLED:
+        return
+
+    from django.urls import get_resolver
+    from ec2.constants import DEFAULT_REGION
+
+    started = time.perf_counter()
+    warm_up(region_name=DEFAULT_REGION)
+    get_resolver().url_patterns
+    logger.info(f'Worker warmed up in {time.perf_counter() - started:.3f}s')
@@ -0,0 +1,56 @@
+from django.http import Http404, HttpResponse
+from rest_framework.views import APIView
+
+from core.api import get_client_registry
+from core.executor import get_request_executor, get_stream_limit
+from core.images import get_image_resolver
+from core.jobs import get_job_manager
+from core.metrics import get_metrics_registry, metrics_enabled
+from core.permissions import get_permission_cache
+from core.sessions import get_session_store
+from core.warmpool import get_warm_pool
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsView(APIView):
+    """
+    Scrape endpoint exposing the metrics of the process in the Prometheus text format
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        if not metrics_enabled():
+            raise Http404()
+        return HttpResponse(get_metrics_registry().render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def _executors():
+    values = {}
+    executors = [('launch_jobs', get_job_manager()), ('aws_requests', get_request_executor()),
+                 ('streams', get_stream_limit())]
+    if get_warm_pool() is not None:
+        executors.append(('warm_pool_refills', get_warm_pool()))
+    for name, stats in ((name, executor.stats()) for name, executor in executors):
+        values[(name, 'in_flight')] = stats['in_flight']
+        values[(name, 'capacity')] = stats['max_workers'] + stats['max_queued']
+    return values
+
+
+def _cache_stats(name, cache):
+    stats = cache.stats()
+    return {(name, key): stats[key] for key in ('size', 'hits', 'misses', 'evictions', 'expirations')}
+
+
+def _caches():
+    values = _cache_stats('client_registry', get_client_registry())
+    values.update(_cache_stats('permissions', get_permission_cache()))
+    values.update(_cache_stats('sessions', get_session_store()))
+    values.update(_cache_stats('images', get_image_resolver()))
+    return values
+
+
+get_metrics_registry().gauge('executor_tasks', 'Tasks in flight per bounded executor and the most it accepts',
+                             ('executor', 'kind'), _executors)
+get_metrics_registry().gauge('cache_stats', 'Size and counters of the process caches', ('cache', 'stat'), _caches)
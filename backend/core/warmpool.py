@@ -0,0 +1,184 @@
+import logging
+import threading
+import time
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+
+from core.exceptions import ServiceOverloaded
+from core.executor import BoundedExecutor
+from core.index import InstanceIndex
+from core.metrics import get_metrics_registry, metrics_enabled
+from core.pipeline import LaunchPipeline
+from core.poller import get_instance_poller
+
+logger = logging.getLogger(__name__)
+
+# Seconds, provisioning a spare means booting it and stopping it again
+REFILL_LAG_BUCKETS = (30, 60, 120, 180, 300, 600, 900, 1800)
+
+
+class WarmPool(object):
+    """
+    Keeps, per credentials, region and instance type, up to a target number of already provisioned and stopped
+    instances so launches are served by starting them, in seconds, instead of running brand new ones from the AMI.
+    The spares are tracked in the instances index, see InstanceIndex.claim_pooled.
+
+    The pool is refilled in the background after every launch of an instance type with a target size. Secrets are
+    never stored, so the refill uses the client of the launch that drained the pool and the pool of some credentials
+    is first filled by their first launch.
+    """
+
+    def __init__(self, sizes, max_workers, max_queued, poll_interval=15, poll_attempts=40):
+        self.sizes = sizes
+        self.poll_interval = poll_interval
+        self.poll_attempts = poll_attempts
+
+        self._executor = BoundedExecutor(max_workers, max_queued, thread_name_prefix='warm-pool')
+        self._refilling = set()
+        self._lock = threading.Lock()
+
+        if metrics_enabled():
+            registry = get_metrics_registry()
+            self._served = registry.counter('warm_pool_instances_total',
+                                            'Instances handed out by launches, out of the warm pool or launched cold',
+                                            ('instance_type', 'source'))
+            self._refill_lag = registry.histogram('warm_pool_refill_lag_seconds',
+                                                  'Time from a refill being requested to its spares being ready',
+                                                  ('instance_type',), buckets=REFILL_LAG_BUCKETS)
+        else:
+            self._served = self._refill_lag = None
+
+    def size(self, instance_type):
+        return self.sizes.get(instance_type, 0)
+
+    def claim(self, aws_client, instance_type, count):
+        """
+        Starts up to count spares of the pool. The ones that cannot be started are taken out of the pool, the launch
+        goes cold for them.
+        :param aws_client: AmazonAPIWrapper of the launch
+        :param instance_type: type of the instances
+        :param count: number of instances the launch wants
+        :return: list of Instance started, their state is the one given by StartInstances
+        """
+        if not self.size(instance_type):
+            return []
+
+        claimed = InstanceIndex.claim_pooled(aws_client, instance_type, count)
+        if not claimed:
+            return []
+
+        instance_ids = [instance.instance_id for instance in claimed]
+        try:
+            starting, errors = aws_client.change_instances_state('start', instance_ids)
+        except ClientError as e:
+            logger.warning(f'Could not start the warm pool instances {instance_ids}, {e}')
+            InstanceIndex.release_pooled(aws_client, instance_ids)
+            return []
+        if errors:
+            logger.warning(f'Could not start the warm pool instances {errors}')
+            InstanceIndex.release_pooled(aws_client, list(errors))
+
+        claimed = [instance for instance in claimed if instance.instance_id in starting]
+        for instance in claimed:
+            state = starting[instance.instance_id].get('CurrentState', {})
+            instance.state = state.get('Name', 'pending')
+            instance.state_code = state.get('Code')
+            InstanceIndex.record_state(aws_client, instance.instance_id, state)
+            get_instance_poller().forget(aws_client, instance.instance_id)
+
+        logger.info(f'Served {len(claimed)} {instance_type} instances out of the warm pool of {aws_client.region_name}')
+        return claimed
+
+    def record_served(self, instance_type, pooled, launched):
+        if self._served is not None:
+            self._served.inc(pooled, instance_type=instance_type, source='pool')
+            self._served.inc(launched, instance_type=instance_type, source='cold')
+
+    def refill(self, aws_client, instance_type, ami):
+        """
+        Queues a refill of the pool, unless one is already running or queued for the same credentials, region and type
+        :param aws_client: AmazonAPIWrapper of the pool owner
+        :param instance_type: type of the instances
+        :param ami: id of the image of the spares
+        """
+        if not self.size(instance_type):
+            return
+
+        key = (aws_client.credential_key, aws_client.region_name, instance_type)
+        with self._lock:
+            if key in self._refilling:
+                return
+            self._refilling.add(key)
+
+        try:
+            self._executor.submit(self._refill, key, aws_client, instance_type, ami, time.perf_counter())
+        except ServiceOverloaded:
+            logger.warning(f'Too many warm pool refills in progress, skipping {instance_type} in '
+                           f'{aws_client.region_name}')
+            with self._lock:
+                self._refilling.discard(key)
+
+    def stats(self):
+        return self._executor.stats()
+
+    def _refill(self, key, aws_client, instance_type, ami, requested_at):
+        """
+        Launches the missing spares, waits for them to boot and stops them. Spares that could not be provisioned are
+        taken out of the pool, they are listed as any other instance of the credentials.
+        """
+        try:
+            missing = self.size(instance_type) - InstanceIndex.count_pooled(aws_client, instance_type)
+            if missing <= 0:
+                return
+
+            instances, _ = LaunchPipeline(aws_client, count=missing, instance_type=instance_type, ami=ami).run()
+            InstanceIndex.record_launch(aws_client, instances, ami, instance_type, missing, pooled=True)
+            instance_ids = [instance.id for instance in instances]
+
+            try:
+                aws_client.wait_for('instance_running', instance_ids, self.poll_interval, self.poll_attempts)
+                _, errors = aws_client.change_instances_state('stop', instance_ids)
+                if errors:
+                    InstanceIndex.release_pooled(aws_client, list(errors))
+                    instance_ids = [instance_id for instance_id in instance_ids if instance_id not in errors]
+                if instance_ids:
+                    aws_client.wait_for('instance_stopped', instance_ids, self.poll_interval, self.poll_attempts)
+            except Exception:
+                InstanceIndex.release_pooled(aws_client, instance_ids)
+                raise
+
+            InstanceIndex.record_pooled_ready(aws_client, instance_ids)
+            lag = time.perf_counter() - requested_at
+            if self._refill_lag is not None:
+                self._refill_lag.observe(lag, instance_type=instance_type)
+            logger.info(f'Warm pool of {instance_type} in {aws_client.region_name} refilled with {len(instance_ids)} '
+                        f'instances in {lag:.1f}s')
+        except Exception:
+            logger.exception(f'Error refilling the warm pool of {instance_type} in {aws_client.region_name}')
+        finally:
+            with self._lock:
+                self._refilling.discard(key)
+
+
+_warm_pool = None
+_warm_pool_lock = threading.Lock()
+
+
+def get_warm_pool():
+    """
+    Lazily builds the process wide WarmPool out of the EC2_WARM_POOL_* settings. The pool needs the instances index.
+    :return: WarmPool or None if it is disabled
+    """
+    global _warm_pool
+    if not settings.EC2_WARM_POOL_ENABLED or not settings.EC2_INDEX_ENABLED:
+        return None
+    if _warm_pool is None:
+        with _warm_pool_lock:
+            if _warm_pool is None:
+                _warm_pool = WarmPool(sizes=settings.EC2_WARM_POOL_SIZES,
+                                      max_workers=settings.EC2_WARM_POOL_WORKERS,
+                                      max_queued=settings.EC2_WARM_POOL_QUEUE_SIZE,
+                                      poll_interval=settings.EC2_WARM_POOL_POLL_INTERVAL,
+                                      poll_attempts=settings.EC2_WARM_POOL_POLL_ATTEMPTS)
+    return _warm_pool
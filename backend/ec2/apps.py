@@ -1,5 +0,0 @@
-from django.apps import AppConfig
-
-
-class Ec2Config(AppConfig):
-    name = 'ec2'
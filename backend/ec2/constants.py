@@ -1,6 +1,52 @@
-WORDPRESS_AMI = 'ami-0ec852340933f4f48'
+DEFAULT_REGION = 'eu-west-1'
+# Bitnami WordPress AMI per region, AMI ids are regional. Launches use the latest image, looked up by core.images, these
+# are only used when the lookup fails
+WORDPRESS_AMIS = {
+    'eu-west-1': 'ami-0ec852340933f4f48',
+}
+WORDPRESS_AMI = WORDPRESS_AMIS[DEFAULT_REGION]
+DEFAULT_INSTANCE_TYPE = 't2.micro'
+# Tag put on every instance launched by the launchpad so they can be found in any region
+LAUNCHPAD_TAG_KEY = 'launchpad'
+LAUNCHPAD_TAG_VALUE = 'aws-launchpad'
 SECURITY_GROUP_NAME = 'bitnami-wordpress-sg'
 SECURITY_GROUP_DESCRIPTION = 'Opens port 80, 443 and 22'
+SECURITY_GROUP_INGRESS = [
+    {'IpProtocol': 'tcp',
+     'FromPort': 80,
+     'ToPort': 80,
+     'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
+    {'IpProtocol': 'tcp',
+     'FromPort': 443,
+     'ToPort': 443,
+     'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
+    {'IpProtocol': 'tcp',
+     'FromPort': 22,
+     'ToPort': 22,
+     'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
+]
+
+INSTANCE_STATES = ('pending', 'running', 'shutting-down', 'terminated', 'stopping', 'stopped')
+
+# Maximum number of instances launched by a single request and by a single RunInstances call
+MAX_LAUNCH_COUNT = 200
+MAX_INSTANCES_PER_RUN = 100
+# RunInstances ClientToken can be up to 64 ASCII characters
+MAX_CLIENT_TOKEN_LENGTH = 64
+# Maximum number of instance ids accepted by the batch endpoints
+MAX_BATCH_INSTANCE_IDS = 500
+# Maximum number of instance ids sent in a single StartInstances, StopInstances or TerminateInstances call, as
+# documented by AWS
+MAX_STATE_CHANGE_IDS = 1000
+# Bulk state change actions: boto3 client method and response key with the state transitions
+STATE_CHANGE_ACTIONS = {
+    'start': ('start_instances', 'StartingInstances'),
+    'stop': ('stop_instances', 'StoppingInstances'),
+    'terminate': ('terminate_instances', 'TerminatingInstances'),
+}
+# EC2 accepts up to 200 values per filter and 1000 results per describe_instances page
+MAX_FILTER_VALUES = 200
+DESCRIBE_INSTANCES_PAGE_SIZE = 1000
 
 ERROR_GETTING_STATUS = {
     'message': 'There has been an error getting the status of the VM',
@@ -0,0 +1,58 @@
+# Generated by Django 2.2.7 on 2026-10-18 08:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Instance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(help_text='Fingerprint of the credentials that launched the instance', max_length=64)),
+                ('region', models.CharField(max_length=32)),
+                ('instance_id', models.CharField(max_length=32, unique=True)),
+                ('state', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('shutting-down', 'shutting-down'), ('terminated', 'terminated'), ('stopping', 'stopping'), ('stopped', 'stopped')], max_length=16)),
+                ('state_code', models.PositiveSmallIntegerField(null=True)),
+                ('instance_type', models.CharField(max_length=32)),
+                ('availability_zone', models.CharField(blank=True, default='', max_length=32)),
+                ('public_ip', models.GenericIPAddressField(blank=True, null=True)),
+                ('launched_at', models.DateTimeField(auto_now_add=True)),
+                ('refreshed_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LaunchRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(help_text='Fingerprint of the credentials that launched the instances', max_length=64)),
+                ('region', models.CharField(max_length=32)),
+                ('job_id', models.CharField(blank=True, default='', max_length=32)),
+                ('ami', models.CharField(max_length=32)),
+                ('instance_type', models.CharField(max_length=32)),
+                ('requested', models.PositiveIntegerField()),
+                ('launched', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='launchrecord',
+            index=models.Index(fields=['account', 'region', 'created_at'], name='ec2_launchr_account_d57687_idx'),
+        ),
+        migrations.AddField(
+            model_name='instance',
+            name='launch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='instances', to='ec2.LaunchRecord'),
+        ),
+        migrations.AddIndex(
+            model_name='instance',
+            index=models.Index(fields=['account', 'region', 'state', 'instance_id'], name='ec2_instanc_account_297574_idx'),
+        ),
+    ]
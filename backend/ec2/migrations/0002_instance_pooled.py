@@ -0,0 +1,22 @@
+# Generated by Django 2.2.7 on 2026-10-18 09:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ec2', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instance',
+            name='pooled',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='instance',
+            index=models.Index(fields=['account', 'region', 'pooled', 'instance_type', 'state'], name='ec2_instanc_account_092133_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.7 on 2026-10-18 09:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ec2', '0002_instance_pooled'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResolvedImage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region', models.CharField(max_length=32, unique=True)),
+                ('image_id', models.CharField(max_length=32)),
+                ('name', models.CharField(blank=True, default='', max_length=255)),
+                ('creation_date', models.CharField(blank=True, default='', max_length=32)),
+                ('resolved_at', models.DateTimeField()),
+            ],
+        ),
+    ]
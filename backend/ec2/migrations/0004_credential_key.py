@@ -0,0 +1,47 @@
+# Generated by Django 2.2.7 on 2026-10-18 09:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ec2', '0003_resolvedimage'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='instance',
+            name='ec2_instanc_account_297574_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='instance',
+            name='ec2_instanc_account_092133_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='launchrecord',
+            name='ec2_launchr_account_d57687_idx',
+        ),
+        migrations.RenameField(
+            model_name='instance',
+            old_name='account',
+            new_name='credential_key',
+        ),
+        migrations.RenameField(
+            model_name='launchrecord',
+            old_name='account',
+            new_name='credential_key',
+        ),
+        migrations.AddIndex(
+            model_name='instance',
+            index=models.Index(fields=['credential_key', 'region', 'state', 'instance_id'], name='ec2_instanc_credent_1cc2c0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='instance',
+            index=models.Index(fields=['credential_key', 'region', 'pooled', 'instance_type', 'state'], name='ec2_instanc_credent_bc0986_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='launchrecord',
+            index=models.Index(fields=['credential_key', 'region', 'created_at'], name='ec2_launchr_credent_29ec4e_idx'),
+        ),
+    ]
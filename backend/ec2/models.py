@@ -1,3 +1,107 @@
 from django.db import models
 
-# Create your models here.
+from ec2.constants import INSTANCE_STATES
+
+FINAL_STATES = ('terminated',)
+
+
+class LaunchRecord(models.Model):
+    """
+    One launch request, as queued by the create endpoint
+    """
+    credential_key = models.CharField(max_length=64,
+                                      help_text='Fingerprint of the credentials that launched the instances')
+    region = models.CharField(max_length=32)
+    job_id = models.CharField(max_length=32, blank=True, default='')
+    ami = models.CharField(max_length=32)
+    instance_type = models.CharField(max_length=32)
+    requested = models.PositiveIntegerField()
+    launched = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['credential_key', 'region', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.launched}/{self.requested} {self.instance_type} in {self.region}'
+
+
+class ResolvedImage(models.Model):
+    """
+    Last WordPress image looked up for a region, see core.images
+    """
+    region = models.CharField(max_length=32, unique=True)
+    image_id = models.CharField(max_length=32)
+    name = models.CharField(max_length=255, blank=True, default='')
+    creation_date = models.CharField(max_length=32, blank=True, default='')
+    resolved_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.image_id} in {self.region}'
+
+
+class InstanceQuerySet(models.QuerySet):
+
+    def owned_by(self, credential_key, region):
+        return self.filter(credential_key=credential_key, region=region)
+
+    def live(self):
+        return self.exclude(state__in=FINAL_STATES)
+
+    def pooled(self, instance_type):
+        return self.filter(pooled=True, instance_type=instance_type)
+
+
+class Instance(models.Model):
+    """
+    Last known state of an instance launched by the launchpad. refreshed_at tells when it was last checked with AWS.
+    Pooled instances are spares of the warm pool, not handed out to any launch yet, see core.warmpool.
+    """
+    credential_key = models.CharField(max_length=64,
+                                      help_text='Fingerprint of the credentials that launched the instance')
+    region = models.CharField(max_length=32)
+    instance_id = models.CharField(max_length=32, unique=True)
+    launch = models.ForeignKey(LaunchRecord, related_name='instances', null=True, blank=True,
+                               on_delete=models.SET_NULL)
+    state = models.CharField(max_length=16, choices=[(state, state) for state in INSTANCE_STATES])
+    state_code = models.PositiveSmallIntegerField(null=True)
+    instance_type = models.CharField(max_length=32)
+    availability_zone = models.CharField(max_length=32, blank=True, default='')
+    public_ip = models.GenericIPAddressField(null=True, blank=True)
+    launched_at = models.DateTimeField(auto_now_add=True)
+    refreshed_at = models.DateTimeField()
+    pooled = models.BooleanField(default=False)
+
+    objects = InstanceQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['credential_key', 'region', 'state', 'instance_id']),
+            models.Index(fields=['credential_key', 'region', 'pooled', 'instance_type', 'state']),
+        ]
+
+    def __str__(self):
+        return f'{self.instance_id} ({self.state})'
+
+    def apply(self, description):
+        """
+        Copies the mutable attributes of an instance description as returned by describe_instances
+        :param description: instance description
+        :return: True if anything changed
+        """
+        state = description.get('State', {})
+        values = {
+            'state': state.get('Name', self.state),
+            'state_code': state.get('Code', self.state_code),
+            'instance_type': description.get('InstanceType', self.instance_type),
+            'availability_zone': description.get('Placement', {}).get('AvailabilityZone', self.availability_zone),
+            'public_ip': description.get('PublicIpAddress'),
+        }
+        changed = False
+        for field, value in values.items():
+            if getattr(self, field) != value:
+                setattr(self, field, value)
+                changed = True
+        return changed
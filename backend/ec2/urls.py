@@ -1,9 +1,19 @@
 from django.conf.urls import url
 
-from ec2.views import EC2CreateVMView, EC2CheckStatusView, EC2StopInstanceView
+from ec2.views import EC2CreateVMView, EC2CheckStatusView, EC2StopInstanceView, EC2BatchCheckStatusView, \
+    EC2StatusStreamView, EC2LaunchJobView, EC2LocateView, EC2InventoryView, \
+    EC2InstancesView, EC2BulkStateView, EC2SessionView
 
 urlpatterns = [
+    url(r'^jobs/(?P<job_id>[0-9a-f]{32})$', EC2LaunchJobView.as_view(), name='launch-job'),
+    url(r'^session$', EC2SessionView.as_view(), name='session'),
     url(r'create', EC2CreateVMView.as_view(), name='create-vm'),
+    url(r'check-status-batch', EC2BatchCheckStatusView.as_view(), name='check-status-batch'),
     url(r'check-status', EC2CheckStatusView.as_view(), name='check-status'),
+    url(r'status-stream', EC2StatusStreamView.as_view(), name='status-stream'),
     url(r'stop-instance', EC2StopInstanceView.as_view(), name='stop-instance'),
+    url(r'^instances/(?P<action>start|stop|terminate)$', EC2BulkStateView.as_view(), name='instances-state'),
+    url(r'instances', EC2InstancesView.as_view(), name='instances'),
+    url(r'inventory', EC2InventoryView.as_view(), name='inventory'),
+    url(r'locate', EC2LocateView.as_view(), name='locate'),
 ]
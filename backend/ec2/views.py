@@ -1,24 +1,236 @@
+import json
 import logging
+import math
+import re
+import time
 
 from core.exceptions import AWSException
+from core.executor import get_stream_limit, run_bounded
 from core.services import AmazonService
-from django.forms import Form, fields
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.forms import Form, MultipleHiddenInput, fields
+from django.http import StreamingHttpResponse
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from ec2.constants import MAX_BATCH_INSTANCE_IDS, MAX_LAUNCH_COUNT, DEFAULT_INSTANCE_TYPE, DEFAULT_REGION, \
+    INSTANCE_STATES
+
 logger = logging.getLogger(__name__)
 
+INSTANCE_TYPE_PATTERN = re.compile(r'^[a-z0-9-]+\.[a-z0-9-]+$')
+SESSION_EXPIRED = 'session_expired'
+
+
+def invalid_form_response(request_form):
+    """
+    Response for a request that did not validate, a 401 if its session expired so clients know they have to open
+    another one
+    """
+    session_errors = request_form.errors.as_data().get('session', [])
+    if any(error.code == SESSION_EXPIRED for error in session_errors):
+        return Response(data=request_form.errors, status=status.HTTP_401_UNAUTHORIZED)
+    return Response(data=request_form.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+def error_response(aws_e):
+    """
+    Response for an AWSException, telling clients when to retry if the service is overloaded
+    """
+    response = Response(data=str(aws_e), status=aws_e.status)
+    retry_after = getattr(aws_e, 'retry_after', None)
+    if retry_after:
+        response['Retry-After'] = str(int(math.ceil(retry_after)))
+    return response
+
 
-class EC2VMRequest(Form):
+class EC2VMCredentials(Form):
     client_id = fields.CharField(required=True, max_length=128)
     client_secret = fields.CharField(required=True, max_length=128)
+    region = fields.CharField(required=False, max_length=32)
+
+    def clean_region(self):
+        region = self.cleaned_data['region'] or DEFAULT_REGION
+        if region not in settings.EC2_ENABLED_REGIONS:
+            raise ValidationError(f'The region {region} is not enabled', code='invalid_region')
+        return region
+
+
+class EC2VMRequest(EC2VMCredentials):
+    """
+    Requests are made either with the credentials or with the token of a session opened with them, see EC2SessionView.
+    The credentials of the session are resolved here so the views get them the same way.
+    """
+    client_id = fields.CharField(required=False, max_length=128)
+    client_secret = fields.CharField(required=False, max_length=128)
+    session = fields.CharField(required=False, max_length=128)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('session'):
+            credentials = AmazonService.resolve_session(cleaned_data['session'])
+            if credentials is None:
+                raise ValidationError({'session': ValidationError('The session expired or it was revoked',
+                                                                  code=SESSION_EXPIRED)})
+            cleaned_data['client_id'], cleaned_data['client_secret'] = credentials
+        elif not cleaned_data.get('client_id') or not cleaned_data.get('client_secret'):
+            raise ValidationError('Either the session or the client id and secret are required', code='required')
+        return cleaned_data
+
+
+class EC2SessionToken(Form):
+    session = fields.CharField(required=True, max_length=128)
+
+
+class EC2VMLaunchRequest(EC2VMRequest):
+    count = fields.IntegerField(required=False, min_value=1, max_value=MAX_LAUNCH_COUNT)
+    instance_type = fields.RegexField(INSTANCE_TYPE_PATTERN, required=False, max_length=32)
+    idempotency_key = fields.CharField(required=False, max_length=255)
 
 
 class EC2VMStatus(EC2VMRequest):
     instance_id = fields.CharField(required=True, max_length=128)
 
 
+class EC2VMStatusStream(EC2VMStatus):
+    target_state = fields.ChoiceField(required=False, choices=[(state, state) for state in INSTANCE_STATES])
+
+
+class EC2VMStatusWait(EC2VMStatusStream):
+    timeout = fields.IntegerField(required=False, min_value=0)
+
+
+class InstanceIdsField(fields.Field):
+    """
+    List of instance ids, given either as a JSON list or as a comma separated string. Duplicates are dropped.
+    """
+    widget = MultipleHiddenInput
+
+    def __init__(self, max_ids=MAX_BATCH_INSTANCE_IDS, **kwargs):
+        self.max_ids = max_ids
+        super().__init__(**kwargs)
+
+    def to_python(self, value):
+        if not value:
+            return []
+        if isinstance(value, str):
+            value = value.split(',')
+        if not isinstance(value, (list, tuple)):
+            raise ValidationError('Must be a list of instance ids', code='invalid')
+
+        instance_ids = [str(instance_id).strip() for instance_id in value if str(instance_id).strip()]
+        if any(len(instance_id) > 128 for instance_id in instance_ids):
+            raise ValidationError('Instance ids have at most 128 characters', code='max_length')
+        return list(dict.fromkeys(instance_ids))
+
+    def validate(self, value):
+        super().validate(value)
+        if len(value) > self.max_ids:
+            raise ValidationError(f'At most {self.max_ids} instance ids can be given at once', code='max_ids')
+
+
+class EC2VMBatchStatus(EC2VMRequest):
+    instance_ids = InstanceIdsField(required=True)
+
+
+class InstanceTypesField(fields.Field):
+    """
+    List of instance types, given either as a JSON list or as a comma separated string
+    """
+    widget = MultipleHiddenInput
+
+    def to_python(self, value):
+        if not value:
+            return []
+        if isinstance(value, str):
+            value = value.split(',')
+        if not isinstance(value, (list, tuple)):
+            raise ValidationError('Must be a list of instance types', code='invalid')
+
+        instance_types = [str(instance_type).strip() for instance_type in value if str(instance_type).strip()]
+        if not all(INSTANCE_TYPE_PATTERN.match(instance_type) for instance_type in instance_types):
+            raise ValidationError('Instance types look like t2.micro', code='invalid')
+        return list(dict.fromkeys(instance_types))
+
+
+class TagsField(fields.Field):
+    """
+    Tags the instances must have, given either as a JSON object or as a list of key=value strings
+    """
+    widget = MultipleHiddenInput
+
+    def to_python(self, value):
+        if not value:
+            return {}
+        if isinstance(value, str):
+            value = [value]
+        if isinstance(value, (list, tuple)):
+            if not all(isinstance(tag, str) and '=' in tag for tag in value):
+                raise ValidationError('Tags must be given as key=value', code='invalid')
+            value = dict(tag.split('=', 1) for tag in value)
+        if not isinstance(value, dict):
+            raise ValidationError('Must be an object of tag keys and values', code='invalid')
+        return {str(key): str(tag_value) for key, tag_value in value.items()}
+
+
+class EC2VMInventory(EC2VMRequest):
+    states = fields.MultipleChoiceField(required=False, widget=MultipleHiddenInput,
+                                        choices=[(state, state) for state in INSTANCE_STATES])
+    instance_types = InstanceTypesField(required=False)
+    tags = TagsField(required=False)
+
+
+class EC2VMIndexedList(EC2VMRequest):
+    states = fields.MultipleChoiceField(required=False, widget=MultipleHiddenInput,
+                                        choices=[(state, state) for state in INSTANCE_STATES])
+    instance_types = InstanceTypesField(required=False)
+    instance_ids = InstanceIdsField(required=False)
+
+
+class EC2VMLocate(EC2VMRequest):
+    regions = fields.MultipleChoiceField(required=False, widget=MultipleHiddenInput)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['regions'].choices = [(region, region) for region in settings.EC2_ENABLED_REGIONS]
+
+
+class EC2SessionView(APIView):
+    """
+    Opens a session out of the credentials, POST, or revokes it, DELETE
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request):
+        request_form = EC2VMCredentials(request.data)
+        if not request_form.is_valid():
+            return invalid_form_response(request_form)
+
+        client_id = request_form.cleaned_data['client_id']
+        client_secret = request_form.cleaned_data['client_secret']
+        region = request_form.cleaned_data['region']
+
+        try:
+            data = run_bounded(AmazonService.open_session, client_id, client_secret, region)
+            return Response(data, status=status.HTTP_201_CREATED)
+
+        except AWSException as aws_e:
+            return error_response(aws_e)
+        except Exception as e:
+            return Response(data=str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def delete(self, request):
+        request_form = EC2SessionToken(request.data)
+        if not request_form.is_valid():
+            return invalid_form_response(request_form)
+
+        AmazonService.close_session(request_form.cleaned_data['session'])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 class EC2StopInstanceView(APIView):
     authentication_classes = []
     permission_classes = []
@@ -26,64 +238,340 @@ class EC2StopInstanceView(APIView):
     def post(self, request):
         request_form = EC2VMStatus(request.data)
         if not request_form.is_valid():
-            return Response(data=request_form.errors, status=status.HTTP_400_BAD_REQUEST)
+            return invalid_form_response(request_form)
 
         client_id = request_form.cleaned_data['client_id']
         client_secret = request_form.cleaned_data['client_secret']
         instance_id = request_form.cleaned_data['instance_id']
+        region = request_form.cleaned_data['region']
 
         try:
-            data = AmazonService.stop_instance(instance_id, client_id, client_secret)
+            data = run_bounded(AmazonService.stop_instance, instance_id, client_id, client_secret, region)
 
             return Response(data)
 
         except AWSException as aws_e:
-            return Response(data=str(aws_e), status=aws_e.status)
+            return error_response(aws_e)
         except Exception as e:
             return Response(data=str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 class EC2CheckStatusView(APIView):
+    """
+    Status of an instance. Given a timeout, the request waits until the status changes, unless it is already
+    target_state, so clients learn about transitions with a single round trip
+    """
     authentication_classes = []
     permission_classes = []
 
     def post(self, request):
-        request_form = EC2VMStatus(request.data)
+        request_form = EC2VMStatusWait(request.data)
         if not request_form.is_valid():
-            return Response(data=request_form.errors, status=status.HTTP_400_BAD_REQUEST)
+            return invalid_form_response(request_form)
 
         client_id = request_form.cleaned_data['client_id']
         client_secret = request_form.cleaned_data['client_secret']
         instance_id = request_form.cleaned_data['instance_id']
+        region = request_form.cleaned_data['region']
+        target_state = request_form.cleaned_data['target_state'] or None
+        timeout = request_form.cleaned_data['timeout']
+
+        try:
+            if timeout:
+                # Long polling, the request thread waits on the state poller without holding a worker of the request
+                # executor, it holds a slot of the streams limit instead
+                with get_stream_limit().hold():
+                    data = AmazonService.wait_for_instance_status(instance_id, client_id, client_secret,
+                                                                  target_state, timeout, region)
+            else:
+                data = run_bounded(AmazonService.get_instance_status, instance_id, client_id, client_secret, region)
+
+            return Response(data)
+
+        except AWSException as aws_e:
+            return error_response(aws_e)
+        except Exception as e:
+            return Response(data=str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class EC2StatusStreamView(APIView):
+    """
+    Keeps the connection open and pushes the status of the instance as server-sent events, only when it changes
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request):
+        request_form = EC2VMStatusStream(request.data)
+        if not request_form.is_valid():
+            return invalid_form_response(request_form)
+
+        client_id = request_form.cleaned_data['client_id']
+        client_secret = request_form.cleaned_data['client_secret']
+        instance_id = request_form.cleaned_data['instance_id']
+        target_state = request_form.cleaned_data['target_state'] or None
+        region = request_form.cleaned_data['region']
+
+        stream_limit = get_stream_limit()
+        try:
+            stream_limit.acquire()
+        except AWSException as aws_e:
+            return error_response(aws_e)
+
+        try:
+            changes = AmazonService.watch_instance_status(instance_id, client_id, client_secret, target_state, region)
+
+        except AWSException as aws_e:
+            stream_limit.release()
+            return error_response(aws_e)
+        except Exception as e:
+            stream_limit.release()
+            return Response(data=str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        response = StreamingHttpResponse(stream_limit.stream(self._event_stream(changes)),
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Disables response buffering on nginx so events are delivered as soon as they are written
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @staticmethod
+    def _event_stream(changes):
+        last_write = time.monotonic()
+        try:
+            for instance_status in changes:
+                if instance_status is not None:
+                    yield f'event: status\ndata: {json.dumps(instance_status)}\n\n'
+                    last_write = time.monotonic()
+                elif time.monotonic() - last_write >= settings.EC2_STATUS_STREAM_HEARTBEAT:
+                    yield ': keep-alive\n\n'
+                    last_write = time.monotonic()
+
+        except AWSException as aws_e:
+            yield f'event: error\ndata: {json.dumps({"message": str(aws_e), "status": aws_e.status})}\n\n'
+        except Exception as e:
+            logger.exception('Error streaming the instance status')
+            data = {"message": str(e), "status": status.HTTP_500_INTERNAL_SERVER_ERROR}
+            yield f'event: error\ndata: {json.dumps(data)}\n\n'
+
+
+class EC2BatchCheckStatusView(APIView):
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request):
+        request_form = EC2VMBatchStatus(request.data)
+        if not request_form.is_valid():
+            return invalid_form_response(request_form)
+
+        client_id = request_form.cleaned_data['client_id']
+        client_secret = request_form.cleaned_data['client_secret']
+        instance_ids = request_form.cleaned_data['instance_ids']
+        region = request_form.cleaned_data['region']
+
+        try:
+            data = run_bounded(AmazonService.get_instances_status, instance_ids, client_id, client_secret, region)
+
+            return Response(data)
+
+        except AWSException as aws_e:
+            return error_response(aws_e)
+        except Exception as e:
+            return Response(data=str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class EC2BulkStateView(APIView):
+    """
+    Starts, stops or terminates many instances at once, the action is given in the URL. Answers the state transition
+    of every instance and the errors of the ones that could not change state.
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request, action):
+        request_form = EC2VMBatchStatus(request.data)
+        if not request_form.is_valid():
+            return invalid_form_response(request_form)
+
+        client_id = request_form.cleaned_data['client_id']
+        client_secret = request_form.cleaned_data['client_secret']
+        instance_ids = request_form.cleaned_data['instance_ids']
+        region = request_form.cleaned_data['region']
 
         try:
-            data = AmazonService.get_instance_status(instance_id, client_id, client_secret)
+            data = run_bounded(AmazonService.change_instances_state, action, instance_ids, client_id, client_secret,
+                               region)
 
             return Response(data)
 
         except AWSException as aws_e:
-            return Response(data=str(aws_e), status=aws_e.status)
+            return error_response(aws_e)
         except Exception as e:
             return Response(data=str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 class EC2CreateVMView(APIView):
+    """
+    Queues a launch job. The idempotency key can be given in the body or in the Idempotency-Key header
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request):
+        data = request.data.copy()
+        if request.META.get('HTTP_IDEMPOTENCY_KEY') and not data.get('idempotency_key'):
+            data['idempotency_key'] = request.META['HTTP_IDEMPOTENCY_KEY']
+        request_form = EC2VMLaunchRequest(data)
+        if not request_form.is_valid():
+            return invalid_form_response(request_form)
+
+        client_id = request_form.cleaned_data['client_id']
+        client_secret = request_form.cleaned_data['client_secret']
+        count = request_form.cleaned_data['count'] or 1
+        instance_type = request_form.cleaned_data['instance_type'] or DEFAULT_INSTANCE_TYPE
+        region = request_form.cleaned_data['region']
+        idempotency_key = request_form.cleaned_data['idempotency_key'] or None
+
+        try:
+            data = run_bounded(AmazonService.launch_vm, client_id, client_secret, count, instance_type, region,
+                               idempotency_key)
+            return Response(data, status=status.HTTP_202_ACCEPTED)
+
+        except AWSException as aws_e:
+            return error_response(aws_e)
+        except Exception as e:
+            return Response(data=str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class EC2LaunchJobView(APIView):
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request, job_id):
+        try:
+            data = AmazonService.get_launch_job(job_id)
+            return Response(data)
+
+        except AWSException as aws_e:
+            return error_response(aws_e)
+        except Exception as e:
+            return Response(data=str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class EC2LocateView(APIView):
+    """
+    Looks for the instances launched by the launchpad in every enabled region, or in the given ones
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request):
+        request_form = EC2VMLocate(request.data)
+        if not request_form.is_valid():
+            return invalid_form_response(request_form)
+
+        client_id = request_form.cleaned_data['client_id']
+        client_secret = request_form.cleaned_data['client_secret']
+        regions = request_form.cleaned_data['regions'] or None
+
+        try:
+            data = run_bounded(AmazonService.find_launchpad_instances, client_id, client_secret, regions)
+            return Response(data)
+
+        except AWSException as aws_e:
+            return error_response(aws_e)
+        except Exception as e:
+            return Response(data=str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class EC2InventoryView(APIView):
+    """
+    Streams the instances of the region as newline delimited JSON, one instance per line, as the pages arrive from AWS
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request):
+        request_form = EC2VMInventory(request.data)
+        if not request_form.is_valid():
+            return invalid_form_response(request_form)
+
+        client_id = request_form.cleaned_data['client_id']
+        client_secret = request_form.cleaned_data['client_secret']
+        region = request_form.cleaned_data['region']
+
+        stream_limit = get_stream_limit()
+        try:
+            stream_limit.acquire()
+        except AWSException as aws_e:
+            return error_response(aws_e)
+
+        try:
+            instances = AmazonService.list_instances(client_id, client_secret,
+                                                     states=request_form.cleaned_data['states'],
+                                                     instance_types=request_form.cleaned_data['instance_types'],
+                                                     tags=request_form.cleaned_data['tags'],
+                                                     region_name=region)
+
+        except AWSException as aws_e:
+            stream_limit.release()
+            return error_response(aws_e)
+        except Exception as e:
+            stream_limit.release()
+            return Response(data=str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        response = StreamingHttpResponse(stream_limit.stream(self._ndjson_stream(instances)),
+                                         content_type='application/x-ndjson')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @staticmethod
+    def _ndjson_stream(instances):
+        """
+        One line per instance. The last line tells whether the listing is complete, so a truncated stream can be told
+        apart from a short one: {"Count": n} or {"Count": n, "Error": {"message", "status"}}
+        """
+        count = 0
+        try:
+            for instance in instances:
+                count += 1
+                yield json.dumps(instance) + '\n'
+            yield json.dumps({'Count': count}) + '\n'
+
+        except AWSException as aws_e:
+            yield json.dumps({'Count': count, 'Error': {'message': str(aws_e), 'status': aws_e.status}}) + '\n'
+        except Exception as e:
+            logger.exception('Error streaming the instance inventory')
+            data = {'message': str(e), 'status': status.HTTP_500_INTERNAL_SERVER_ERROR}
+            yield json.dumps({'Count': count, 'Error': data}) + '\n'
+
+
+class EC2InstancesView(APIView):
+    """
+    Lists the instances launched through the launchpad out of the local index
+    """
     authentication_classes = []
     permission_classes = []
 
     def post(self, request):
-        request_form = EC2VMRequest(request.data)
+        request_form = EC2VMIndexedList(request.data)
         if not request_form.is_valid():
-            return Response(data=request_form.errors, status=status.HTTP_400_BAD_REQUEST)
+            return invalid_form_response(request_form)
 
         client_id = request_form.cleaned_data['client_id']
         client_secret = request_form.cleaned_data['client_secret']
+        region = request_form.cleaned_data['region']
 
         try:
-            data = AmazonService.create_vm(client_id, client_secret)
+            data = run_bounded(AmazonService.list_indexed_instances, client_id, client_secret,
+                               states=request_form.cleaned_data['states'],
+                               instance_types=request_form.cleaned_data['instance_types'],
+                               instance_ids=request_form.cleaned_data['instance_ids'],
+                               region_name=region)
             return Response(data)
 
         except AWSException as aws_e:
-            return Response(data=str(aws_e), status=aws_e.status)
+            return error_response(aws_e)
         except Exception as e:
             return Response(data=str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -15,4 +15,6 @@ python /app/manage.py migrate
 EXIT_CODE=$?
 echo >&2 "Migrations applied, exit code: ${EXIT_CODE}"
 
+python /app/manage.py createcachetable
+
 exec "$@"
@@ -0,0 +1,21 @@
+"""
+gunicorn configuration of the production serving mode: a few processes, each with a pool of threads, so requests
+waiting on AWS only hold a cheap thread and the AWS work itself is bounded by the request executor (see
+core.executor). Every value can be overridden through the environment.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:7000')
+worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', min(multiprocessing.cpu_count(), 4)))
+# Requests in flight per worker, they mostly wait on AWS so they can largely outnumber the cores
+threads = int(os.environ.get('GUNICORN_THREADS', 128))
+# Connections over workers * threads wait in the listen backlog
+backlog = int(os.environ.get('GUNICORN_BACKLOG', 2048))
+# With gthread workers the timeout is the heartbeat of the worker process, not a limit on each request, so status
+# streams can stay open for minutes while a stuck worker is still restarted. Streams are capped by EC2_STREAM_LIMIT
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
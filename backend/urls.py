@@ -1,7 +1,10 @@
 from django.conf.urls import url
 from django.urls import include
 
+from core.views import MetricsView
+
 urlpatterns = [
     url(r'^api-auth/', include('rest_framework.urls')),
-    url(r'^ec2/', include(('ec2.urls', 'ec2')))
+    url(r'^ec2/', include(('ec2.urls', 'ec2'))),
+    url(r'^metrics$', MetricsView.as_view(), name='metrics'),
 ]
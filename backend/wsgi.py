@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/2.2/howto/deployment/wsgi/
 
 import os
 
-from django.core.wsgi import get_wsgi_application
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config')
+os.environ.setdefault('DJANGO_CONFIGURATION', 'Docker')
+
+from configurations.wsgi import get_wsgi_application  # noqa: E402
 
 application = get_wsgi_application()
+
+# Only the servers load this module, once per worker process, so the manage.py commands are not slowed down
+from core.transport import warm_up_worker  # noqa: E402
+
+warm_up_worker()
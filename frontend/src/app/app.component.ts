@@ -2,7 +2,7 @@ import { Component, OnInit, ViewChild } from '@angular/core';
 import { MatHorizontalStepper, MatSnackBar } from '@angular/material';
 import { FormBuilder, FormGroup, Validators } from '@angular/forms';
 import { AppService, VMStatus } from './app.service';
-import { finalize, tap } from 'rxjs/operators';
+import { finalize, switchMap, tap } from 'rxjs/operators';
 import { HttpErrorResponse } from '@angular/common/http';
 
 
@@ -78,7 +78,10 @@ export class AppComponent implements OnInit {
     if (this.isCredentialsFormValid) {
       const {clientId, clientSecret} = this.credentialsForm.getRawValue();
       this.isLoading = true;
-      this.service.createVM(clientId, clientSecret)
+      this.service.openSession(clientId, clientSecret)
+        .pipe(
+          switchMap(() => this.service.createVM())
+        )
         .subscribe(data => {
         this.instanceId = data.InstanceId;
         this.instanceType.value = data.InstanceType;
@@ -92,8 +95,7 @@ export class AppComponent implements OnInit {
   public stopServer(): void {
     if (this.isCredentialsFormValid) {
       this.isLoading = true;
-      const {clientId, clientSecret} = this.credentialsForm.getRawValue();
-      this.service.stopInstance(clientId, clientSecret, this.instanceId)
+      this.service.stopInstance(this.instanceId)
         .pipe(
           finalize(() => {
             this.startStatusPolling('stopped');
@@ -108,8 +110,7 @@ export class AppComponent implements OnInit {
 
 
   private startStatusPolling(checkStatus = 'running'): void {
-    const {clientId, clientSecret} = this.credentialsForm.getRawValue();
-    this.service.getEC2Instance(clientId, clientSecret, this.instanceId, checkStatus)
+    this.service.getEC2Instance(this.instanceId, checkStatus)
       .pipe(
         tap(() => this.isLoading = true),
         finalize(() => {
@@ -1,7 +1,7 @@
 import { Injectable } from '@angular/core';
-import { HttpClient, HttpHeaders } from '@angular/common/http';
-import { interval, Observable } from 'rxjs';
-import { switchMap, takeWhile } from 'rxjs/operators';
+import { HttpClient, HttpErrorResponse, HttpHeaders } from '@angular/common/http';
+import { defer, Observable, Subscriber, throwError, timer } from 'rxjs';
+import { catchError, exhaustMap, first, map, repeat, switchMap, takeWhile, tap } from 'rxjs/operators';
 import { environment } from '../environments/environment';
 
 export interface VMStatus {
@@ -11,6 +11,7 @@ export interface VMStatus {
   PublicIP: string;
   InstanceType: string;
   Region: string;
+  Age?: number;
 }
 
 export interface InstanceDetails {
@@ -19,44 +20,192 @@ export interface InstanceDetails {
   Region: string;
 }
 
+export interface Session {
+  Session: string;
+  Account: string;
+  ExpiresAt: string;
+  Permissions: { [action: string]: boolean };
+}
+
+export interface LaunchJob {
+  JobId: string;
+  Status: 'queued' | 'running' | 'succeeded' | 'failed';
+  Steps: { Name: string, Status: string, Duration: number }[];
+  Result: InstanceDetails;
+  Error: { Message: string, Status: number };
+}
+
 @Injectable()
 export class AppService {
   private API_DOMAIN = environment.apiDomain;
+  private credentials: { client_id: string, client_secret: string } = null;
+  private session: string = null;
 
   constructor(private httpClient: HttpClient) {
   }
 
-  public stopInstance(clientId: string, clientSecret: string, instanceId: string): Observable<VMStatus> {
-    return this.httpClient.post<VMStatus>(`${ this.API_DOMAIN }/ec2/stop-instance`, {
-      client_id: clientId,
-      client_secret: clientSecret,
+  /**
+   * Validates the credentials once, the session token it returns is sent instead of them by the other calls.
+   * The credentials are kept in memory to open a new session if this one expires.
+   */
+  public openSession(clientId: string, clientSecret: string): Observable<Session> {
+    this.credentials = {client_id: clientId, client_secret: clientSecret};
+    return this.renewSession();
+  }
+
+  public stopInstance(instanceId: string): Observable<VMStatus> {
+    return this.withSession(session => this.httpClient.post<VMStatus>(`${ this.API_DOMAIN }/ec2/stop-instance`, {
+      session,
       instance_id: instanceId
-    });
+    }));
   }
 
-  public createVM(clientId: string, clientSecret: string): Observable<InstanceDetails> {
+  public createVM(): Observable<InstanceDetails> {
     const httpOptions = {
       headers: new HttpHeaders({
         'Content-Type': 'application/json',
       })
     };
 
-    return this.httpClient.post<InstanceDetails>(`${ this.API_DOMAIN }/ec2/create-vm`, {
-      client_id: clientId,
-      client_secret: clientSecret
-    }, httpOptions);
+    return this.withSession(session => this.httpClient.post<LaunchJob>(`${ this.API_DOMAIN }/ec2/create-vm`, {
+      session
+    }, httpOptions))
+      .pipe(
+        switchMap(job => this.waitForJob(job.JobId))
+      );
   }
 
+  private renewSession(): Observable<Session> {
+    return this.httpClient.post<Session>(`${ this.API_DOMAIN }/ec2/session`, this.credentials)
+      .pipe(
+        tap(session => this.session = session.Session)
+      );
+  }
 
-  public getEC2Instance(clientId: string, clientSecret: string, instanceId: string, checkStatus = 'running'): Observable<VMStatus> {
-    return interval(10000)
+  /**
+   * Makes a call with the current session. Sessions expire once they are not used for a while, if the backend
+   * answers the session expired a new one is opened and the call is retried, once.
+   */
+  private withSession<T>(call: (session: string) => Observable<T>): Observable<T> {
+    return defer(() => call(this.session))
       .pipe(
-        switchMap(() => this.httpClient.post<VMStatus>(`${ this.API_DOMAIN }/ec2/check-status`, {
-          client_id: clientId,
-          client_secret: clientSecret,
-          instance_id: instanceId
-        })),
+        catchError((error: HttpErrorResponse) => {
+          if (error.status !== 401 || !error.error || !error.error.session || !this.credentials) {
+            return throwError(error);
+          }
+          return this.renewSession()
+            .pipe(
+              switchMap(session => call(session.Session))
+            );
+        })
+      );
+  }
+
+  /**
+   * Launches run in the background on the server, follows the job until it finishes and emits its result.
+   */
+  private waitForJob(jobId: string): Observable<InstanceDetails> {
+    return timer(0, 1000)
+      .pipe(
+        exhaustMap(() => this.httpClient.get<LaunchJob>(`${ this.API_DOMAIN }/ec2/jobs/${ jobId }`)),
+        first(job => job.Status === 'succeeded' || job.Status === 'failed'),
+        map(job => {
+          if (job.Status === 'failed') {
+            throw new HttpErrorResponse({error: job.Error.Message, status: job.Error.Status});
+          }
+          return job.Result;
+        })
+      );
+  }
+
+
+  public getEC2Instance(instanceId: string, checkStatus = 'running'): Observable<VMStatus> {
+    return this.withSession(session => this.streamStatus({
+      session,
+      instance_id: instanceId,
+      target_state: checkStatus
+    }))
+      .pipe(
+        // The server closes the stream after a while, open a new one until the expected status is reached
+        repeat(),
         takeWhile(res => res.Raw !== checkStatus, true)
       );
   }
+
+  /**
+   * Opens the status stream of an instance. The backend pushes server-sent events only when the status changes,
+   * fetch is used instead of EventSource because the session is sent in the body of a POST request.
+   */
+  private streamStatus(body: object): Observable<VMStatus> {
+    return new Observable<VMStatus>(subscriber => {
+      const controller = new AbortController();
+
+      fetch(`${ this.API_DOMAIN }/ec2/status-stream`, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify(body),
+        signal: controller.signal
+      })
+        .then(response => {
+          if (!response.ok) {
+            return response.json()
+              .then(error => subscriber.error(new HttpErrorResponse({
+                error,
+                status: response.status,
+                statusText: response.statusText
+              })));
+          }
+          return this.readEvents(response.body.getReader(), subscriber);
+        })
+        .catch(error => {
+          if (error.name !== 'AbortError') {
+            subscriber.error(new HttpErrorResponse({error: error.message, status: 0}));
+          }
+        });
+
+      return () => controller.abort();
+    });
+  }
+
+  private readEvents(reader: ReadableStreamDefaultReader, subscriber: Subscriber<VMStatus>): Promise<void> {
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    const read = (): Promise<void> => reader.read().then(({done, value}) => {
+      if (done) {
+        subscriber.complete();
+        return;
+      }
+
+      buffer += decoder.decode(value, {stream: true});
+      const events = buffer.split('\n\n');
+      buffer = events.pop();
+      events.forEach(event => this.dispatchEvent(event, subscriber));
+      return read();
+    });
+
+    return read();
+  }
+
+  private dispatchEvent(rawEvent: string, subscriber: Subscriber<VMStatus>): void {
+    let name = 'message';
+    let data = '';
+    rawEvent.split('\n').forEach(line => {
+      if (line.startsWith('event:')) {
+        name = line.slice(6).trim();
+      } else if (line.startsWith('data:')) {
+        data += line.slice(5).trim();
+      }
+    });
+
+    if (!data) {
+      return;
+    }
+    if (name === 'error') {
+      const {message, status} = JSON.parse(data);
+      subscriber.error(new HttpErrorResponse({error: message, status}));
+    } else {
+      subscriber.next(JSON.parse(data));
+    }
+  }
 }